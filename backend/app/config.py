@@ -0,0 +1,160 @@
+import os
+import socket
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Shared package caches mounted into every clone's installs
+PACKAGE_CACHE_DIR = os.getenv("PACKAGE_CACHE_DIR", "/tmp/reporefine_cache")
+# Optional pre-built virtual environment copied (reflinked where supported) into new .venv dirs
+BASE_VENV_TEMPLATE = os.getenv("BASE_VENV_TEMPLATE")
+# Offline mode: installs only use the shared caches and LOCAL_PACKAGE_INDEX
+PACKAGE_INDEX_OFFLINE = _env_bool("PACKAGE_INDEX_OFFLINE")
+LOCAL_PACKAGE_INDEX = os.getenv("LOCAL_PACKAGE_INDEX")
+
+# Execution pool for commands run inside clones
+EXEC_MAX_CONCURRENT = int(os.getenv("EXEC_MAX_CONCURRENT", str(os.cpu_count() or 2)))
+EXEC_CPU_SECONDS = int(os.getenv("EXEC_CPU_SECONDS", "120"))
+# Limits writable memory (RLIMIT_DATA) rather than address space, because
+# runtimes like node reserve large virtual ranges they never touch.
+EXEC_MEMORY_BYTES = int(os.getenv("EXEC_MEMORY_BYTES", str(2 * 1024 ** 3)))
+EXEC_FILE_SIZE_BYTES = int(os.getenv("EXEC_FILE_SIZE_BYTES", str(512 * 1024 ** 2)))
+# Processes and threads one command may have at once. Enforced with a cgroup per command
+# (pids.max) under EXEC_CGROUP_ROOT, a cgroup directory the server may create children in;
+# without one, RLIMIT_NPROC gives each command this much headroom over the server's user.
+EXEC_MAX_PROCESSES = int(os.getenv("EXEC_MAX_PROCESSES", "256"))
+EXEC_CGROUP_ROOT = os.getenv("EXEC_CGROUP_ROOT", "")
+
+# Clone storage
+# Local bare mirrors, one per repository, refreshed with fetch and shared by clones
+MIRROR_CACHE_DIR = os.getenv("MIRROR_CACHE_DIR", "/tmp/reporefine_mirrors")
+# "reference" (shared clone of the local mirror), "shallow" (depth 1),
+# "blobless" (partial clone, blobs fetched on demand) or "full"
+CLONE_MODE = os.getenv("CLONE_MODE", "reference").lower()
+
+# Session expiry and clone eviction
+# Sessions expire after this long without activity...
+SESSION_IDLE_TTL_SECONDS = int(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+# ...and never live longer than this, however active
+SESSION_MAX_LIFETIME_SECONDS = int(os.getenv("SESSION_MAX_LIFETIME_SECONDS", str(24 * 3600)))
+CLEANUP_INTERVAL_SECONDS = int(os.getenv("CLEANUP_INTERVAL_SECONDS", "900"))
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "100"))
+# Total size clones may take up before the least recently used are evicted (0 disables)
+CLONE_DISK_BUDGET_BYTES = int(os.getenv("CLONE_DISK_BUDGET_BYTES", str(20 * 1024 ** 3)))
+# Evict clones whenever free space on the clone filesystem drops below this
+CLONE_MIN_FREE_BYTES = int(os.getenv("CLONE_MIN_FREE_BYTES", str(1024 ** 3)))
+CLONE_ROOT_DIR = os.getenv("CLONE_ROOT_DIR", "/tmp")
+# Sessions used more recently than this are never evicted for disk space
+EVICTION_GRACE_SECONDS = int(os.getenv("EVICTION_GRACE_SECONDS", "300"))
+
+# Disk quota and deduplication
+# Total disk a user's clones (with .venv and node_modules) may use (0 disables)
+USER_DISK_QUOTA_BYTES = int(os.getenv("USER_DISK_QUOTA_BYTES", str(5 * 1024 ** 3)))
+DEDUP_MIN_FILE_BYTES = int(os.getenv("DEDUP_MIN_FILE_BYTES", "4096"))
+# Space an install is expected to take; it is refused if that would exceed the quota
+INSTALL_QUOTA_RESERVE_BYTES = int(os.getenv("INSTALL_QUOTA_RESERVE_BYTES", str(256 * 1024 ** 2)))
+# Usage is updated incrementally from changed directories; a full rescan catches files grown in place
+DISK_FULL_RESCAN_SECONDS = int(os.getenv("DISK_FULL_RESCAN_SECONDS", "900"))
+
+# Warm pool of pre-cloned sessions for each user's recently opened repositories
+# Repositories kept warm per user (0 disables the pool)
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))
+# Upper bound on warm clones across all users
+WARM_POOL_MAX_SESSIONS = int(os.getenv("WARM_POOL_MAX_SESSIONS", "50"))
+WARM_POOL_REFRESH_SECONDS = int(os.getenv("WARM_POOL_REFRESH_SECONDS", "600"))
+# Only repositories opened within this window are kept warm
+WARM_POOL_LOOKBACK_DAYS = int(os.getenv("WARM_POOL_LOOKBACK_DAYS", "7"))
+
+# Token budgets (0 disables). A run stops once it has used RUN_TOKEN_BUDGET tokens;
+# a user cannot use more than USER_TOKEN_BUDGET tokens per USER_TOKEN_BUDGET_WINDOW_HOURS.
+RUN_TOKEN_BUDGET = int(os.getenv("RUN_TOKEN_BUDGET", "0"))
+USER_TOKEN_BUDGET = int(os.getenv("USER_TOKEN_BUDGET", "0"))
+USER_TOKEN_BUDGET_WINDOW_HOURS = int(os.getenv("USER_TOKEN_BUDGET_WINDOW_HOURS", "24"))
+# USD per million tokens, for cost estimates ("input,cached,output")
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gemini-2.0-flash-001")
+MODEL_PRICE_PER_MILLION = tuple(
+    float(price) for price in os.getenv("MODEL_PRICE_PER_MILLION", "0.10,0.025,0.40").split(",")
+)
+
+# Model backend: "gemini" (the real API), "fake" (a local scripted server for load tests)
+# or "replay" (responses recorded in a cassette, see MODEL_RECORD_DIR)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "gemini").lower()
+FAKE_MODEL_URL = os.getenv("FAKE_MODEL_URL", "http://127.0.0.1:8089")
+FAKE_MODEL_TIMEOUT_SECONDS = float(os.getenv("FAKE_MODEL_TIMEOUT_SECONDS", "60"))
+# Record every run's model requests and responses to <dir>/<review_id>.jsonl.gz (off when unset)
+MODEL_RECORD_DIR = os.getenv("MODEL_RECORD_DIR", "")
+# MODEL_BACKEND=replay serves the responses recorded in this cassette, in order
+MODEL_REPLAY_CASSETTE = os.getenv("MODEL_REPLAY_CASSETTE", "")
+# Fail a replayed call whose request differs from the recorded one (default: only the
+# sequence of roles and tool calls must match; tool output such as timings may differ)
+MODEL_REPLAY_STRICT = _env_bool("MODEL_REPLAY_STRICT")
+
+# Answers to read-only prompts, reused when the same prompt is sent on the same repository
+# state (see app/services/response_cache.py). Off unless the TTL is set.
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "0"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "500"))
+
+# Message cache. Set REDIS_URL=none to run without Redis (history then comes from the database).
+REDIS_URL = os.getenv(
+    "REDIS_URL",
+    f"redis://{os.getenv('REDIS_HOST', 'localhost')}:{os.getenv('REDIS_PORT', '6379')}"
+)
+
+# Database connection pool. Each agent run in progress holds one connection until it
+# finishes, so size + overflow caps concurrent runs per process.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# Multi-node deployment. Clones and in-process state live on the node that created the
+# session; with NODE_URL set (how other nodes reach this one, e.g. http://10.0.0.5:8001),
+# requests for another node's sessions are forwarded there. Give every worker process its
+# own NODE_ID and port. Without NODE_URL everything is handled locally.
+NODE_URL = os.getenv("NODE_URL", "").rstrip("/")
+NODE_ID = os.getenv("NODE_ID") or (NODE_URL.split("://", 1)[-1] if NODE_URL else socket.gethostname())
+NODE_HEARTBEAT_SECONDS = int(os.getenv("NODE_HEARTBEAT_SECONDS", "10"))
+# A node without a heartbeat for this long is treated as down
+NODE_TTL_SECONDS = int(os.getenv("NODE_TTL_SECONDS", "30"))
+
+
+def _env_map(name: str, cast=str) -> dict:
+    """Parse "key=value,key=value" into a dict."""
+    pairs = (item.split("=", 1) for item in os.getenv(name, "").split(",") if "=" in item)
+    return {key.strip(): cast(value.strip()) for key, value in pairs}
+
+
+# Agent run admission. At most RUN_MAX_CONCURRENT runs execute at once and at most
+# RUN_MAX_PER_USER per user; the others wait, and users take turns in proportion to their
+# weight. Prompts beyond the queue limits are refused with a retry-after hint. 0 disables a limit.
+RUN_MAX_CONCURRENT = int(os.getenv("RUN_MAX_CONCURRENT", "16"))
+RUN_MAX_PER_USER = int(os.getenv("RUN_MAX_PER_USER", "2"))
+RUN_MAX_QUEUED = int(os.getenv("RUN_MAX_QUEUED", "100"))
+RUN_MAX_QUEUED_PER_USER = int(os.getenv("RUN_MAX_QUEUED_PER_USER", "5"))
+# By user id, e.g. RUN_USER_WEIGHTS=42=2 gives user 42 twice the default share of 1
+RUN_USER_WEIGHTS = _env_map("RUN_USER_WEIGHTS", float)
+
+# Event log. Records are formatted and written by a background thread; the request path
+# only enqueues them, and drops them when the queue is full rather than wait.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json or text
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Per-event overrides, e.g. LOG_EVENT_LEVELS=ws.update_sent=info,clone.completed=debug
+LOG_EVENT_LEVELS = _env_map("LOG_EVENT_LEVELS", str.upper)
+# Fraction of an event's records to keep, e.g. LOG_SAMPLE_RATES=ws.update_sent=0.01
+LOG_SAMPLE_RATES = _env_map("LOG_SAMPLE_RATES", float)
+
+# Tracing. Spans go to a background exporter: "file" appends OTLP/JSON lines to TRACE_FILE,
+# "otlp" posts OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT (a collector), "none" keeps only propagation.
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "reporefine-backend")
+# Fraction of new traces recorded; traces started upstream follow the caller's sampled flag
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
@@ -3,18 +3,43 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+import threading
 from typing import Annotated
 from sqlalchemy.orm import Session
 from fastapi import Depends
 import redis
+from app.config import DB_MAX_OVERFLOW, DB_POOL_SIZE, REDIS_URL
 
 load_dotenv()
 
-engine = create_engine(os.getenv("DATABASE_URL"))
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process's engine, created on first use so importing the app needs no database."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(os.getenv("DATABASE_URL"), pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return _engine
+
+
+class _LazyEngineSession(Session):
+    def get_bind(self, *args, **kwargs):
+        return get_engine()
+
+
+SessionLocal = sessionmaker(class_=_LazyEngineSession, autocommit=False, autoflush=False)
 Base = declarative_base()
-from app.models import User, Session as SessionModel, Message as MessageModel, Review as ReviewModel
-Base.metadata.create_all(bind=engine)
+
+
+def init_db():
+    """Create missing tables. Run once at startup (the app lifespan), not on import."""
+    from app.models import User, Session as SessionModel, Message as MessageModel, Review as ReviewModel, RepoHistory, TokenUsage, Node  # noqa: F401
+    Base.metadata.create_all(bind=get_engine())
+
 def get_db():
     db = SessionLocal()
     try:
@@ -23,7 +48,11 @@ def get_db():
         db.close()
 
 def get_redis():
-    r = redis.Redis(host='localhost', port=6379, decode_responses=True)
+    # REDIS_URL=none runs without the cache; callers fall back to the database
+    if REDIS_URL.lower() in ("", "none"):
+        yield None
+        return
+    r = redis.Redis.from_url(REDIS_URL, decode_responses=True)
     try:
         yield r
     finally:
@@ -1,48 +1,102 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routers.auth import auth_router
 from app.routers.user import user_router
 from app.routers.agent import agent_router
-from app.database import get_redis
+from app.database import get_redis, init_db
 from app.redis_schema import create_messages_index
-from app.utils.file_cleanup import cleanup_expired_sessions
+from app.utils.file_cleanup import run_cleanup
+from app.config import CLEANUP_INTERVAL_SECONDS, NODE_ID
+from app.services.warm_pool import periodic_fill
+from app.services.agent_service import warm_up
+from app.services.clone_service import fail_interrupted_clones
+from app.services.cluster import (
+    CLUSTER_ENABLED, FORWARDED_HEADER, NODE_HEADER, close_http_client, deregister_node, forward_request,
+    owned_key, periodic_heartbeat, register_node, route_request
+)
+from app.utils.metrics import HTTP_REQUEST_SECONDS, NODE_FORWARDS, render_metrics
+from app.utils.event_log import log_event, setup_logging, shutdown_logging
+from app.utils.tracing import begin_span, flush_spans, parse_traceparent
 import asyncio
+import time
 from contextlib import asynccontextmanager
 
 async def periodic_cleanup():
-    """Background task to clean up expired sessions every 15 minutes."""
+    """Background task to clean up expired sessions and evict clones for disk space."""
     while True:
         try:
-            await asyncio.sleep(900)  # 15 minutes
-            result = cleanup_expired_sessions()
-            if "error" not in result:
-                print(f"Cleanup: {result.get('message', 'Completed')}")
+            await asyncio.sleep(CLEANUP_INTERVAL_SECONDS)
+            # Deleting clones is slow filesystem work; keep it off the event loop
+            result = await asyncio.to_thread(run_cleanup)
+            for name, outcome in result.items():
+                if "error" in outcome:
+                    log_event("cleanup.failed", level="error", task=name, error=outcome["error"])
+                else:
+                    log_event("cleanup.completed", task=name, message=outcome.get("message", "Completed"))
         except Exception as e:
-            print(f"Error in periodic cleanup: {e}")
+            log_event("cleanup.failed", level="error", exc_info=True, error=str(e))
+
+async def warm_up_agent():
+    """Load the model SDK and client in the background, so startup does not wait for them."""
+    started_at = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up)
+        log_event("startup.agent_warmed", seconds=round(time.perf_counter() - started_at, 3))
+    except Exception as e:
+        # The first prompt retries and reports the problem to the user
+        log_event("startup.agent_warm_failed", level="warning", error=str(e))
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan event handler for startup and shutdown."""
     # Startup
+    setup_logging()
+    init_db()
+    if CLUSTER_ENABLED:
+        register_node()
+        log_event("node.registered", node_id=NODE_ID)
+    interrupted = fail_interrupted_clones()
+    if interrupted:
+        log_event("startup.clones_interrupted", count=interrupted)
     try:
         redis_client = next(get_redis())
-        result = create_messages_index(redis_client)
-        print(f"Redis index initialization: {result.get('message', 'Unknown')}")
-        redis_client.close()
+        if redis_client is None:
+            log_event("redis.disabled", message="Message history is served from the database")
+        else:
+            result = create_messages_index(redis_client)
+            log_event("redis.index_initialized", message=result.get("message", "Unknown"))
+            redis_client.close()
     except Exception as e:
-        print(f"Warning: Failed to initialize Redis index: {e}")
+        log_event("redis.index_failed", level="warning", error=str(e))
     
     # Start background cleanup task
     cleanup_task = asyncio.create_task(periodic_cleanup())
+    warm_pool_task = asyncio.create_task(periodic_fill())
+    warm_up_task = asyncio.create_task(warm_up_agent())
+    background_tasks = [cleanup_task, warm_pool_task, warm_up_task]
+    if CLUSTER_ENABLED:
+        background_tasks.append(asyncio.create_task(periodic_heartbeat()))
     
     yield  # App runs here
     
     # Shutdown (optional - cleanup if needed)
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+    for task in background_tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    if CLUSTER_ENABLED:
+        try:
+            await asyncio.to_thread(deregister_node)
+        except Exception as e:
+            log_event("node.deregister_failed", level="warning", error=str(e))
+        await close_http_client()
+    # Write out whatever is still queued
+    shutdown_logging()
+    flush_spans()
 
 app = FastAPI(lifespan=lifespan)
 app.add_middleware(
@@ -52,10 +106,70 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.middleware("http")
+async def route_to_owner(request: Request, call_next):
+    """
+    Forward requests for sessions, reviews and jobs held by another node to that node
+    (see app/services/cluster.py), and tag every response with the node that served it.
+    """
+    if not CLUSTER_ENABLED:
+        return await call_next(request)
+    owned = owned_key(request.url.path)
+    if owned and FORWARDED_HEADER not in request.headers:
+        where, node_url = await run_in_threadpool(route_request, *owned)
+        if where == "remote":
+            request.state.forwarded = True
+            return await forward_request(request, node_url)
+        # Deleting a session whose owner is down is handled here (see orphaned_sessions)
+        if where == "unavailable" and not (request.method == "DELETE" and owned[0] == "session"):
+            NODE_FORWARDS.inc(kind="http", outcome="unavailable")
+            return JSONResponse({"detail": "The server holding this repository is unavailable"}, status_code=503)
+    response = await call_next(request)
+    response.headers[NODE_HEADER] = NODE_ID
+    return response
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """
+    Observe request latency by route template (not raw path, to bound label cardinality),
+    in a server span that continues the caller's trace when it sends a traceparent header.
+    """
+    started_at = time.perf_counter()
+    status = 500
+    request_span = begin_span(
+        f"HTTP {request.method}", kind="server", parent=parse_traceparent(request.headers.get("traceparent")),
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = getattr(request.scope.get("route"), "path", None)
+        if route is None:
+            route = "forwarded" if getattr(request.state, "forwarded", False) else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started_at,
+            method=request.method,
+            route=route,
+            status=status
+        )
+        request_span.name = f"HTTP {request.method} {route}"
+        request_span.set_attributes(**{"http.route": route, "http.status_code": status})
+        if status >= 500:
+            request_span.set_error(f"HTTP {status}")
+        request_span.end()
+
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(agent_router)
 
 @app.get("/")
 async def root():
-    return{"message": "Hello World"}
\ No newline at end of file
+    return{"message": "Hello World"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Process metrics in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
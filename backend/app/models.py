@@ -1,8 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, LargeBinary
 from app.database import Base
 from datetime import datetime, timezone
 from sqlalchemy.orm import relationship
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, UniqueConstraint
 
 class User(Base):
     __tablename__ = "users"
@@ -26,6 +26,13 @@ class Session(Base):
     clone_path= Column(String)
     created_at= Column(DateTime, default=lambda: datetime.now(timezone.utc))
     expires_at= Column(DateTime)
+    last_activity_at= Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    status= Column(String, default="ready")  # cloning, ready, failed, or warm (pre-cloned, not yet handed out; warm_refreshing while the pool updates it)
+    status_message= Column(String, nullable=True)
+    disk_bytes= Column(BigInteger, nullable=True)  # clone size, hardlinked files split between owners
+    disk_measured_at= Column(DateTime, nullable=True)
+    total_tokens= Column(Integer, default=0)  # model tokens used by all runs in the session
+    node_id= Column(String, nullable=True, index=True)  # the node holding the clone (see app/services/cluster.py)
     user= relationship("User", back_populates="sessions")
     messages = relationship("Message", back_populates="session")
     reviews = relationship("Review", back_populates="session")
@@ -48,11 +55,56 @@ class Review(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     prompt = Column(Text)  
     changes = Column(Text)  
+    diff_patch = Column(LargeBinary, nullable=True)  # zlib-compressed patch against the checkpoint
+    diff_files = Column(Text, nullable=True)  # JSON per-file stats and offsets into the patch
+    diff_digest = Column(String, nullable=True)
     checkpoint_commit_hash = Column(String)  
+    step_checkpoints = Column(Text, nullable=True)  # JSON list of per-iteration snapshot commits
     status = Column(String, default="pending_review")  
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     approved_at = Column(DateTime, nullable=True)
     rejected_at = Column(DateTime, nullable=True)
     commit_message = Column(String, nullable=True)  
     branch_name = Column(String, nullable=True)  
+    prompt_tokens = Column(Integer, default=0)  # totals over the run's model calls
+    cached_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    total_tokens = Column(Integer, default=0)
     session = relationship("Session", back_populates="reviews")
+
+
+class RepoHistory(Base):
+    __tablename__ = "repo_history"
+    __table_args__ = (UniqueConstraint("user_id", "repo_url"),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    repo_id = Column(Integer)
+    repo_name = Column(String)
+    repo_url = Column(String)
+    open_count = Column(Integer, default=0)
+    last_opened_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class TokenUsage(Base):
+    """Tokens used by one model call. Kept after its session is cleaned up, for per-user totals."""
+    __tablename__ = "token_usage"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    session_id = Column(String, ForeignKey("sessions.id", ondelete="SET NULL"), nullable=True, index=True)
+    review_id = Column(String, ForeignKey("reviews.id", ondelete="SET NULL"), nullable=True, index=True)
+    iteration = Column(Integer)
+    model = Column(String)
+    prompt_tokens = Column(Integer, default=0)  # includes cached_tokens
+    cached_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)  # candidates plus thinking tokens
+    total_tokens = Column(Integer, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+
+class Node(Base):
+    """A backend node (worker process) that holds clones. Others forward its sessions' requests to url."""
+    __tablename__ = "nodes"
+    id = Column(String, primary_key=True)
+    url = Column(String)
+    started_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    heartbeat_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), index=True)
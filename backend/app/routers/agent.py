@@ -1,4 +1,4 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Header, HTTPException, Request, Response, Query
 from app.services.agent_service import GeminiAgentService
 from app.database import db_dependency, redis_dependency
 from app.models import Session as SessionModel
@@ -9,13 +9,27 @@ import json
 import os
 from app.models import Review as ReviewModel
 from app.models import User as UserModel
-from app.utils.git_utils import revert_to_checkpoint, commit_changes, push_changes
+from app.utils.git_utils import revert_to_checkpoint, restore_snapshot, get_git_status
+from app.utils.event_stream import sse_response
+from app.utils.session_activity import touch_session
+from app.services.job_service import jobs, start_review_job, has_active_job, job_to_dict
+from app.utils.review_diff import build_review_diff, load_diff_files, read_file_diff
 from pydantic import BaseModel
 from datetime import datetime, timezone
+from typing import List
+import asyncio
+from app.utils.metrics import NODE_FORWARDS, WEBSOCKET_CONNECTIONS
+from app.services.cluster import FORWARDED_HEADER, owner_route, proxy_websocket
+from app.services.run_service import active_run, runs, start_run
+from app.utils.admission import AdmissionRejected
+from app.utils.token_usage import usage_totals
+from app.utils.event_log import bind_log_context, log_event
+from app.utils.tracing import parse_traceparent
 
 class ApproveReviewRequest(BaseModel):
     commit_message: str
     branch_name: str = None
+    push: bool = False
 
 
 agent_router=APIRouter(prefix="/agent",tags=["agent"])
@@ -25,26 +39,23 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
     """
     Stream agent output to the client.
     Requires JWT token in cookie (sent automatically with WebSocket connection).
+    Runs continue when the client disconnects. Connecting again with ?run_id=...&last_event_id=...
+    resumes after the last event received; without them, a run in progress is replayed from its start.
+    Only the most recent tool output lines are kept, so a replay may contain an events_truncated
+    event where older output was dropped; all other events are always replayed.
     """
     await websocket.accept()
-    print(f"WebSocket accepted for session: {session_id}")
+    # Each connection runs in its own task, so this binds the id for this connection only
+    bind_log_context(session_id=session_id)
+    log_event("ws.accepted")
+    WEBSOCKET_CONNECTIONS.inc()
     
-    from app.database import get_db, get_redis
+    from app.database import get_db
     
     db = None
-    redis = None
     
     try:
         db = next(get_db())
-        print(f"Database connection established")
-        
-        try:
-            redis = next(get_redis())
-            print(f"Redis connection established")
-        except Exception as redis_error:
-            print(f"Warning: Redis connection failed: {redis_error}")
-            # Continue without Redis - app will use PostgreSQL only
-            redis = None
         
         # Try to get token from cookies first, then fall back to query param
         token = None
@@ -54,16 +65,16 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
             token = websocket.query_params.get("token")
         
         if not token:
-            print("Error: No token provided")
+            log_event("ws.auth_failed", level="warning", reason="no token")
             await websocket.close(code=1008, reason="Authentication token required")
             return
         
         try:
             from app.middleware.auth import get_user_from_token
             current_user = get_user_from_token(token, db)
-            print(f"User authenticated: {current_user.id}")
+            bind_log_context(user_id=current_user.id)
         except HTTPException as e:
-            print(f"Authentication failed: {e.detail}")
+            log_event("ws.auth_failed", level="warning", reason=e.detail)
             await websocket.close(code=1008, reason=e.detail)
             return
         
@@ -72,27 +83,65 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
             SessionModel.user_id == current_user.id
         ).first()
         if not session:
-            print(f"Session not found: {session_id}")
+            log_event("ws.session_not_found", level="warning")
             await websocket.close(code=1008, reason="Session not found or access denied")
             return
         
-        print(f"Session validated: {session_id}")
+        if FORWARDED_HEADER not in websocket.headers:
+            where, node_url = owner_route(db, session.node_id)
+            if where == "unavailable":
+                NODE_FORWARDS.inc(kind="websocket", outcome="unavailable")
+                log_event("ws.owner_unavailable", level="warning", node_id=session.node_id)
+                await websocket.close(code=1013, reason="The server holding this repository is unavailable")
+                return
+            if where == "remote":
+                # The clone is on another node: relay to it without holding a connection here
+                log_event("ws.forwarded", node_id=session.node_id)
+                db.close()
+                db = None
+                await proxy_websocket(websocket, node_url)
+                return
+        
+        touch_session(session, db)
+        # Runs use their own connections; the websocket only relays their events
+        db.close()
+        db = None
         
         # Send initial connection confirmation
         await websocket.send_json({
             "type": "connected",
             "message": "WebSocket connection established. Ready to receive messages."
         })
-        print("Connection confirmation sent, waiting for messages...")
+        log_event("ws.connected", level="debug")
+        
+        # Resume the run the client was following, or join the session's run in progress
+        requested_run_id = websocket.query_params.get("run_id")
+        try:
+            last_event_id = int(websocket.query_params.get("last_event_id") or 0)
+        except ValueError:
+            last_event_id = 0
+        run = runs.get(requested_run_id) if requested_run_id else active_run(session_id)
+        if requested_run_id and (run is None or run["session_id"] != session_id):
+            run = None
+            await websocket.send_json({
+                "type": "error",
+                "status": "error",
+                "message": "Run not found or expired"
+            })
+        if run is not None:
+            log_event("ws.run_joined", run_id=run["id"], last_event_id=last_event_id)
+            if not await _relay_run(websocket, run, last_event_id):
+                return
         
-        agent_service=GeminiAgentService()
+        # Each prompt is its own trace, continuing the client's when it passes a traceparent
+        trace_parent = parse_traceparent(websocket.query_params.get("traceparent") or websocket.headers.get("traceparent"))
         
         # Keep connection open and handle multiple messages
         while True:
             try:
                 # Wait for client to send a message
                 data = await websocket.receive_text()
-                print(f"Message received: {data[:100]}...")
+                log_event("ws.message_received", level="debug", size=len(data))
                 request_data = json.loads(data)
                 prompt = request_data.get("prompt")
 
@@ -103,48 +152,38 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
                         "message": "Prompt is required"
                     })
                     continue  # Continue waiting for next message instead of closing
+                if active_run(session_id):
+                    await websocket.send_json({
+                        "type": "error",
+                        "status": "error",
+                        "message": "The agent is already working on this session"
+                    })
+                    continue
                 
-                print(f"Starting agent execution for prompt: {prompt[:50]}...")
+                # The run goes on in the background if this client disconnects
                 try:
-                    update_count = 0
-                    async for update in agent_service.execute(prompt, session_id, db=db, redis=redis):
-                        update_count += 1
-                        print(f"Sending update #{update_count}: {update.get('type', 'unknown')} - {update.get('status', 'no status')}")
-                        try:
-                            await websocket.send_json(update)
-                        except (WebSocketDisconnect, RuntimeError) as send_error:
-                            print(f"Error sending update to client: {send_error}")
-                            return  # Client disconnected, exit loop
-                    print(f"Agent execution completed. Total updates sent: {update_count}")
-                except HTTPException as http_error:
-                    print(f"HTTPException in agent execution: {http_error.detail}")
-                    try:
-                        await websocket.send_json({
-                            "type": "error",
-                            "status": "error",
-                            "message": http_error.detail
-                        })
-                    except (WebSocketDisconnect, RuntimeError):
-                        return  # Client disconnected, exit loop
-                except Exception as agent_error:
-                    print(f"Exception in agent execution: {type(agent_error).__name__}: {str(agent_error)}")
-                    import traceback
-                    traceback.print_exc()
-                    try:
-                        await websocket.send_json({
-                            "type": "error",
-                            "status": "error",
-                            "message": f"Agent execution failed: {str(agent_error)}"
-                        })
-                    except (WebSocketDisconnect, RuntimeError):
-                        return  # Client disconnected, exit loop
+                    # "cache": false asks for a fresh answer even when a cached one exists
+                    run = start_run(session_id, current_user.id, prompt, trace_parent,
+                                    use_cache=request_data.get("cache", True) is not False)
+                except AdmissionRejected as rejected:
+                    log_event("ws.prompt_shed", level="warning", reason=str(rejected), retry_after=rejected.retry_after)
+                    await websocket.send_json({
+                        "type": "error",
+                        "status": "error",
+                        "reason": "overloaded",
+                        "message": str(rejected),
+                        "retry_after": rejected.retry_after
+                    })
+                    continue
+                if not await _relay_run(websocket, run):
+                    return
                         
             except WebSocketDisconnect:
                 # Client disconnected normally
-                print("Client disconnected")
+                log_event("ws.disconnected", level="debug")
                 return
             except json.JSONDecodeError as json_error:
-                print(f"Invalid JSON received: {json_error}")
+                log_event("ws.invalid_json", level="warning", error=str(json_error))
                 try:
                     await websocket.send_json({
                         "type": "error",
@@ -154,19 +193,14 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
                 except (WebSocketDisconnect, RuntimeError):
                     return
             except Exception as receive_error:
-                print(f"Error receiving message: {type(receive_error).__name__}: {str(receive_error)}")
-                import traceback
-                traceback.print_exc()
+                log_event("ws.receive_failed", level="error", exc_info=True, error=f"{type(receive_error).__name__}: {receive_error}")
                 return  # Exit on unexpected errors
         
     except WebSocketDisconnect as e:
         # Client disconnected, no need to close - connection already closed
-        print(f"Client disconnected: {e}")
-        pass
+        log_event("ws.disconnected", level="debug", code=e.code)
     except Exception as e:
-        print(f"Error in WebSocket handler: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_event("ws.handler_failed", level="error", exc_info=True, error=f"{type(e).__name__}: {e}")
         try:
             # Try to send error message if connection is still open, but don't close
             await websocket.send_json({
@@ -179,12 +213,21 @@ async def stream_agent_output(websocket: WebSocket, session_id: str):
             # Connection already closed, ignore
             pass
     finally:
-        # Only close DB/Redis connections, not the WebSocket
+        # Only close the DB connection, not the WebSocket
         if db:
             db.close()
-        if redis:
-            redis.close()
-        print(f"WebSocket handler ended for session: {session_id}")
+        WEBSOCKET_CONNECTIONS.dec()
+        log_event("ws.closed")
+
+async def _relay_run(websocket: WebSocket, run: dict, last_event_id: int = 0):
+    """Send a run's events after last_event_id until it finishes. False if the client went away."""
+    try:
+        async for event in run["channel"].subscribe(last_event_id):
+            await websocket.send_json(event)
+    except (WebSocketDisconnect, RuntimeError) as send_error:
+        log_event("ws.send_failed", level="debug", run_id=run["id"], error=str(send_error))
+        return False
+    return True
 
 @agent_router.get("/{session_id}/messages")
 async def get_past_messages(
@@ -255,17 +298,61 @@ async def get_review_details(
         "session_id": review.session_id,
         "prompt": review.prompt,
         "changes": changes,
+        "diff_files": load_diff_files(review),
         "checkpoint_commit_hash": review.checkpoint_commit_hash,
+        "checkpoints": [
+            {"step": step["step"], "commit_hash": step["commit_hash"], "created_at": step["created_at"]}
+            for step in json.loads(review.step_checkpoints or "[]")
+        ],
         "status": review.status,
         "created_at": review.created_at.isoformat() if review.created_at else None,
         "approved_at": review.approved_at.isoformat() if review.approved_at else None,
         "rejected_at": review.rejected_at.isoformat() if review.rejected_at else None,
         "commit_message": review.commit_message,
-        "branch_name": review.branch_name
+        "branch_name": review.branch_name,
+        "usage": usage_totals(review)
     }
     return review
 
-@agent_router.post("/review/{review_id}/approve")
+@agent_router.get("/review/{review_id}/diff")
+async def get_review_diff(
+    review_id: str,
+    request: Request,
+    response: Response,
+    db: db_dependency,
+    path: str = None,
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Get the stored diff of a review.
+    Without path, returns the per-file stats; with path, returns that file's hunks.
+    Responses carry an ETag so clients can revalidate instead of downloading again.
+    """
+    review = db.query(ReviewModel).filter(
+        ReviewModel.id == review_id,
+        ReviewModel.user_id == current_user.id
+    ).first()
+    
+    if not review:
+        raise HTTPException(status_code=404, detail="Review not found or access denied")
+    if not review.diff_digest:
+        raise HTTPException(status_code=404, detail="No diff stored for this review")
+
+    etag = f'"{review.diff_digest}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    if path is None:
+        return {"review_id": review_id, "files": load_diff_files(review)}
+
+    file_diff = read_file_diff(review, path)
+    if file_diff is None:
+        raise HTTPException(status_code=404, detail=f"No changes to {path} in this review")
+    return {"review_id": review_id, **file_diff}
+
+@agent_router.post("/review/{review_id}/approve", status_code=202)
 async def approve_review(
     review_id: str, 
     request: ApproveReviewRequest, 
@@ -274,6 +361,8 @@ async def approve_review(
 ):
     """
     Approve a review and commit changes to the repository.
+    The commit (and the push, if requested) runs as a background job;
+    poll /agent/jobs/{job_id} or subscribe to its events for the result.
     """
 
     try:
@@ -288,27 +377,88 @@ async def approve_review(
             raise HTTPException(status_code=404, detail="Cloned repository not found")
         if review_result.status != "pending_review":
             raise HTTPException(status_code=400, detail="Review is not pending review")
+        if request.push and not current_user.github_token:
+            raise HTTPException(status_code=400, detail="GitHub token not found. Please re-authenticate.")
+        if has_active_job(review_id):
+            raise HTTPException(status_code=409, detail="A job for this review is already running")
+
+        steps = ["approve", "push"] if request.push else ["approve"]
+        touch_session(session, db, force=True)
+        job = start_review_job(review_id, current_user.id, steps, request.commit_message, request.branch_name)
+        return {
+        "message": "Review approval queued",
+        "review_id": review_id,
+        "job_id": job["id"],
+        "status": job["status"],
+        "steps": steps
+        }
+    except HTTPException: #To catch the HTTPException raised in the try block
+        raise 
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error approving review: {str(e)}")
+
+@agent_router.post("/review/{review_id}/revert")
+async def revert_review(
+    review_id: str,
+    db: db_dependency,
+    to: int = 0,
+    path: List[str] = Query(None),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Revert a pending review to one of its per-iteration checkpoints.
+    to is the step to go back to (0 = before the run); path limits the
+    revert to specific files. The review stays pending with updated changes.
+    """
+    try:
+        review_result=db.query(ReviewModel).filter(ReviewModel.id == review_id, ReviewModel.user_id == current_user.id).first()
+        if not review_result:
+            raise HTTPException(status_code=404, detail="Review not found")
+        if review_result.status != "pending_review":
+            raise HTTPException(status_code=400, detail="Review is not pending review")
+
+        session=db.query(SessionModel).filter(SessionModel.id == review_result.session_id, SessionModel.user_id == current_user.id).first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        working_directory=session.clone_path
+        if not os.path.exists(working_directory):
+            raise HTTPException(status_code=404, detail="Cloned repository not found")
+        # A running agent would keep writing to the tree being restored
+        if active_run(session.id):
+            raise HTTPException(status_code=409, detail="The agent is already working on this session")
 
-        result = commit_changes(working_directory, request.commit_message, request.branch_name)
+        steps = json.loads(review_result.step_checkpoints or "[]")
+        step = next((s for s in steps if s["step"] == to), None)
+        if step is None:
+            raise HTTPException(status_code=404, detail=f"Checkpoint for step {to} not found")
 
+        result = await asyncio.to_thread(restore_snapshot, working_directory, step["commit_hash"], path)
         if "error" in result:
             raise HTTPException(status_code=500, detail=result.get("error"))
 
-        review_result.status = "approved"
-        review_result.approved_at = datetime.now(timezone.utc)
-        review_result.commit_message = request.commit_message
-        review_result.branch_name = result.get("branch_name")
+        # Refresh the stored change set and diff to match the reverted tree
+        changes = await asyncio.to_thread(get_git_status, working_directory)
+        if "error" not in changes:
+            review_result.changes = json.dumps(changes)
+            diff = await asyncio.to_thread(build_review_diff, working_directory, review_result.checkpoint_commit_hash)
+            if "error" not in diff:
+                review_result.diff_patch = diff["diff_patch"]
+                review_result.diff_files = diff["diff_files"]
+                review_result.diff_digest = diff["diff_digest"]
         db.commit()
+
         return {
-        "message": "Review approved and changes committed",
-        "review_id": review_id,
-        "commit_hash": result.get("commit_hash"),
-        "branch_name": result.get("branch_name")
+            "message": result.get("message"),
+            "review_id": review_id,
+            "step": to,
+            "restored": result.get("restored"),
+            "removed": result.get("removed"),
+            "changes": changes if "error" not in changes else None
         }
-    except HTTPException: #To catch the HTTPException raised in the try block
-        raise 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error approving review: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reverting review: {str(e)}")
 
 @agent_router.post("/review/{review_id}/reject")
 async def reject_review(
@@ -336,7 +486,8 @@ async def reject_review(
         
         if not os.path.exists(working_directory):
             raise HTTPException(status_code=404, detail="Cloned repository not found")
-        
+        if has_active_job(review_id):
+            raise HTTPException(status_code=409, detail="A job for this review is already running")
 
         result = revert_to_checkpoint(working_directory, checkpoint_commit_hash)
         
@@ -357,7 +508,7 @@ async def reject_review(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error rejecting review: {str(e)}")
 
-@agent_router.post("/review/{review_id}/push")
+@agent_router.post("/review/{review_id}/push", status_code=202)
 async def push_review(
     review_id: str,
     db: db_dependency,
@@ -365,7 +516,8 @@ async def push_review(
 ):
     """
     Push changes to the remote repository.
-    Only works if review is approved.
+    Only works if review is approved. The push runs as a background job and is
+    retried with backoff on network errors.
     """
     try:
         review_result = db.query(ReviewModel).filter(
@@ -396,27 +548,53 @@ async def push_review(
         
         if not current_user.github_token:
             raise HTTPException(status_code=400, detail="GitHub token not found. Please re-authenticate.")
-        
-        result = push_changes(
-            working_directory, 
-            review_result.branch_name, 
-            current_user.github_token, 
-            session.repo_url
-        )
-        
-        if "error" in result:
-            raise HTTPException(status_code=500, detail=result.get("error"))
-        
-        review_result.status = "pushed"
-        db.commit()
-        
+
+        if has_active_job(review_id):
+            raise HTTPException(status_code=409, detail="A job for this review is already running")
+
+        touch_session(session, db, force=True)
+        job = start_review_job(review_id, current_user.id, ["push"])
         return {
-            "message": "Review pushed to the repository",
+            "message": "Review push queued",
             "review_id": review_id,
-            "branch_name": result.get("branch_name"),
-            "repo_url": result.get("repo_url")
+            "job_id": job["id"],
+            "status": job["status"]
         }
     except HTTPException:
         raise 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error pushing review: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error pushing review: {str(e)}")
+
+def _get_user_job(job_id: str, current_user: UserModel):
+    job = jobs.get(job_id)
+    if not job or job["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@agent_router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Get the status of a background approve/push job.
+    """
+    return job_to_dict(_get_user_job(job_id, current_user))
+
+@agent_router.get("/jobs/{job_id}/events")
+async def stream_job_events(
+    job_id: str,
+    last_event_id: int = None,
+    last_event_id_header: int = Header(None, alias="Last-Event-ID"),
+    current_user: UserModel = Depends(get_current_user)
+):
+    """
+    Subscribe to a job's status changes as Server-Sent Events.
+    The stream ends once the job has succeeded or failed. Resumes after the
+    last_event_id query parameter, or else the Last-Event-ID header that
+    EventSource sends when it reconnects.
+    """
+    job = _get_user_job(job_id, current_user)
+    if last_event_id is None:
+        last_event_id = last_event_id_header or 0
+    return sse_response(job["channel"], last_event_id)
@@ -1,13 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from app.models import User as UserModel, Session as SessionModel
 import requests
 from pydantic import BaseModel
 from app.middleware.auth import get_current_user
+import os
 import uuid
-import git
-from datetime import datetime, timezone, timedelta
+from sqlalchemy import or_
+from datetime import datetime, timedelta, timezone
+from app.config import (
+    CLONE_ROOT_DIR, NODE_ID, RUN_TOKEN_BUDGET, USER_DISK_QUOTA_BYTES, USER_TOKEN_BUDGET, USER_TOKEN_BUDGET_WINDOW_HOURS
+)
 from app.database import db_dependency
-from app.utils.file_cleanup import cleanup_expired_sessions, cleanup_session
+from app.utils.file_cleanup import cleanup_session
+from app.utils.event_stream import EventChannel, sse_response
+from app.services.clone_service import clone_channels, start_clone
+from app.services.cluster import owner_is_down
+from app.services.warm_pool import claim_warm_session, record_repo_open, schedule_fill
+from app.utils.session_activity import session_expiry
+from app.utils.disk_usage import check_user_quota, user_disk_usage
+from app.utils.event_log import log_event
+from app.utils.token_usage import budget_window_start, usage_summary, user_tokens_used
 user_router=APIRouter(prefix="/user",tags=["user"])
 
 class Repo(BaseModel):
@@ -15,6 +27,7 @@ class Repo(BaseModel):
     name: str
     full_name: str
     private: bool
+    size: int = 0  # KiB, as reported by GitHub
 
 @user_router.get("/repos")
 async def get_user_repos(current_user: UserModel = Depends(get_current_user)):
@@ -30,7 +43,8 @@ async def get_user_repos(current_user: UserModel = Depends(get_current_user)):
                 id=repo["id"], 
                 name=repo["name"],
                 full_name=repo["full_name"],
-                private=repo["private"]
+                private=repo["private"],
+                size=repo.get("size") or 0
             )for repo in repos
         ]
         return {"repos":repos_list}
@@ -39,17 +53,21 @@ async def get_user_repos(current_user: UserModel = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-@user_router.post("/repos/clone")
-async def clone_repo(repo: Repo, current_user: UserModel = Depends(get_current_user), db: db_dependency = None):
+@user_router.post("/repos/clone", status_code=202)
+async def clone_repo(repo: Repo, response: Response, current_user: UserModel = Depends(get_current_user), db: db_dependency = None):
+    """
+    Start cloning a repository in the background.
+    Returns immediately with the session id; poll /user/sessions/{id}/status
+    or subscribe to /user/sessions/{id}/events until the session is ready.
+    If the warm pool holds a fresh clone of the repository, it is handed over
+    and the session is ready right away (200).
+    """
     try:
-        
-        cleanup_expired_sessions(db)
-        
-        
         MAX_ACTIVE_SESSIONS = 5
         active_sessions = db.query(SessionModel).filter(
             SessionModel.user_id == current_user.id,
-            SessionModel.expires_at > datetime.now(timezone.utc)
+            SessionModel.expires_at > datetime.now(timezone.utc),
+            or_(SessionModel.status.is_(None), SessionModel.status.notin_(("failed", "warm", "warm_refreshing")))
         ).count()
         
         if active_sessions >= MAX_ACTIVE_SESSIONS:
@@ -57,11 +75,23 @@ async def clone_repo(repo: Repo, current_user: UserModel = Depends(get_current_u
                 status_code=400, 
                 detail=f"Maximum number of active repositories ({MAX_ACTIVE_SESSIONS}) reached. Please close a repository to clone another."
             )
+
+        quota_error = check_user_quota(current_user.id, db, additional_bytes=repo.size * 1024)
+        if quota_error:
+            raise HTTPException(status_code=400, detail=quota_error["error"])
         
-        session_id=str(uuid.uuid4())
-        clone_path=f"/tmp/repo_{session_id}"
         repo_url=f"https://github.com/{repo.full_name}.git"
-        git.Repo.clone_from(repo_url, clone_path)
+        record_repo_open(db, current_user.id, repo.id, repo.name, repo_url)
+
+        warm = claim_warm_session(db, current_user.id, repo_url)
+        if warm:
+            schedule_fill(current_user.id)
+            response.status_code = 200
+            return {"message": "Repository ready", "session_id": warm.id, "status": "ready", "warm": True, "node_id": NODE_ID}
+
+        session_id=str(uuid.uuid4())
+        now=datetime.now(timezone.utc)
+        clone_path=os.path.join(CLONE_ROOT_DIR, f"repo_{session_id}")
         session=SessionModel(
             id=session_id,
             user_id=current_user.id,
@@ -69,28 +99,141 @@ async def clone_repo(repo: Repo, current_user: UserModel = Depends(get_current_u
             repo_name=repo.name,
             repo_url=repo_url,
             clone_path=clone_path,
-            created_at=datetime.now(timezone.utc),
-            expires_at=datetime.now(timezone.utc) + timedelta(hours=1)
+            created_at=now,
+            last_activity_at=now,
+            expires_at=session_expiry(now, now),
+            status="cloning",
+            node_id=NODE_ID
         )
         db.add(session)
         db.commit()
-        db.refresh(session)
 
-        return {"message": "Repo cloned successfully", "session_id": session_id}
+        start_clone(session_id, repo_url, clone_path)
+        schedule_fill(current_user.id)
+
+        return {"message": "Clone started", "session_id": session_id, "status": "cloning", "warm": False, "node_id": NODE_ID}
     except HTTPException:
         # Re-raise HTTPExceptions (like the 400 for max sessions) as-is
         raise
-    except git.exc.GitCommandError as e:
-        import traceback
-        print(f"Git clone error: {str(e)}")
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Failed to clone repo: {str(e)}")
     except Exception as e:
-        import traceback
-        print(f"Unexpected error in clone_repo: {type(e).__name__}: {str(e)}")
-        traceback.print_exc()
+        log_event("clone.request_failed", level="error", exc_info=True, user_id=current_user.id,
+                  error=f"{type(e).__name__}: {e}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+def _get_user_session(session_id: str, current_user: UserModel, db):
+    session = db.query(SessionModel).filter(
+        SessionModel.id == session_id,
+        SessionModel.user_id == current_user.id
+    ).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found or access denied")
+    return session
+
+@user_router.get("/sessions/{session_id}/status")
+async def get_session_status(
+    session_id: str,
+    current_user: UserModel = Depends(get_current_user),
+    db: db_dependency = None
+):
+    """
+    Get the clone status of a session (cloning, ready or failed) with the latest progress.
+    """
+    session = _get_user_session(session_id, current_user, db)
+    channel = clone_channels.get(session_id)
+    progress = None
+    if channel and channel.last_event and channel.last_event.get("type") == "clone_progress":
+        progress = channel.last_event
+    return {
+        "session_id": session_id,
+        "status": session.status,
+        "message": session.status_message,
+        "progress": progress,
+        "expires_at": session.expires_at.isoformat() if session.expires_at else None,
+        "disk_bytes": session.disk_bytes,
+        "node_id": session.node_id
+    }
+
+@user_router.get("/disk-usage")
+async def get_disk_usage(
+    current_user: UserModel = Depends(get_current_user),
+    db: db_dependency = None
+):
+    """
+    Disk used by each of the user's sessions (clone, .venv and node_modules) and the total against the quota.
+    Files shared with other clones through hardlinks are split between them.
+    """
+    sessions = db.query(SessionModel).filter(SessionModel.user_id == current_user.id).all()
+    return {
+        "used_bytes": user_disk_usage(db, current_user.id),
+        "quota_bytes": USER_DISK_QUOTA_BYTES or None,
+        "sessions": [
+            {
+                "session_id": session.id,
+                "repo_name": session.repo_name,
+                "status": session.status,
+                "disk_bytes": session.disk_bytes,
+                "measured_at": session.disk_measured_at.isoformat() if session.disk_measured_at else None
+            }
+            for session in sessions
+        ]
+    }
+
+@user_router.get("/usage")
+async def get_token_usage(
+    days: int = 30,
+    session_id: str = None,
+    current_user: UserModel = Depends(get_current_user),
+    db: db_dependency = None
+):
+    """
+    Model tokens used by the user over the last `days` days (0 for all time), in total and per
+    session, with estimated cost and the budgets in force. session_id narrows it to one session.
+    """
+    if days < 0:
+        raise HTTPException(status_code=400, detail="days must be 0 or more")
+    since = datetime.now(timezone.utc) - timedelta(days=days) if days else None
+    summary = usage_summary(db, current_user.id, since, session_id)
+    repo_names = dict(
+        db.query(SessionModel.id, SessionModel.repo_name).filter(SessionModel.user_id == current_user.id).all()
+    )
+    for entry in summary["sessions"]:
+        entry["repo_name"] = repo_names.get(entry["session_id"])
+    return {
+        "days": days or None,
+        **summary,
+        "budget": {
+            "user_budget_tokens": USER_TOKEN_BUDGET or None,
+            "window_hours": USER_TOKEN_BUDGET_WINDOW_HOURS,
+            "used_in_window_tokens": user_tokens_used(db, current_user.id, budget_window_start()),
+            "run_budget_tokens": RUN_TOKEN_BUDGET or None
+        }
+    }
+
+@user_router.get("/sessions/{session_id}/events")
+async def stream_session_events(
+    session_id: str,
+    last_event_id: int = None,
+    last_event_id_header: int = Header(None, alias="Last-Event-ID"),
+    current_user: UserModel = Depends(get_current_user),
+    db: db_dependency = None
+):
+    """
+    Subscribe to clone progress events for a session as Server-Sent Events.
+    The stream ends once the clone is ready or has failed. Resumes after the
+    last_event_id query parameter, or else the Last-Event-ID header that
+    EventSource sends when it reconnects.
+    """
+    session = _get_user_session(session_id, current_user, db)
+    channel = clone_channels.get(session_id)
+    if channel is None:
+        # Clone finished long ago (or on another process); report the final status only
+        channel = EventChannel(maxlen=1)
+        channel.publish({"type": "clone_status", "status": session.status, "message": session.status_message})
+        channel.close()
+    if last_event_id is None:
+        last_event_id = last_event_id_header or 0
+    return sse_response(channel, last_event_id)
+
 @user_router.delete("/sessions/{session_id}")
 async def delete_session(
     session_id: str,
@@ -114,6 +257,13 @@ async def delete_session(
                 detail="Session not found or access denied"
             )
         
+        # A clone left unfinished by a node that is down never finishes
+        if session.status == "cloning" and not owner_is_down(db, session.node_id):
+            raise HTTPException(
+                status_code=409,
+                detail="Repository is still cloning. Please try again once the clone has finished."
+            )
+        
         # Clean up session and clone directory
         result = cleanup_session(session_id, db)
         
@@ -1,7 +1,7 @@
 import os
+import asyncio
+import functools
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from functions.get_files_info import schema_get_files_info
 from functions.get_file_content import schema_get_file_content
 from functions.write_file import schema_write_file
@@ -23,14 +23,106 @@ from sqlalchemy.orm import Session
 import json
 import uuid
 from redis.commands.json.path import Path
-from app.utils.git_utils import get_current_commit_hash, get_git_status, revert_to_checkpoint, commit_changes, push_changes
+from app.utils.git_utils import get_current_commit_hash, ChangeTracker, snapshot_working_tree
+from app.utils.review_diff import build_review_diff
+from app.utils.session_activity import touch_session
+from app.utils.disk_usage import refresh_session_usage
+from app.utils.metrics import AGENT_RUNS_ACTIVE, HISTORY_LOADS, MODEL_CALL_SECONDS, RESPONSE_CACHE_LOOKUPS
 from app.models import Review as ReviewModel
+from app.services.model_backend import get_model_backend
+from app.services.model_cassette import CassetteRecorder, cassette_path
+from app.services.response_cache import (
+    CACHE_ENABLED, config_digest as response_cache_config_digest, cache_key as response_cache_key, history_digest,
+    is_cacheable, reads_only_tracked_files, response_cache
+)
+from app.config import AGENT_MODEL, MODEL_RECORD_DIR
+from app.utils.event_log import bind_log_context, log_event
+from app.utils.tracing import begin_span, span
+from app.utils.token_usage import (
+    check_run_token_budget, check_user_token_budget, record_usage, usage_from_response, usage_totals
+)
+from app.utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+
+SYSTEM_PROMPT = """
+You are a helpful AI coding agent.
+
+When a user asks a question or makes a request, make a function call plan. You can perform the following operations:
+
+- List files and directories
+- Read the content of a file
+- Write to a file (create or update)
+- Run a python file with optional arguments
+- Run shell commands (for tests, builds, etc.)
+
+IMPORTANT GUIDELINES:
+
+1. **Code Analysis Focus**: When exploring a repository, focus on reading and analyzing code files rather than running the application. Read README files, source code, configuration files, and documentation to understand the project.
+
+2. **Do NOT run long-running processes**: 
+   - Do NOT run development servers (e.g., `npm run dev`, `python app.py`, `uvicorn`, etc.) as they run indefinitely and will timeout
+   - Do NOT run processes that require user interaction or run continuously
+
+3. **Environment Variables**:
+   - Do NOT try to create or modify `.env` files - they are gitignored and not available in cloned repositories
+   - Do NOT assume you can access environment variables from GitHub repos
+   - If environment variables are needed, mention this to the user but don't try to create them
+
+4. **What you CAN do**:
+   - Read all code files to understand the project structure
+   - Run quick commands like `npm test`, `pytest`, `npm run build` (if they complete quickly)
+   - Check for compilation errors by running build commands
+   - Analyze code quality, architecture, and functionality by reading files
+   - Run unit tests if they exist and are quick to execute
+
+5. **Project Understanding**: When asked to explain a repository:
+   - Start by reading the README.md file
+   - Explore the project structure using `get_files_info`
+   - Read key source files (main entry points, configuration files)
+   - Identify the tech stack from package.json, requirements.txt, etc.
+   - Summarize the project's purpose, features, and architecture
+
+6. **All paths should be relative to the working directory**. You do not need to specify the working directory in your function calls as it is automatically injected for security reasons.
+"""
+
+TOOL_SCHEMAS = [
+    schema_get_files_info,
+    schema_get_file_content,
+    schema_write_file,
+    schema_run_program_file,
+    schema_get_file_overview,
+    schema_search_in_file,
+    schema_run_command,
+]
+MAX_ITERATIONS = 20
+
+
+@functools.cache
+def get_generate_config():
+    """The tool declarations and system prompt, validated into a request config once per process."""
+    return types.GenerateContentConfig(
+        tools=[types.Tool(function_declarations=TOOL_SCHEMAS)], system_instruction=SYSTEM_PROMPT
+    )
+
+
+@functools.cache
+def get_config_digest():
+    """Digest of the model setup, part of every response cache key."""
+    return response_cache_config_digest(SYSTEM_PROMPT, TOOL_SCHEMAS, MAX_ITERATIONS)
+
+
+def warm_up():
+    """Load the model SDK, build the request config and create the backend client before the first prompt needs them."""
+    get_generate_config()
+    get_model_backend()
+
 
 class GeminiAgentService:
-    def __init__(self):
+    def __init__(self, backend=None):
+        """backend defaults to the one selected by MODEL_BACKEND (Gemini API or local fake)."""
         load_dotenv()
-        self.api_key = os.environ.get("GEMINI_API_KEY")
-        self.client = genai.Client(api_key=self.api_key)
+        self.backend = backend or get_model_backend()
 
     def _load_raw_messages(self, session_id: str, redis_client: redis.Redis, db: Session):
         """
@@ -52,6 +144,7 @@ class GeminiAgentService:
                         "sequence": message_data.get("sequence", 0),
                         "created_at": None 
                     })
+                HISTORY_LOADS.inc(source="redis")
                 return messages
         except Exception:
             pass
@@ -70,8 +163,10 @@ class GeminiAgentService:
                     "sequence": db_message.sequence,
                     "created_at": db_message.created_at.isoformat() if db_message.created_at else None
                 })
+            HISTORY_LOADS.inc(source="postgres")
             return messages
         except Exception:
+            HISTORY_LOADS.inc(source="error")
             return []
 
     def load_messages(self, session_id: str, redis_client: redis.Redis, db: Session):
@@ -120,7 +215,7 @@ class GeminiAgentService:
         
         return 0  
 
-    def save_message_cache(self, message: types.Content, session_id: str, sequence: int, redis_client: redis.Redis):
+    def save_message_cache(self, message: "types.Content", session_id: str, sequence: int, redis_client: redis.Redis):
         """Save a message to the Redis cache."""
         try:
             message_id = str(uuid.uuid4())
@@ -137,7 +232,7 @@ class GeminiAgentService:
         except Exception:
             pass
        
-    def save_message_db(self, message: types.Content, session_id: str, sequence: int, db: Session):
+    def save_message_db(self, message: "types.Content", session_id: str, sequence: int, db: Session):
         """Save a message to the database."""
         try:
             
@@ -159,16 +254,121 @@ class GeminiAgentService:
         except Exception:
             db.rollback()
             pass
-   
-    async def execute(self, prompt: str, session_id: str, db: db_dependency=None, redis: redis_dependency=None):
+
+    async def _stream_function_call(self, function_call_part, working_directory: str, user_id: int = None):
+        """
+        Run a tool call, yielding tool_output updates while it runs.
+        The last item yielded is the tool's response Content.
+        """
+        queue = asyncio.Queue()
+
+        async def on_output(stream: str, line: str):
+            await queue.put({
+                "type": "tool_output",
+                "function_name": function_call_part.name,
+                "stream": stream,
+                "line": line
+            })
+
+        task = asyncio.create_task(call_function(function_call_part, working_directory, on_output=on_output, user_id=user_id))
+        try:
+            while not task.done() or not queue.empty():
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                else:
+                    getter.cancel()
+            yield task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+
+    def _track_changes(self, change_tracker: ChangeTracker, function_call_part):
+        """Tell the change tracker which paths a tool call may have modified."""
+        if function_call_part.name == "write_file":
+            file_path = (function_call_part.args or {}).get("file_path")
+            if file_path:
+                change_tracker.mark_path(file_path)
+        elif function_call_part.name in ("run_command", "run_program_file"):
+            change_tracker.mark_all()
+
+    async def _record_step_checkpoint(self, review, steps: list, step: int, working_directory: str, db: Session):
+        """
+        Snapshot the working tree after an iteration so the review can be
+        reverted to this step later. Returns a checkpoint update, or None if
+        nothing changed since the previous snapshot.
+        """
+        snapshot = await asyncio.to_thread(
+            snapshot_working_tree,
+            working_directory,
+            review.checkpoint_commit_hash,
+            f"Review {review.id} step {step}",
+            f"refs/reporefine/reviews/{review.id}/{step}"
+        )
+        if "error" in snapshot:
+            return None
+        if steps and steps[-1]["tree_hash"] == snapshot["tree_hash"]:
+            return None
+        steps.append({
+            "step": step,
+            "commit_hash": snapshot["commit_hash"],
+            "tree_hash": snapshot["tree_hash"],
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        review.step_checkpoints = json.dumps(steps)
+        db.commit()
+        return {
+            "type": "checkpoint",
+            "step": step,
+            "commit_hash": snapshot["commit_hash"],
+            "review_id": review.id
+        }
+
+    async def _finalize_review(self, review, change_tracker, working_directory: str, checkpoint_commit_hash: str, db,
+                               measure_usage: bool = True):
+        """
+        Store the run's final change set and compressed diff on the review.
+        measure_usage=False skips the disk usage update, for runs that wrote nothing.
+        """
+        changes = await asyncio.to_thread(change_tracker.refresh)
+
+        if changes and "error" not in changes:
+            changes_json=json.dumps(changes)
+        else:
+            changes_json = json.dumps({"error": changes.get("error", "Unknown error")}) if changes else None
+
+        review.changes=changes_json
+
+        # Store the compressed patch once so reviews can load files lazily
+        if changes and "error" not in changes:
+            diff = await asyncio.to_thread(build_review_diff, working_directory, checkpoint_commit_hash)
+            if "error" not in diff:
+                review.diff_patch = diff["diff_patch"]
+                review.diff_files = diff["diff_files"]
+                review.diff_digest = diff["diff_digest"]
+        db.commit()
+        if measure_usage:
+            await asyncio.to_thread(refresh_session_usage, review.session_id)
+
+    async def execute(self, prompt: str, session_id: str, db: db_dependency=None, redis: redis_dependency=None,
+                      use_cache: bool = True):
         
         session = db.query(SessionModel).filter(SessionModel.id == session_id).first()
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
+        if session.status == "cloning":
+            raise HTTPException(status_code=409, detail="Repository is still cloning. Please wait until it is ready.")
+        if session.status == "failed":
+            raise HTTPException(status_code=400, detail=f"Repository clone failed: {session.status_message}")
         
         working_directory = session.clone_path
         if not os.path.exists(working_directory):
             raise HTTPException(status_code=404, detail="Cloned repository not found")
+        touch_session(session, db, force=True)
+        budget_error = check_user_token_budget(session.user_id, db)
+        if budget_error:
+            raise HTTPException(status_code=429, detail=budget_error["error"])
 
         checkpoint =get_current_commit_hash(working_directory)
         if "error" in checkpoint:
@@ -179,6 +379,7 @@ class GeminiAgentService:
             return
         
         checkpoint_commit_hash=checkpoint.get("commit_hash")
+        change_tracker = ChangeTracker(working_directory)
 
         review_id = str(uuid.uuid4())
         review= ReviewModel(
@@ -197,6 +398,24 @@ class GeminiAgentService:
         )
         db.add(review)
         db.commit()
+        bind_log_context(review_id=review_id)
+
+        backend = self.backend
+        if MODEL_RECORD_DIR:
+            # Keep the run's model calls so it can be replayed (MODEL_BACKEND=replay)
+            backend = CassetteRecorder(self.backend, cassette_path(review_id), {
+                "review_id": review_id,
+                "session_id": session_id,
+                "prompt": prompt,
+                "model": AGENT_MODEL,
+                "repo_url": session.repo_url,
+                "checkpoint_commit_hash": checkpoint_commit_hash,
+                "backend": type(self.backend).__name__,
+            })
+
+        # Step 0 is the tree as it was before the run, including earlier unapproved edits
+        step_checkpoints = []
+        await self._record_step_checkpoint(review, step_checkpoints, 0, working_directory, db)
 
         yield {
             "type": "agent_started",
@@ -205,48 +424,6 @@ class GeminiAgentService:
             "session_id": session_id
         }
 
-        system_prompt = """
-        You are a helpful AI coding agent.
-
-        When a user asks a question or makes a request, make a function call plan. You can perform the following operations:
-
-        - List files and directories
-        - Read the content of a file
-        - Write to a file (create or update)
-        - Run a python file with optional arguments
-        - Run shell commands (for tests, builds, etc.)
-
-        IMPORTANT GUIDELINES:
-
-        1. **Code Analysis Focus**: When exploring a repository, focus on reading and analyzing code files rather than running the application. Read README files, source code, configuration files, and documentation to understand the project.
-
-        2. **Do NOT run long-running processes**: 
-           - Do NOT run development servers (e.g., `npm run dev`, `python app.py`, `uvicorn`, etc.) as they run indefinitely and will timeout
-           - Do NOT run processes that require user interaction or run continuously
-
-        3. **Environment Variables**:
-           - Do NOT try to create or modify `.env` files - they are gitignored and not available in cloned repositories
-           - Do NOT assume you can access environment variables from GitHub repos
-           - If environment variables are needed, mention this to the user but don't try to create them
-
-        4. **What you CAN do**:
-           - Read all code files to understand the project structure
-           - Run quick commands like `npm test`, `pytest`, `npm run build` (if they complete quickly)
-           - Check for compilation errors by running build commands
-           - Analyze code quality, architecture, and functionality by reading files
-           - Run unit tests if they exist and are quick to execute
-
-        5. **Project Understanding**: When asked to explain a repository:
-           - Start by reading the README.md file
-           - Explore the project structure using `get_files_info`
-           - Read key source files (main entry points, configuration files)
-           - Identify the tech stack from package.json, requirements.txt, etc.
-           - Summarize the project's purpose, features, and architecture
-
-        6. **All paths should be relative to the working directory**. You do not need to specify the working directory in your function calls as it is automatically injected for security reasons.
-        """
-        
-       
         previous_messages = self.load_messages(session_id, redis, db)
         
         user_message = types.Content(role="user", parts=[types.Part(text=prompt)])
@@ -256,34 +433,62 @@ class GeminiAgentService:
         user_sequence = self._get_next_sequence(session_id, redis, db)
         self.save_message_cache(user_message, session_id, user_sequence, redis)
         self.save_message_db(user_message, session_id, user_sequence, db)
-       
-        available_functions = types.Tool(
-            function_declarations=[
-                schema_get_files_info,
-                schema_get_file_content,
-                schema_write_file,
-                schema_run_program_file,
-                schema_get_file_overview,
-                schema_search_in_file,
-                schema_run_command,
-            ]
-        )
 
-        config = types.GenerateContentConfig(
-            tools=[available_functions], system_instruction=system_prompt
-        )
+        # Same read-only prompt on the same repository state: answer from the cache
+        cache_key = None
+        if CACHE_ENABLED and step_checkpoints:
+            history = [(message.role, message.parts[0].text if message.parts else "") for message in previous_messages]
+            cache_key = response_cache_key(
+                session.user_id, prompt, history_digest(history), checkpoint_commit_hash,
+                step_checkpoints[0]["tree_hash"], get_config_digest()
+            )
+            cached = response_cache.get(cache_key) if use_cache else None
+            if not use_cache:
+                RESPONSE_CACHE_LOOKUPS.inc(outcome="bypass")
+            if cached:
+                log_event("agent.cache_hit", cached_review_id=cached["review_id"])
+                await self._finalize_review(review, change_tracker, working_directory, checkpoint_commit_hash, db,
+                                            measure_usage=False)
+                yield {
+                    "status": "completed",
+                    "message": cached["message"],
+                    "usage": usage_totals(review),
+                    "function_calls": cached["function_calls"],
+                    "agent_responses": cached["agent_responses"],
+                    "working_directory": working_directory,
+                    "review_id": review_id,
+                    "cached": True,
+                    "cached_review_id": cached["review_id"]
+                }
+                agent_message = types.Content(role="model", parts=[types.Part(text=cached["message"])])
+                self.save_message_cache(agent_message, session_id, user_sequence + 1, redis)
+                self.save_message_db(agent_message, session_id, user_sequence + 1, db)
+                return
+       
+        config = get_generate_config()
 
-        max_iters = 20
+        max_iters = MAX_ITERATIONS
         function_calls = []
         agent_responses = []
 
+        AGENT_RUNS_ACTIVE.inc()
+        # Started by hand rather than with a with-block: the updates yielded below cross it
+        run_span = begin_span("agent.run", session_id=session_id, review_id=review_id)
+        run_error = None
         try:
             for i in range(0, max_iters):
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-flash-001",
-                    contents=messages,
-                    config=config,
-                )
+                # Long runs keep the session alive
+                touch_session(session, db)
+                with MODEL_CALL_SECONDS.time(model=AGENT_MODEL, outcome="error") as call_labels, \
+                        span("model.generate", kind="client", model=AGENT_MODEL, iteration=i + 1) as model_span:
+                    # The client is blocking; keep other sessions' websockets moving meanwhile
+                    response = await asyncio.to_thread(
+                        backend.generate_content,
+                        model=AGENT_MODEL,
+                        contents=messages,
+                        config=config,
+                    )
+                    call_labels["outcome"] = "ok"
                 
                 if response is None or response.usage_metadata is None:
                     yield {
@@ -293,6 +498,11 @@ class GeminiAgentService:
                         "agent_responses": agent_responses
                     }
                     return
+                usage = usage_from_response(response)
+                model_span.set_attributes(function_calls=len(response.function_calls or []), **usage)
+                record_usage(db, review, session, i + 1, AGENT_MODEL, usage)
+                log_event("agent.model_call", level="debug", iteration=i + 1,
+                          function_calls=len(response.function_calls or []), **usage)
 
                 if response.candidates:
                     for candidate in response.candidates:
@@ -315,8 +525,17 @@ class GeminiAgentService:
                             "arguments": function_call_part.args
                         })
                         
-                        # Get the function result
-                        function_result = call_function(function_call_part, working_directory)
+                        # Get the function result, streaming command output as it arrives
+                        function_result = None
+                        async for item in self._stream_function_call(function_call_part, working_directory, session.user_id):
+                            if isinstance(item, dict):
+                                yield item
+                            else:
+                                function_result = item
+                        self._track_changes(change_tracker, function_call_part)
+                        if function_call_part.name in ("run_command", "run_program_file"):
+                            # Commands may install dependencies; keep disk usage current for quota checks
+                            await asyncio.to_thread(refresh_session_usage, session_id)
                         # Extract the part from the Content object
                         if function_result and function_result.parts:
                             function_response_parts.extend(function_result.parts)
@@ -328,16 +547,42 @@ class GeminiAgentService:
                             parts=function_response_parts
                         )
                         messages.append(function_response_content)
-                else:
-                    changes=get_git_status(working_directory)
 
-                    if changes and "error" not in changes:
-                        changes_json=json.dumps(changes)
-                    else:
-                        changes_json = json.dumps({"error": changes.get("error", "Unknown error")}) if changes else None
+                    # Report the run's change set so far, rescanning only what the tools touched
+                    if change_tracker.is_dirty:
+                        checkpoint_update = await self._record_step_checkpoint(review, step_checkpoints, i + 1, working_directory, db)
+                        if checkpoint_update:
+                            yield checkpoint_update
+                        changes = await asyncio.to_thread(change_tracker.refresh)
+                        if "error" not in changes:
+                            yield {
+                                "type": "changes",
+                                "changes": changes,
+                                "review_id": review_id
+                            }
 
-                    review.changes=changes_json
-                    db.commit()
+                    # Out of tokens: stop here and leave the work so far up for review
+                    budget_error = check_run_token_budget(review) or check_user_token_budget(session.user_id, db)
+                    if budget_error:
+                        await self._finalize_review(review, change_tracker, working_directory, checkpoint_commit_hash, db)
+                        yield {
+                            "status": "budget_exceeded",
+                            "message": budget_error["error"],
+                            "used_tokens": budget_error["used_tokens"],
+                            "budget_tokens": budget_error["budget_tokens"],
+                            "usage": usage_totals(review),
+                            "function_calls": function_calls,
+                            "agent_responses": agent_responses,
+                            "working_directory": working_directory,
+                            "review_id": review_id
+                        }
+                        agent_message = types.Content(role="model", parts=[types.Part(text=budget_error["error"])])
+                        agent_sequence = user_sequence + 1
+                        self.save_message_cache(agent_message, session_id, agent_sequence, redis)
+                        self.save_message_db(agent_message, session_id, agent_sequence, db)
+                        return
+                else:
+                    await self._finalize_review(review, change_tracker, working_directory, checkpoint_commit_hash, db)
 
                     # Extract text from response candidates
                     agent_response_text = "Task completed"
@@ -350,10 +595,19 @@ class GeminiAgentService:
                         agent_response_text = response.text
                     
                     agent_message = types.Content(role="model", parts=[types.Part(text=agent_response_text)])
+                    if (cache_key and is_cacheable(function_calls, step_checkpoints)
+                            and await asyncio.to_thread(reads_only_tracked_files, working_directory, function_calls)):
+                        response_cache.put(cache_key, {
+                            "message": agent_response_text,
+                            "function_calls": function_calls,
+                            "agent_responses": agent_responses,
+                            "review_id": review_id
+                        })
                     
                     yield {
                         "status": "completed",
                         "message": agent_response_text,
+                        "usage": usage_totals(review),
                         "function_calls": function_calls,
                         "agent_responses": agent_responses,
                         "working_directory": working_directory,
@@ -368,6 +622,7 @@ class GeminiAgentService:
             yield {
                 "status": "max_iterations_reached",
                 "message": "Agent reached maximum iterations",
+                "usage": usage_totals(review),
                 "function_calls": function_calls,
                 "agent_responses": agent_responses,
                 "working_directory": working_directory,
@@ -375,6 +630,8 @@ class GeminiAgentService:
             }
             
         except Exception as e:
+            run_error = e
+            log_event("agent.run_failed", level="error", exc_info=True, error=f"{type(e).__name__}: {e}")
             yield {
                 "status": "error",
                 "message": f"Agent execution failed: {str(e)}",
@@ -383,4 +640,12 @@ class GeminiAgentService:
                 "working_directory": working_directory,
                 "review_id": review_id
             }
+        except BaseException as e:
+            # Closed early (client disconnected) or cancelled
+            run_error = e
+            raise
+        finally:
+            AGENT_RUNS_ACTIVE.dec()
+            run_span.set_attributes(tool_calls=len(function_calls), total_tokens=review.total_tokens or 0)
+            run_span.end(error=run_error)
 
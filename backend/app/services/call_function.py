@@ -1,4 +1,5 @@
-from google.genai import types
+import json
+import time
 from functions.get_files_info import get_files_info
 from functions.get_file_content import get_file_content
 from functions.write_file import write_file
@@ -6,29 +7,46 @@ from functions.run_program_file import run_program_file
 from functions.get_file_overview import get_file_overview
 from functions.search_in_file import search_in_file
 from functions.run_command import run_command
+from app.utils.metrics import TOOL_CALL_SECONDS, TOOL_RESULT_BYTES
+from app.utils.tracing import span
+from app.utils.lazy_import import lazy_import
 
+types = lazy_import("google.genai.types")
 
-def call_function(function_call_part, working_directory):
+
+async def call_function(function_call_part, working_directory, on_output=None, user_id=None):
     """
     Call a function and return a properly formatted function response.
     The response must match the function call structure exactly.
+    on_output receives (stream, line) for commands that stream their output.
+    user_id is used to queue commands fairly in the execution pool.
     """
     result = None
+    started_at = time.perf_counter()
+
+    with span(f"tool.{function_call_part.name}", tool=function_call_part.name) as tool_span:
+        if function_call_part.name == "get_files_info":
+            result = get_files_info(working_directory, **function_call_part.args)
+        elif function_call_part.name == "get_file_content":
+            result = get_file_content(working_directory, **function_call_part.args)
+        elif function_call_part.name == "write_file":
+            result = write_file(working_directory, **function_call_part.args)
+        elif function_call_part.name == "run_program_file":
+            result = await run_program_file(working_directory, on_output=on_output, user_id=user_id, **function_call_part.args)
+        elif function_call_part.name == "get_file_overview":
+            result = get_file_overview(working_directory, **function_call_part.args)
+        elif function_call_part.name == "search_in_file":
+            result = search_in_file(working_directory, **function_call_part.args)
+        elif function_call_part.name == "run_command":
+            result = await run_command(working_directory, on_output=on_output, user_id=user_id, **function_call_part.args)
 
-    if function_call_part.name == "get_files_info":
-        result = get_files_info(working_directory, **function_call_part.args)
-    elif function_call_part.name == "get_file_content":
-        result = get_file_content(working_directory, **function_call_part.args)
-    elif function_call_part.name == "write_file":
-        result = write_file(working_directory, **function_call_part.args)
-    elif function_call_part.name == "run_program_file":
-        result = run_program_file(working_directory, **function_call_part.args)
-    elif function_call_part.name == "get_file_overview":
-        result = get_file_overview(working_directory, **function_call_part.args)
-    elif function_call_part.name == "search_in_file":
-        result = search_in_file(working_directory, **function_call_part.args)
-    elif function_call_part.name == "run_command":
-        result = run_command(working_directory, **function_call_part.args)
+        outcome = "error" if result is None or (isinstance(result, dict) and "error" in result) else "ok"
+        result_bytes = len(json.dumps(result, default=str))
+        TOOL_CALL_SECONDS.observe(time.perf_counter() - started_at, tool=function_call_part.name, outcome=outcome)
+        TOOL_RESULT_BYTES.observe(result_bytes, tool=function_call_part.name)
+        tool_span.set_attribute("result_bytes", result_bytes)
+        if outcome == "error":
+            tool_span.set_error(str(result.get("error")) if isinstance(result, dict) else "unknown function")
 
     # Create function response part - must match the function call part structure
     # Check if function_call_part has an id attribute (for matching)
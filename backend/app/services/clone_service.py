@@ -0,0 +1,181 @@
+import asyncio
+import functools
+import re
+import time
+from datetime import datetime, timezone
+from app.config import CLONE_MODE
+from app.database import SessionLocal
+from app.models import Session as SessionModel
+from app.services.cluster import local_sessions
+from app.utils.disk_usage import refresh_session_usage
+from app.utils.event_stream import EventChannel
+from app.utils.event_log import log_event
+from app.utils.metrics import CLONE_SECONDS
+from app.utils.repo_cache import create_clone
+from app.utils.lazy_import import lazy_import
+
+git = lazy_import("git")
+
+# Progress channels for clones started by this process, by session id
+clone_channels = {}
+_clone_tasks = set()
+
+# How long a finished clone's progress stays available to late subscribers
+CHANNEL_RETENTION_SECONDS = 300
+PROGRESS_INTERVAL_SECONDS = 0.5
+
+@functools.cache
+def _stages():
+    return {
+        git.RemoteProgress.COUNTING: "counting",
+        git.RemoteProgress.COMPRESSING: "compressing",
+        git.RemoteProgress.RECEIVING: "receiving",
+        git.RemoteProgress.RESOLVING: "resolving",
+        git.RemoteProgress.WRITING: "writing",
+        git.RemoteProgress.FINDING_SOURCES: "finding_sources",
+        git.RemoteProgress.CHECKING_OUT: "checking_out",
+    }
+
+_UNITS = {"bytes": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3}
+_SIZE_RE = re.compile(r"([\d.]+) (bytes|KiB|MiB|GiB)(/s)?")
+
+
+class CloneProgress:
+    """
+    Turns git's progress output into clone_progress events (objects, bytes, ETA).
+    Passed to clone_from as a callable, so GitPython is only loaded once a clone runs.
+    Runs in the clone thread; publish must be thread-safe.
+    """
+
+    def __init__(self, publish):
+        self._publish = publish
+        self._stage = None
+        self._stage_started_at = time.monotonic()
+        self._last_sent_at = 0.0
+        self._bytes_received = None
+
+    def __call__(self, op_code, cur_count, max_count=None, message=""):
+        stage = op_code & git.RemoteProgress.OP_MASK
+        now = time.monotonic()
+        if stage != self._stage:
+            self._stage = stage
+            self._stage_started_at = now
+        elif not op_code & git.RemoteProgress.END and now - self._last_sent_at < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_sent_at = now
+
+        rate = None
+        for value, unit, per_second in _SIZE_RE.findall(message or ""):
+            size = int(float(value) * _UNITS[unit])
+            if per_second:
+                rate = size
+            else:
+                self._bytes_received = size
+
+        current = int(cur_count or 0)
+        total = int(max_count) if max_count else None
+        eta = None
+        if total and current:
+            elapsed = now - self._stage_started_at
+            eta = round(elapsed * (total - current) / current, 1)
+
+        self._publish({
+            "type": "clone_progress",
+            "stage": _stages().get(stage, "working"),
+            "objects_received": current,
+            "objects_total": total,
+            "percent": round(current * 100 / total, 1) if total else None,
+            "bytes_received": self._bytes_received,
+            "bytes_per_second": rate,
+            "eta_seconds": eta
+        })
+
+
+def start_clone(session_id: str, repo_url: str, clone_path: str):
+    """
+    Clone a repository in the background for an already created session row.
+    Progress and the final ready/failed status are published on the session's channel.
+    """
+    loop = asyncio.get_running_loop()
+    channel = EventChannel(maxlen=200)
+    clone_channels[session_id] = channel
+    channel.publish({"type": "clone_status", "status": "cloning"})
+
+    task = asyncio.create_task(_run_clone(loop, channel, session_id, repo_url, clone_path))
+    _clone_tasks.add(task)
+    task.add_done_callback(_clone_tasks.discard)
+    return channel
+
+
+async def _run_clone(loop, channel: EventChannel, session_id: str, repo_url: str, clone_path: str):
+    started_at = time.monotonic()
+    progress = CloneProgress(lambda event: loop.call_soon_threadsafe(channel.publish, event))
+    try:
+        # Imported here: file_cleanup needs clone_channels from this module
+        from app.utils.file_cleanup import evict_for_disk_space
+        # Make room first if the clone filesystem is short on space
+        await asyncio.to_thread(evict_for_disk_space, None, False)
+    except Exception as e:
+        log_event("clone.evict_failed", level="error", session_id=session_id, error=str(e))
+    try:
+        result = await asyncio.to_thread(create_clone, repo_url, clone_path, progress=progress)
+    except Exception as e:
+        result = {"error": f"Error cloning {repo_url}: {str(e)}"}
+
+    status = "failed" if "error" in result else "ready"
+    message = result.get("error")
+    CLONE_SECONDS.observe(time.monotonic() - started_at, mode=result.get("mode", CLONE_MODE), status=status)
+    try:
+        await asyncio.to_thread(_mark_session, session_id, status, message)
+    except Exception as e:
+        log_event("clone.status_update_failed", level="error", session_id=session_id, error=str(e))
+        status, message = "failed", f"Error updating session: {str(e)}"
+
+    usage = {}
+    if status == "ready":
+        usage = await asyncio.to_thread(refresh_session_usage, session_id)
+
+    channel.publish({
+        "type": "clone_status",
+        "status": status,
+        "message": message,
+        "disk_bytes": usage.get("disk_bytes"),
+        "duration_seconds": round(time.monotonic() - started_at, 3)
+    })
+    channel.close()
+    loop.call_later(CHANNEL_RETENTION_SECONDS, clone_channels.pop, session_id, None)
+
+
+def _mark_session(session_id: str, status: str, message: str = None):
+    db = SessionLocal()
+    try:
+        session = db.query(SessionModel).filter(SessionModel.id == session_id).first()
+        if not session:
+            return
+        session.status = status
+        session.status_message = message
+        if status == "failed":
+            # Let the periodic cleanup remove the failed session
+            session.expires_at = datetime.now(timezone.utc)
+        db.commit()
+    finally:
+        db.close()
+
+
+def fail_interrupted_clones():
+    """
+    Mark this node's sessions still "cloning" as failed. Run at startup, before any
+    clone starts: those clones were cut off by a restart and will never finish. Blocking.
+    """
+    db = SessionLocal()
+    try:
+        count = db.query(SessionModel).filter(local_sessions(), SessionModel.status == "cloning").update({
+            SessionModel.status: "failed",
+            SessionModel.status_message: "The clone was interrupted by a server restart. Please clone again.",
+            # Let the periodic cleanup remove them
+            SessionModel.expires_at: datetime.now(timezone.utc),
+        }, synchronize_session=False)
+        db.commit()
+        return count
+    finally:
+        db.close()
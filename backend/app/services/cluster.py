@@ -0,0 +1,280 @@
+"""
+Multi-node deployment: session ownership and routing.
+
+A session's clone and its in-process state (agent runs on the websocket, clone
+progress, approve/push jobs) live on the node that created it, recorded in
+sessions.node_id. Nodes register in the nodes table with the URL the other nodes
+reach them at and keep a heartbeat. A request for a session, review or job owned by
+another node is forwarded there: HTTP requests by the route_to_owner middleware,
+websockets by proxy_websocket. Any node can therefore sit behind a plain load
+balancer, without a shared filesystem; new sessions land on whichever node
+receives the clone request. Responses carry the X-Reporefine-Node header, so a
+sticky load balancer or client can go to the owner directly and skip the hop.
+
+Clustering is on when NODE_URL is set; otherwise everything is handled locally.
+"""
+import asyncio
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import and_, or_, select
+from starlette.background import BackgroundTask
+from app.config import NODE_HEARTBEAT_SECONDS, NODE_ID, NODE_TTL_SECONDS, NODE_URL
+from app.database import SessionLocal
+from app.models import Node, Review as ReviewModel, Session as SessionModel
+from app.utils.event_log import log_event
+from app.utils.lazy_import import lazy_import
+from app.utils.metrics import NODE_FORWARDS
+from app.utils.tracing import current_span
+
+httpx = lazy_import("httpx")
+ws_client = lazy_import("websockets.asyncio.client")
+
+CLUSTER_ENABLED = bool(NODE_URL)
+NODE_HEADER = "x-reporefine-node"
+# Set on forwarded requests; the receiving node then always handles them itself
+FORWARDED_HEADER = "x-reporefine-forwarded-by"
+# Requests that need the owning node's clone or in-process state (the agent websocket
+# is routed by its handler, see proxy_websocket)
+OWNER_ROUTES = (
+    (re.compile(r"^/agent/review/(?P<key>[^/]+)"), "review"),
+    (re.compile(r"^/agent/jobs/(?P<key>[^/]+)"), "job"),
+    (re.compile(r"^/user/sessions/(?P<key>[^/]+)"), "session"),
+)
+_HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host",
+}
+# Set again by the server sending the response
+_RESPONSE_EXCLUDE = _HOP_BY_HOP | {"date", "server"}
+_JOB_ID_SEPARATOR = "~"
+_NODE_CACHE_SECONDS = 5
+_OWNER_CACHE_SIZE = 10000
+
+# Ownership never changes once recorded, so found owners are cached for good
+_owners = {}
+_node_urls = {}
+_http_client = None
+
+
+def local_sessions():
+    """Filter for sessions whose clone is on this node. Sessions from before node ids count as local."""
+    return or_(SessionModel.node_id == NODE_ID, SessionModel.node_id.is_(None))
+
+
+def orphaned_sessions():
+    """
+    Filter for sessions whose owner is down: no heartbeat for NODE_TTL_SECONDS, or no
+    longer registered (stopped, or restarted under another NODE_ID). Nobody can serve
+    them, so any node may delete their rows.
+    """
+    alive_since = datetime.now(timezone.utc) - timedelta(seconds=NODE_TTL_SECONDS)
+    live_nodes = select(Node.id).where(Node.heartbeat_at >= alive_since)
+    return and_(
+        SessionModel.node_id.is_not(None),
+        SessionModel.node_id != NODE_ID,
+        SessionModel.node_id.not_in(live_nodes),
+    )
+
+
+def owner_is_down(db, node_id: str):
+    """Whether a session owned by node_id is orphaned (see orphaned_sessions)."""
+    if node_id is None or node_id == NODE_ID:
+        return False
+    return _live_node_url(db, node_id) is None
+
+
+def node_scoped_id():
+    """A new id for in-process state (jobs) that tells other nodes where it lives."""
+    if not CLUSTER_ENABLED:
+        return str(uuid.uuid4())
+    return f"{NODE_ID}{_JOB_ID_SEPARATOR}{uuid.uuid4()}"
+
+
+def register_node():
+    """Record this node and its URL, or refresh its heartbeat. Blocking."""
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        node = db.query(Node).filter(Node.id == NODE_ID).first()
+        if node is None:
+            db.add(Node(id=NODE_ID, url=NODE_URL, started_at=now, heartbeat_at=now))
+        else:
+            node.url = NODE_URL
+            node.heartbeat_at = now
+        db.commit()
+    finally:
+        db.close()
+
+
+def deregister_node():
+    """Remove this node at shutdown, so others stop forwarding to it right away. Blocking."""
+    db = SessionLocal()
+    try:
+        db.query(Node).filter(Node.id == NODE_ID).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def periodic_heartbeat():
+    """Background task keeping this node's registration fresh."""
+    while True:
+        await asyncio.sleep(NODE_HEARTBEAT_SECONDS)
+        try:
+            await asyncio.to_thread(register_node)
+        except Exception as e:
+            log_event("node.heartbeat_failed", level="warning", error=str(e))
+
+
+def _owner_of(db, kind: str, key: str):
+    if kind == "job":
+        owner, separator, _ = key.partition(_JOB_ID_SEPARATOR)
+        return owner if separator else None
+    cached = _owners.get((kind, key))
+    if cached is not None:
+        return cached
+    if kind == "session":
+        row = db.query(SessionModel.node_id).filter(SessionModel.id == key).first()
+    else:
+        row = db.query(SessionModel.node_id).join(
+            ReviewModel, ReviewModel.session_id == SessionModel.id
+        ).filter(ReviewModel.id == key).first()
+    owner = row[0] if row else None
+    if owner is not None:
+        if len(_owners) >= _OWNER_CACHE_SIZE:
+            _owners.clear()
+        _owners[(kind, key)] = owner
+    return owner
+
+
+def _live_node_url(db, node_id: str):
+    cached = _node_urls.get(node_id)
+    if cached and time.monotonic() - cached[1] < _NODE_CACHE_SECONDS:
+        return cached[0]
+    alive_since = datetime.now(timezone.utc) - timedelta(seconds=NODE_TTL_SECONDS)
+    row = db.query(Node.url).filter(Node.id == node_id, Node.heartbeat_at >= alive_since).first()
+    url = row[0] if row else None
+    _node_urls[node_id] = (url, time.monotonic())
+    return url
+
+
+def owner_route(db, node_id: str):
+    """
+    Where requests for state owned by node_id go: ("local", None), ("remote", url)
+    or ("unavailable", None) when the owner has stopped sending heartbeats.
+    """
+    if not CLUSTER_ENABLED or node_id is None or node_id == NODE_ID:
+        return "local", None
+    url = _live_node_url(db, node_id)
+    return ("remote", url) if url else ("unavailable", None)
+
+
+def owned_key(path: str):
+    """(kind, key) when the request path is for a session, review or job, else None."""
+    for pattern, kind in OWNER_ROUTES:
+        match = pattern.match(path)
+        if match:
+            return kind, match.group("key")
+    return None
+
+
+def route_request(kind: str, key: str):
+    """owner_route for the session, review or job with this key. Blocking."""
+    db = SessionLocal()
+    try:
+        return owner_route(db, _owner_of(db, kind, key))
+    finally:
+        db.close()
+
+
+def _forward_headers(headers):
+    forwarded = [(name, value) for name, value in headers if name.lower() not in _HOP_BY_HOP]
+    forwarded.append((FORWARDED_HEADER, NODE_ID))
+    span = current_span()
+    if span is not None:
+        forwarded = [(name, value) for name, value in forwarded if name.lower() != "traceparent"]
+        forwarded.append(("traceparent", span.traceparent))
+    return forwarded
+
+
+def _client():
+    global _http_client
+    if _http_client is None:
+        # No read timeout: event streams stay open as long as the owner keeps them
+        _http_client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+    return _http_client
+
+
+async def forward_request(request, node_url: str):
+    """Send the request to the owning node and stream its response back."""
+    upstream_request = _client().build_request(
+        request.method,
+        f"{node_url}{request.url.path}",
+        params=request.url.query,
+        headers=_forward_headers(request.headers.items()),
+        content=request.stream(),
+    )
+    try:
+        upstream = await _client().send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        NODE_FORWARDS.inc(kind="http", outcome="failed")
+        log_event("node.forward_failed", level="warning", node_url=node_url, error=f"{type(e).__name__}: {e}")
+        return JSONResponse({"detail": "The server holding this repository is not responding"}, status_code=502)
+    NODE_FORWARDS.inc(kind="http", outcome="forwarded")
+    return StreamingResponse(
+        upstream.aiter_raw(),
+        status_code=upstream.status_code,
+        headers={name: value for name, value in upstream.headers.items() if name.lower() not in _RESPONSE_EXCLUDE},
+        background=BackgroundTask(upstream.aclose),
+    )
+
+
+async def proxy_websocket(websocket, node_url: str):
+    """Relay an accepted websocket to the same path on the owning node, both ways, until either side closes."""
+    target = re.sub(r"^http", "ws", node_url) + websocket.url.path
+    if websocket.url.query:
+        target += f"?{websocket.url.query}"
+    headers = [(name, value) for name, value in _forward_headers(websocket.headers.items())
+               if name.lower() in ("cookie", "traceparent", FORWARDED_HEADER)]
+    try:
+        upstream = await ws_client.connect(target, additional_headers=headers, open_timeout=10, max_size=None)
+    except Exception as e:
+        NODE_FORWARDS.inc(kind="websocket", outcome="failed")
+        log_event("node.forward_failed", level="warning", node_url=node_url, error=f"{type(e).__name__}: {e}")
+        await websocket.close(code=1011, reason="The server holding this repository is not responding")
+        return
+    NODE_FORWARDS.inc(kind="websocket", outcome="forwarded")
+
+    async def client_to_upstream():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+    async def upstream_to_client():
+        async for message in upstream:
+            if isinstance(message, str):
+                await websocket.send_text(message)
+            else:
+                await websocket.send_bytes(message)
+        await websocket.close(code=upstream.close_code or 1000, reason=upstream.close_reason or "")
+
+    relays = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(relays, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for relay in relays:
+            relay.cancel()
+        await asyncio.gather(*relays, return_exceptions=True)
+        await upstream.close()
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,203 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from app.database import SessionLocal
+from app.models import Review as ReviewModel
+from app.models import Session as SessionModel
+from app.models import User as UserModel
+from app.services.cluster import node_scoped_id
+from app.utils.event_stream import EventChannel
+from app.utils.git_utils import commit_changes, push_changes
+
+# Background approve/push jobs started by this process, by job id
+jobs = {}
+# Review ids with a job still queued or running
+_active_reviews = set()
+_job_tasks = set()
+
+JOB_RETENTION_SECONDS = 3600
+PUSH_MAX_ATTEMPTS = 4
+PUSH_BACKOFF_SECONDS = 2.0
+
+# git error output that means the push may succeed if retried
+_NETWORK_ERRORS = (
+    "could not resolve host",
+    "failed to connect",
+    "connection timed out",
+    "operation timed out",
+    "connection reset",
+    "early eof",
+    "the remote end hung up",
+    "rpc failed",
+    "unable to access",
+    "http 502",
+    "http 503",
+    "http 504",
+)
+
+
+def is_network_error(message: str):
+    message = (message or "").lower()
+    return any(pattern in message for pattern in _NETWORK_ERRORS)
+
+
+def has_active_job(review_id: str):
+    return review_id in _active_reviews
+
+
+def job_to_dict(job: dict):
+    return {key: value for key, value in job.items() if key != "channel"}
+
+
+def start_review_job(review_id: str, user_id: int, steps: list, commit_message: str = None, branch_name: str = None):
+    """
+    Run approve and/or push for a review in the background.
+    steps is ["approve"], ["push"] or ["approve", "push"]. Returns the job;
+    progress is published on job["channel"].
+    """
+    job_id = node_scoped_id()
+    job = {
+        "id": job_id,
+        "review_id": review_id,
+        "user_id": user_id,
+        "steps": steps,
+        "status": "queued",
+        "current_step": None,
+        "attempts": 0,
+        "result": {},
+        "error": None,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+        "channel": EventChannel(maxlen=100)
+    }
+    jobs[job_id] = job
+    _active_reviews.add(review_id)
+    _publish(job)
+
+    task = asyncio.create_task(_run_job(job, commit_message, branch_name))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return job
+
+
+def _publish(job: dict, **extra):
+    job["channel"].publish({
+        "type": "job_status",
+        "job_id": job["id"],
+        "status": job["status"],
+        "step": job["current_step"],
+        "attempts": job["attempts"],
+        "error": job["error"],
+        **extra
+    })
+
+
+async def _run_job(job: dict, commit_message: str, branch_name: str):
+    job["status"] = "running"
+    try:
+        for step in job["steps"]:
+            job["current_step"] = step
+            job["attempts"] = 0
+            _publish(job)
+            if step == "approve":
+                result = await asyncio.to_thread(_approve, job["review_id"], commit_message, branch_name)
+            else:
+                result = await _push_with_retries(job)
+            if "error" in result:
+                job["status"] = "failed"
+                job["error"] = result["error"]
+                break
+            job["result"][step] = result
+        else:
+            job["status"] = "succeeded"
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = f"Unexpected error: {str(e)}"
+    finally:
+        job["finished_at"] = datetime.now(timezone.utc).isoformat()
+        _active_reviews.discard(job["review_id"])
+        _publish(job, result=job["result"])
+        job["channel"].close()
+        asyncio.get_running_loop().call_later(JOB_RETENTION_SECONDS, jobs.pop, job["id"], None)
+
+
+async def _push_with_retries(job: dict):
+    """Push, retrying with exponential backoff while the failure looks like a network error."""
+    result = {}
+    for attempt in range(1, PUSH_MAX_ATTEMPTS + 1):
+        job["attempts"] = attempt
+        result = await asyncio.to_thread(_push, job["review_id"])
+        if "error" not in result or not is_network_error(result["error"]) or attempt == PUSH_MAX_ATTEMPTS:
+            return result
+        delay = PUSH_BACKOFF_SECONDS * 2 ** (attempt - 1)
+        _publish(job, retry_in_seconds=delay)
+        await asyncio.sleep(delay)
+    return result
+
+
+def _load(db, review_id: str):
+    review = db.query(ReviewModel).filter(ReviewModel.id == review_id).first()
+    if not review:
+        return None, None
+    session = db.query(SessionModel).filter(
+        SessionModel.id == review.session_id,
+        SessionModel.user_id == review.user_id
+    ).first()
+    return review, session
+
+
+def _approve(review_id: str, commit_message: str, branch_name: str = None):
+    db = SessionLocal()
+    try:
+        review, session = _load(db, review_id)
+        if not review or not session:
+            return {"error": "Review or session no longer exists"}
+        if review.status != "pending_review":
+            return {"error": "Review is not pending review"}
+
+        result = commit_changes(session.clone_path, commit_message, branch_name)
+        if "error" in result:
+            return result
+
+        review.status = "approved"
+        review.approved_at = datetime.now(timezone.utc)
+        review.commit_message = commit_message
+        review.branch_name = result.get("branch_name")
+        db.commit()
+        return {"commit_hash": result.get("commit_hash"), "branch_name": result.get("branch_name")}
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error approving review: {str(e)}"}
+    finally:
+        db.close()
+
+
+def _push(review_id: str):
+    db = SessionLocal()
+    try:
+        review, session = _load(db, review_id)
+        if not review or not session:
+            return {"error": "Review or session no longer exists"}
+        if review.status != "approved":
+            return {"error": "Review must be approved before pushing"}
+        user = db.query(UserModel).filter(UserModel.id == review.user_id).first()
+        if not user or not user.github_token:
+            return {"error": "GitHub token not found. Please re-authenticate."}
+
+        started_at = time.monotonic()
+        result = push_changes(session.clone_path, review.branch_name, user.github_token, session.repo_url)
+        if "error" in result:
+            return result
+
+        review.status = "pushed"
+        db.commit()
+        return {
+            "branch_name": result.get("branch_name"),
+            "repo_url": result.get("repo_url"),
+            "duration_seconds": round(time.monotonic() - started_at, 3)
+        }
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error pushing review: {str(e)}"}
+    finally:
+        db.close()
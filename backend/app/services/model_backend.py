@@ -0,0 +1,68 @@
+import os
+import threading
+import requests
+from app.config import FAKE_MODEL_TIMEOUT_SECONDS, FAKE_MODEL_URL, MODEL_BACKEND
+from app.services.model_cassette import ReplayBackend
+from app.utils.lazy_import import lazy_import
+
+genai = lazy_import("google.genai")
+types = lazy_import("google.genai.types")
+
+
+class GeminiBackend:
+    """Model calls go to the Gemini API."""
+
+    def __init__(self, api_key: str = None):
+        self.client = genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+
+    def generate_content(self, model: str, contents: list, config: "types.GenerateContentConfig"):
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+
+class HttpFakeBackend:
+    """
+    Model calls go to a local fake model server (see loadtest/fake_model_server.py),
+    which answers with scripted function calls and text. For load tests without API quota.
+    """
+
+    def __init__(self, base_url: str = None, timeout: float = None):
+        self.base_url = (base_url or FAKE_MODEL_URL).rstrip("/")
+        self.timeout = timeout or FAKE_MODEL_TIMEOUT_SECONDS
+        self._http = requests.Session()
+        # Shared by every run in the process; keep a connection per concurrent call
+        self._http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=64))
+
+    def generate_content(self, model: str, contents: list, config: "types.GenerateContentConfig" = None):
+        payload = {
+            "model": model,
+            "contents": [content.model_dump(mode="json", exclude_none=True) for content in contents],
+        }
+        response = self._http.post(f"{self.base_url}/generate", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return types.GenerateContentResponse.model_validate(response.json())
+
+
+_BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": HttpFakeBackend,
+    "replay": ReplayBackend,
+}
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_model_backend(name: str = None):
+    """
+    The model backend selected by MODEL_BACKEND (gemini, fake or replay). One instance
+    per process, created on first use, so its client and connection pool are shared;
+    backends with per-run state (replay) get a new instance per call.
+    """
+    name = (name or MODEL_BACKEND).lower()
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown model backend: {name}")
+    if not getattr(_BACKENDS[name], "shared", True):
+        return _BACKENDS[name]()
+    with _instances_lock:
+        if name not in _instances:
+            _instances[name] = _BACKENDS[name]()
+        return _instances[name]
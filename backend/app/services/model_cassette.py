@@ -0,0 +1,219 @@
+"""
+Record and replay of model interactions.
+
+CassetteRecorder wraps a model backend and appends each generate_content request and
+response of a run to a cassette, a gzipped JSON-lines file. Requests only store the
+contents added since the previous call, and the config only when it changes, since a
+run resends its whole history every call. Each line is its own gzip member, so a
+cassette is readable up to the last call even if the process died mid-run.
+
+ReplayBackend serves a cassette's responses back in order (MODEL_BACKEND=replay), so
+a run can be reproduced, or the agent loop benchmarked, with identical model behaviour
+and no API calls (see benchmarks/agent_loop.py).
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from app.config import MODEL_RECORD_DIR, MODEL_REPLAY_CASSETTE, MODEL_REPLAY_STRICT
+from app.utils.event_log import log_event
+from app.utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+
+CASSETTE_VERSION = 1
+# Transport details, not model behaviour
+_RESPONSE_EXCLUDE = {"sdk_http_response"}
+
+
+class CassetteError(Exception):
+    pass
+
+
+class CassetteExhausted(CassetteError):
+    pass
+
+
+class CassetteMismatch(CassetteError):
+    pass
+
+
+def cassette_path(run_id: str, directory: str = None):
+    return os.path.join(directory or MODEL_RECORD_DIR, f"{run_id}.jsonl.gz")
+
+
+def _dump(model):
+    return model.model_dump(mode="json", exclude_none=True)
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _shape(content: dict):
+    """The role and the kinds of parts of a content, ignoring text and tool output."""
+    kinds = []
+    for part in content.get("parts", []):
+        if "function_call" in part:
+            kinds.append(f"call:{part['function_call'].get('name')}")
+        elif "function_response" in part:
+            kinds.append(f"response:{part['function_response'].get('name')}")
+        else:
+            kinds.append("text")
+    return f"{content.get('role')}[{','.join(kinds)}]"
+
+
+class CassetteRecorder:
+    """Wraps a model backend and records each call to a cassette. Recording problems never fail the run."""
+
+    def __init__(self, backend, path: str, run_info: dict = None):
+        self.backend = backend
+        self.path = path
+        self.run_info = run_info or {}
+        self._index = 0
+        self._sent = 0
+        self._config_digest = None
+        self._disabled = False
+        self._lock = threading.Lock()
+
+    def generate_content(self, model: str, contents: list, config: "types.GenerateContentConfig" = None):
+        started_at = time.perf_counter()
+        try:
+            response = self.backend.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            self._record(model, contents, config, None, f"{type(e).__name__}: {e}", time.perf_counter() - started_at)
+            raise
+        self._record(model, contents, config, response, None, time.perf_counter() - started_at)
+        return response
+
+    def _record(self, model, contents, config, response, error, elapsed):
+        with self._lock:
+            if self._disabled:
+                return
+            try:
+                records = []
+                if self._index == 0:
+                    records.append({
+                        "kind": "run",
+                        "version": CASSETTE_VERSION,
+                        "recorded_at": datetime.now(timezone.utc).isoformat(),
+                        **self.run_info,
+                    })
+                contents_from = self._sent if len(contents) >= self._sent else 0
+                record = {
+                    "kind": "interaction",
+                    "index": self._index,
+                    "model": model,
+                    "contents_from": contents_from,
+                    "contents": [_dump(content) for content in contents[contents_from:]],
+                    "response": response.model_dump(mode="json", exclude_none=True, exclude=_RESPONSE_EXCLUDE) if response is not None else None,
+                    "error": error,
+                    "elapsed_seconds": round(elapsed, 4),
+                }
+                if config is not None:
+                    config_dump = _dump(config)
+                    record["config_digest"] = _digest(config_dump)
+                    if record["config_digest"] != self._config_digest:
+                        record["config"] = config_dump
+                        self._config_digest = record["config_digest"]
+                records.append(record)
+
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with gzip.open(self.path, "at", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(item, separators=(",", ":")) + "\n" for item in records))
+                self._index += 1
+                self._sent = len(contents)
+            except Exception as e:
+                self._disabled = True
+                log_event("cassette.record_failed", level="warning", path=self.path, error=str(e))
+
+
+def load_cassette(path: str):
+    """
+    {"run": header, "interactions": [...]} with each interaction's full request contents
+    and config rebuilt. A cassette cut off mid-write is read up to its last complete call.
+    """
+    run = {}
+    interactions = []
+    contents = []
+    configs = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["kind"] == "run":
+                    run = record
+                elif record["kind"] == "interaction":
+                    contents = contents[:record["contents_from"]] + record["contents"]
+                    if "config" in record:
+                        configs[record["config_digest"]] = record["config"]
+                    interactions.append({**record, "contents": contents, "config": configs.get(record.get("config_digest"))})
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError):
+            pass
+    return {"run": run, "interactions": interactions}
+
+
+class ReplayBackend:
+    """
+    Serves the responses recorded in a cassette, in order, without calling a model.
+    Recorded failures are raised again. Each instance replays the cassette once.
+
+    By default a call only has to match the recording's sequence of roles and tool
+    calls; strict mode requires the request contents to be identical.
+    """
+    # Holds a position in the cassette, so every agent service gets its own
+    shared = False
+
+    def __init__(self, path: str = None, strict: bool = None, replay_latency: bool = False):
+        self.path = path or MODEL_REPLAY_CASSETTE
+        if not self.path:
+            raise ValueError("MODEL_REPLAY_CASSETTE is not set")
+        cassette = load_cassette(self.path)
+        self.run = cassette["run"]
+        self.interactions = cassette["interactions"]
+        self.strict = MODEL_REPLAY_STRICT if strict is None else strict
+        self.replay_latency = replay_latency
+        self.position = 0
+        self.mismatches = []
+        self._lock = threading.Lock()
+
+    def _difference(self, recorded: list, contents: list):
+        """Where the request first differs from the recorded one, or None."""
+        if self.strict:
+            for i, (expected, actual) in enumerate(zip(recorded, contents)):
+                if expected != actual:
+                    return f"content {i} differs ({_shape(expected)})"
+        else:
+            for i, (expected, actual) in enumerate(zip(recorded, contents)):
+                if _shape(expected) != _shape(actual):
+                    return f"content {i}: recorded {_shape(expected)}, got {_shape(actual)}"
+        if len(recorded) != len(contents):
+            return f"recorded {len(recorded)} contents, got {len(contents)}"
+        return None
+
+    def generate_content(self, model: str, contents: list, config: "types.GenerateContentConfig" = None):
+        with self._lock:
+            if self.position >= len(self.interactions):
+                raise CassetteExhausted(f"Cassette {self.path} has no response for call {self.position + 1}")
+            recorded = self.interactions[self.position]
+            self.position += 1
+
+        difference = self._difference(recorded["contents"], [_dump(content) for content in contents])
+        if difference:
+            self.mismatches.append({"call": recorded["index"] + 1, "difference": difference})
+            if self.strict:
+                raise CassetteMismatch(f"Call {recorded['index'] + 1} does not match the cassette: {difference}")
+            log_event("cassette.replay_mismatch", level="warning", path=self.path,
+                      call=recorded["index"] + 1, difference=difference)
+
+        if self.replay_latency:
+            time.sleep(recorded["elapsed_seconds"])
+        if recorded.get("error"):
+            raise CassetteError(f"Recorded model call failed: {recorded['error']}")
+        return types.GenerateContentResponse.model_validate(recorded["response"])
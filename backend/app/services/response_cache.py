@@ -0,0 +1,118 @@
+"""
+Exact-match cache of agent answers to read-only prompts.
+
+A run is keyed on the user, the normalized prompt, a digest of the conversation history
+before it, the HEAD commit, the tree hash of the working tree (the run's step 0 snapshot,
+so uncommitted edits are covered) and a digest of the model, system prompt and tool
+declarations. Only completed runs that used read-only tools, read only tracked files and
+left the tree unchanged are stored, so a hit returns the same answer and tool transcript
+the agent would most likely produce again, without any model calls. Entries are never
+shared between users or conversations: transcripts hold file contents, and answers can
+depend on earlier messages. Clients can bypass the lookup per prompt.
+
+Entries live in this process, bounded by RESPONSE_CACHE_MAX_ENTRIES (least recently
+used first out) and RESPONSE_CACHE_TTL_SECONDS; a TTL of 0 turns the cache off.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from app.config import AGENT_MODEL, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+from app.utils.git_utils import find_untracked_paths
+from app.utils.metrics import Gauge, RESPONSE_CACHE_LOOKUPS
+
+# Tools that only read the clone; a run that used anything else is never stored
+READ_ONLY_TOOLS = {"get_files_info", "get_file_content", "get_file_overview", "search_in_file"}
+# Ignored files are not in the step 0 tree hash, so runs that read them are never stored
+FILE_READING_TOOLS = {"get_file_content", "get_file_overview", "search_in_file"}
+CACHE_ENABLED = RESPONSE_CACHE_TTL_SECONDS > 0
+
+
+def normalize_prompt(prompt: str):
+    return re.sub(r"\s+", " ", prompt).strip().casefold()
+
+
+def cache_key(user_id: int, prompt: str, history_digest: str, commit_hash: str, tree_hash: str, config_digest: str):
+    parts = [str(user_id), normalize_prompt(prompt), history_digest, commit_hash, tree_hash, AGENT_MODEL, config_digest]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def history_digest(messages: list):
+    """Digest of a conversation as (role, text) pairs, oldest first."""
+    return hashlib.sha256(json.dumps(messages).encode()).hexdigest()
+
+
+def config_digest(system_prompt: str, tool_schemas: list, max_iterations: int):
+    """Digest of everything besides the repository that shapes a run's answer."""
+    return hashlib.sha256(json.dumps(
+        [system_prompt, tool_schemas, max_iterations], sort_keys=True, default=str
+    ).encode()).hexdigest()
+
+
+def is_cacheable(function_calls: list, step_checkpoints: list):
+    """A run can be stored when it only read files and its working tree never changed."""
+    return len(step_checkpoints) == 1 and all(call["function_name"] in READ_ONLY_TOOLS for call in function_calls)
+
+
+def reads_only_tracked_files(working_directory: str, function_calls: list):
+    """
+    True when no call read an untracked or ignored file (such as .env), or listed a
+    directory that contains one. Blocking; run it in a worker thread.
+    """
+    file_paths, directories = [], []
+    for call in function_calls:
+        arguments = call["arguments"] or {}
+        if call["function_name"] in FILE_READING_TOOLS:
+            file_paths.append(arguments.get("file_path", ""))
+        elif call["function_name"] == "get_files_info":
+            directories.append(arguments.get("directory", "."))
+    if not file_paths and not directories:
+        return True
+    result = find_untracked_paths(working_directory, file_paths, directories)
+    return "error" not in result and not result["untracked"]
+
+
+class ResponseCache:
+    """LRU map of cache keys to stored answers, with a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (stored_at, entry)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                RESPONSE_CACHE_LOOKUPS.inc(outcome="miss")
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                RESPONSE_CACHE_LOOKUPS.inc(outcome="expired")
+                return None
+            self._entries.move_to_end(key)
+            RESPONSE_CACHE_LOOKUPS.inc(outcome="hit")
+            return entry
+
+    def put(self, key: str, entry: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
+Gauge("response_cache_entries", "Answers held in the response cache.", collect=lambda: len(response_cache))
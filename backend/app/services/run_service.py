@@ -0,0 +1,137 @@
+import asyncio
+import time
+import uuid
+from datetime import datetime, timezone
+from fastapi import HTTPException
+from app.database import SessionLocal, get_redis
+from app.services.agent_service import GeminiAgentService
+from app.utils.admission import admission
+from app.utils.event_log import log_context, log_event
+from app.utils.event_stream import EventChannel
+from app.utils.metrics import WEBSOCKET_PROMPT_SECONDS
+from app.utils.tracing import span
+
+# Agent runs started by this process, by run id. A run keeps going when its websocket
+# drops; its events stay in the run's channel for viewers and reconnecting clients.
+runs = {}
+# The latest run of each session, by session id
+_session_runs = {}
+_run_tasks = set()
+
+RUN_RETENTION_SECONDS = 600
+# Tool output lines kept per run; other run events are always kept
+RUN_EVENT_BUFFER = 2000
+
+
+def active_run(session_id: str):
+    """The session's run that is still in progress, or None."""
+    run = runs.get(_session_runs.get(session_id))
+    if run is None or run["status"] != "running":
+        return None
+    return run
+
+
+def run_to_dict(run: dict):
+    return {key: value for key, value in run.items() if key != "channel"}
+
+
+def start_run(session_id: str, user_id: int, prompt: str, trace_parent=None, use_cache: bool = True):
+    """
+    Run the agent on a prompt in the background, once admission control lets it start.
+    Returns the run; its updates are published on run["channel"], each with run_id and a
+    sequence event_id. Raises AdmissionRejected when the run queue is full.
+    """
+    run_id = str(uuid.uuid4())
+    run = {
+        "id": run_id,
+        "session_id": session_id,
+        "user_id": user_id,
+        "status": "running",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None,
+        "channel": EventChannel(maxlen=RUN_EVENT_BUFFER, bounded_types={"tool_output"}),
+    }
+    _publish(run, {"type": "run_started"})
+    ticket = admission.submit(user_id, on_position=lambda position, queued: _publish(run, {
+        "type": "queued",
+        "position": position,
+        "queued": queued,
+        "message": f"Waiting for a free agent slot (position {position} of {queued})"
+    }))
+    runs[run_id] = run
+    _session_runs[session_id] = run_id
+
+    task = asyncio.create_task(_run_agent(run, ticket, prompt, trace_parent, use_cache))
+    _run_tasks.add(task)
+    task.add_done_callback(_run_tasks.discard)
+    return run
+
+
+def _publish(run: dict, update: dict):
+    run["channel"].publish({**update, "run_id": run["id"]})
+
+
+async def _run_agent(run: dict, ticket, prompt: str, trace_parent, use_cache: bool):
+    session_id = run["session_id"]
+    db = None
+    redis = None
+
+    with log_context(run_id=run["id"]), span("ws.prompt", kind="server", parent=trace_parent,
+                                             session_id=session_id, run_id=run["id"]) as prompt_span:
+        log_event("ws.prompt_started", prompt_chars=len(prompt))
+        prompt_started_at = time.perf_counter()
+        outcome = "error"
+        update_count = 0
+        admitted = False
+        try:
+            queue_wait = await admission.wait(ticket)
+            admitted = True
+            prompt_span.set_attributes(queue_wait_ms=round(queue_wait * 1000, 1))
+            if queue_wait > 0.001:
+                log_event("run.admitted", queue_wait_ms=round(queue_wait * 1000, 1))
+                _publish(run, {"type": "admitted", "queue_wait_seconds": round(queue_wait, 3)})
+
+            # Connections are only taken once the run may start
+            db = SessionLocal()
+            try:
+                redis = next(get_redis())
+            except Exception as redis_error:
+                log_event("run.redis_unavailable", level="warning", error=str(redis_error))
+            async for update in GeminiAgentService().execute(prompt, session_id, db=db, redis=redis, use_cache=use_cache):
+                update_count += 1
+                log_event("ws.update_sent", level="debug", seq=update_count,
+                          type=update.get("type"), status=update.get("status"))
+                _publish(run, update)
+            outcome = "completed"
+        except HTTPException as http_error:
+            outcome = "rejected"
+            log_event("ws.prompt_rejected", level="warning", status_code=http_error.status_code, reason=http_error.detail)
+            _publish(run, {"type": "error", "status": "error", "message": http_error.detail})
+        except Exception as agent_error:
+            log_event("ws.agent_failed", level="error", exc_info=True, error=f"{type(agent_error).__name__}: {agent_error}")
+            _publish(run, {"type": "error", "status": "error", "message": f"Agent execution failed: {str(agent_error)}"})
+        finally:
+            if admitted:
+                admission.release(ticket)
+            duration = time.perf_counter() - prompt_started_at
+            WEBSOCKET_PROMPT_SECONDS.observe(duration, outcome=outcome)
+            prompt_span.set_attributes(outcome=outcome, updates=update_count)
+            if outcome == "error":
+                prompt_span.set_error("agent execution failed")
+            log_event("ws.prompt_finished", outcome=outcome, updates=update_count, duration_ms=round(duration * 1000, 1))
+
+            run["status"] = outcome
+            run["finished_at"] = datetime.now(timezone.utc).isoformat()
+            _publish(run, {"type": "run_finished", "outcome": outcome})
+            run["channel"].close()
+            asyncio.get_running_loop().call_later(RUN_RETENTION_SECONDS, _forget, run["id"])
+            if db:
+                db.close()
+            if redis:
+                redis.close()
+
+
+def _forget(run_id: str):
+    run = runs.pop(run_id, None)
+    if run is not None and _session_runs.get(run["session_id"]) == run_id:
+        del _session_runs[run["session_id"]]
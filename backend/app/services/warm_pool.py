@@ -0,0 +1,277 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.config import (
+    CLONE_ROOT_DIR, NODE_ID, USER_DISK_QUOTA_BYTES, WARM_POOL_LOOKBACK_DAYS,
+    WARM_POOL_MAX_SESSIONS, WARM_POOL_REFRESH_SECONDS, WARM_POOL_SIZE
+)
+from app.database import SessionLocal
+from app.services.cluster import local_sessions
+from app.models import RepoHistory
+from app.models import Session as SessionModel
+from app.utils.disk_usage import refresh_session_usage, user_disk_usage
+from app.utils.event_log import log_event
+from app.utils.file_cleanup import cleanup_session
+from app.utils.repo_cache import create_clone, refresh_clone
+from app.utils.session_activity import as_utc, session_expiry
+
+# One pool fill at a time
+_fill_lock = threading.Lock()
+# Users waiting for a fill (None: everyone), drained by periodic_fill. Requests for the
+# same user coalesce, so a burst of clones costs one fill and one worker thread.
+_pending_fills = set()
+_fill_requested = None
+
+# A warm clone older than this is not handed out; a normal clone is started instead
+MAX_STALENESS_SECONDS = 2 * WARM_POOL_REFRESH_SECONDS
+# A warm clone being refreshed is "warm_refreshing", which claims skip
+WARM_STATUSES = ("warm", "warm_refreshing")
+
+
+def record_repo_open(db, user_id: int, repo_id: int, repo_name: str, repo_url: str):
+    """Remember that a user opened a repository; the pool warms the most recent ones."""
+    now = datetime.now(timezone.utc)
+    for attempt in range(2):
+        history = db.query(RepoHistory).filter(
+            RepoHistory.user_id == user_id,
+            RepoHistory.repo_url == repo_url
+        ).first()
+        if history is None:
+            history = RepoHistory(user_id=user_id, repo_url=repo_url, open_count=0)
+            db.add(history)
+        history.repo_id = repo_id
+        history.repo_name = repo_name
+        history.open_count = (history.open_count or 0) + 1
+        history.last_opened_at = now
+        try:
+            db.commit()
+            return
+        except IntegrityError:
+            # A concurrent request inserted the row first; update that one instead
+            db.rollback()
+            if attempt:
+                raise
+
+
+def claim_warm_session(db, user_id: int, repo_url: str):
+    """
+    Hand a fresh warm clone of repo_url to the user as a ready session.
+    Returns the session, or None if there is no usable warm clone.
+    """
+    if WARM_POOL_SIZE <= 0:
+        return None
+    now = datetime.now(timezone.utc)
+    warm = db.query(SessionModel).filter(
+        local_sessions(),
+        SessionModel.user_id == user_id,
+        SessionModel.repo_url == repo_url,
+        SessionModel.status == "warm",
+        SessionModel.last_activity_at >= now - timedelta(seconds=MAX_STALENESS_SECONDS)
+    ).order_by(SessionModel.last_activity_at.desc()).first()
+    if warm is None or not os.path.isdir(warm.clone_path):
+        return None
+
+    # Conditional update, so two workers cannot hand out the same clone
+    claimed = db.query(SessionModel).filter(
+        SessionModel.id == warm.id,
+        SessionModel.status == "warm"
+    ).update({
+        SessionModel.status: "ready",
+        SessionModel.created_at: now,
+        SessionModel.last_activity_at: now,
+        SessionModel.expires_at: session_expiry(now, now)
+    }, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return None
+    db.refresh(warm)
+    return warm
+
+
+def _warm_expiry(now: datetime):
+    # Warm clones the pool stops refreshing are picked up by the expired-session cleanup
+    return now + timedelta(seconds=2 * WARM_POOL_REFRESH_SECONDS)
+
+
+def _refresh_warm(db, session, now: datetime):
+    # Take the clone out of the pool first, with the same conditional update a claim
+    # uses, so it cannot be handed to a user while it is being reset
+    leased = db.query(SessionModel).filter(
+        SessionModel.id == session.id,
+        SessionModel.status == "warm"
+    ).update({SessionModel.status: "warm_refreshing"}, synchronize_session=False)
+    db.commit()
+    if not leased:
+        return False  # claimed since the pool listed it
+    result = refresh_clone(session.repo_url, session.clone_path)
+    if "error" in result:
+        log_event("warm_pool.refresh_failed", level="warning", session_id=session.id, error=result["error"])
+        cleanup_session(session.id, db)
+        return False
+    db.query(SessionModel).filter(
+        SessionModel.id == session.id,
+        SessionModel.status == "warm_refreshing"
+    ).update({
+        SessionModel.status: "warm",
+        SessionModel.last_activity_at: now,
+        SessionModel.expires_at: _warm_expiry(now)
+    }, synchronize_session=False)
+    db.commit()
+    refresh_session_usage(session.id, dedupe=False)
+    return True
+
+
+def _create_warm(db, history, now: datetime):
+    session_id = str(uuid.uuid4())
+    clone_path = os.path.join(CLONE_ROOT_DIR, f"repo_{session_id}")
+    result = create_clone(history.repo_url, clone_path)
+    if "error" in result:
+        log_event("warm_pool.clone_failed", level="warning", repo_url=history.repo_url, error=result["error"])
+        return False
+    db.add(SessionModel(
+        id=session_id,
+        user_id=history.user_id,
+        repo_id=history.repo_id,
+        repo_name=history.repo_name,
+        repo_url=history.repo_url,
+        clone_path=clone_path,
+        created_at=now,
+        last_activity_at=now,
+        expires_at=_warm_expiry(now),
+        status="warm",
+        node_id=NODE_ID
+    ))
+    db.commit()
+    refresh_session_usage(session_id)
+
+    # Warm clones never push a user over quota; drop it if it did not fit
+    if USER_DISK_QUOTA_BYTES and user_disk_usage(db, history.user_id, include_warm=True) > USER_DISK_QUOTA_BYTES:
+        cleanup_session(session_id, db)
+        return False
+    return True
+
+
+def fill_warm_pool(user_id: int = None):
+    """
+    Keep warm clones of each user's WARM_POOL_SIZE most recently opened repositories:
+    refresh existing ones, clone missing ones, and drop ones that fell out of the
+    list. Repositories the user already has open are skipped.
+    Blocking; run it in a worker thread.
+    """
+    if WARM_POOL_SIZE <= 0:
+        return {"message": "Warm pool disabled"}
+
+    with _fill_lock:
+        db = SessionLocal()
+        try:
+            now = datetime.now(timezone.utc)
+            since = now - timedelta(days=WARM_POOL_LOOKBACK_DAYS)
+            if user_id is None:
+                user_ids = [uid for (uid,) in db.query(RepoHistory.user_id).filter(
+                    RepoHistory.last_opened_at >= since
+                ).distinct().all()]
+            else:
+                user_ids = [user_id]
+
+            counts = {"created": 0, "refreshed": 0, "removed": 0}
+            total_warm = db.query(SessionModel).filter(local_sessions(), SessionModel.status.in_(WARM_STATUSES)).count()
+            for uid in user_ids:
+                wanted = db.query(RepoHistory).filter(
+                    RepoHistory.user_id == uid,
+                    RepoHistory.last_opened_at >= since
+                ).order_by(RepoHistory.last_opened_at.desc()).limit(WARM_POOL_SIZE).all()
+                wanted_urls = {history.repo_url for history in wanted}
+
+                warm = {}
+                for session in db.query(SessionModel).filter(
+                    local_sessions(),
+                    SessionModel.user_id == uid,
+                    SessionModel.status.in_(WARM_STATUSES)
+                ).all():
+                    # Fills run one at a time, so a clone still marked warm_refreshing
+                    # was left half-refreshed by a restart
+                    if session.status == "warm" and session.repo_url in wanted_urls and session.repo_url not in warm:
+                        warm[session.repo_url] = session
+                    else:
+                        cleanup_session(session.id, db)
+                        counts["removed"] += 1
+                        total_warm -= 1
+
+                open_urls = {url for (url,) in db.query(SessionModel.repo_url).filter(
+                    SessionModel.user_id == uid,
+                    or_(SessionModel.status.is_(None), SessionModel.status.in_(("ready", "cloning")))
+                ).all()}
+
+                for history in wanted:
+                    session = warm.get(history.repo_url)
+                    if session is not None:
+                        refreshed_at = as_utc(session.last_activity_at)
+                        if refreshed_at and (now - refreshed_at).total_seconds() < WARM_POOL_REFRESH_SECONDS / 2:
+                            continue
+                        if _refresh_warm(db, session, now):
+                            counts["refreshed"] += 1
+                        else:
+                            counts["removed"] += 1
+                            total_warm -= 1
+                        continue
+                    if history.repo_url in open_urls or total_warm >= WARM_POOL_MAX_SESSIONS:
+                        continue
+                    if USER_DISK_QUOTA_BYTES and user_disk_usage(db, uid, include_warm=True) >= USER_DISK_QUOTA_BYTES:
+                        continue
+                    if _create_warm(db, history, now):
+                        counts["created"] += 1
+                        total_warm += 1
+
+            return {"message": "Warm pool: {created} created, {refreshed} refreshed, {removed} removed".format(**counts), **counts}
+        except Exception as e:
+            db.rollback()
+            return {"error": f"Error filling warm pool: {str(e)}"}
+        finally:
+            db.close()
+
+
+def schedule_fill(user_id: int = None):
+    """Ask the background fill task to fill the warm pool soon (for one user, or everyone)."""
+    if WARM_POOL_SIZE <= 0:
+        return
+    _pending_fills.add(user_id)
+    if _fill_requested is not None:
+        _fill_requested.set()
+
+
+async def _fill(user_id: int = None):
+    try:
+        result = await asyncio.to_thread(fill_warm_pool, user_id)
+        if "error" in result:
+            log_event("warm_pool.fill_failed", level="error", user_id=user_id, error=result["error"])
+        elif result.get("created") or result.get("removed"):
+            log_event("warm_pool.filled", user_id=user_id, created=result.get("created"), removed=result.get("removed"))
+    except Exception as e:
+        log_event("warm_pool.fill_failed", level="error", exc_info=True, user_id=user_id, error=str(e))
+
+
+async def periodic_fill():
+    """
+    Background task keeping the warm pool filled and fresh: a full fill every
+    WARM_POOL_REFRESH_SECONDS, and in between one fill per user asked for by schedule_fill.
+    """
+    global _fill_requested
+    _fill_requested = asyncio.Event()
+    next_full_fill_at = 0.0
+    while WARM_POOL_SIZE > 0:
+        if time.monotonic() >= next_full_fill_at or None in _pending_fills:
+            _pending_fills.clear()
+            await _fill()
+            next_full_fill_at = time.monotonic() + WARM_POOL_REFRESH_SECONDS
+        while _pending_fills and None not in _pending_fills:
+            await _fill(_pending_fills.pop())
+        try:
+            await asyncio.wait_for(_fill_requested.wait(), timeout=max(0.0, next_full_fill_at - time.monotonic()))
+        except asyncio.TimeoutError:
+            pass
+        _fill_requested.clear()
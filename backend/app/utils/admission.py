@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import math
+import time
+from app import config
+from app.utils.metrics import Gauge, RUN_QUEUE_SECONDS, RUNS_SHED
+
+
+class AdmissionRejected(Exception):
+    """The run queue is full. retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("owner", "seq", "future", "on_position", "position", "queued_at", "started_at")
+
+    def __init__(self, owner, seq: int, future, on_position):
+        self.owner = owner
+        self.seq = seq
+        self.future = future
+        self.on_position = on_position
+        self.position = None
+        self.queued_at = time.monotonic()
+        self.started_at = None
+
+
+class AdmissionController:
+    """
+    Limits how many agent runs execute at once, across the server and per user.
+    Waiting runs are admitted in weighted fair order: each user's next run is tagged
+    with the share of runs the user has already had (runs / weight), and the lowest
+    tag goes first, so a user with many queued prompts cannot starve the others.
+    A user who was idle starts level with the least-served active user rather than banking credit.
+    Runs beyond the queue limits are refused with a retry-after hint. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_running: int, max_per_user: int = 0, max_queued: int = 0,
+                 max_queued_per_user: int = 0, weights: dict = None):
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.weights = weights or {}
+        self._running = {}  # owner -> runs holding a slot
+        self._waiting = []  # tickets in arrival order
+        self._served = {}  # owner -> virtual service (runs admitted / weight)
+        self._seq = itertools.count()
+        # Smoothed run duration, for retry-after hints
+        self._avg_run_seconds = 30.0
+
+    @property
+    def running(self):
+        return sum(self._running.values())
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+    def _weight(self, owner):
+        return max(self.weights.get(str(owner), 1.0), 0.01)
+
+    def _queued_by(self, owner):
+        return sum(1 for ticket in self._waiting if ticket.owner == owner)
+
+    def retry_after(self):
+        """Seconds until the queue has likely moved on, from the average run length."""
+        slots = self.max_running or 1
+        return max(1, math.ceil(self._avg_run_seconds * (self.queued + 1) / slots))
+
+    def submit(self, owner, on_position=None):
+        """
+        Queue a run for owner. Returns a ticket to wait() on; on_position(position, queued)
+        is called whenever its place in the queue changes. Raises AdmissionRejected when full.
+        """
+        if self.max_queued and self.queued >= self.max_queued:
+            RUNS_SHED.inc(reason="queue_full")
+            raise AdmissionRejected("The server is busy. Please try again shortly.", self.retry_after())
+        if self.max_queued_per_user and self._queued_by(owner) >= self.max_queued_per_user:
+            RUNS_SHED.inc(reason="user_queue_full")
+            raise AdmissionRejected("You have too many prompts waiting. Please wait for them to finish.", self.retry_after())
+
+        if owner not in self._served:
+            # Only owners with runs running or queued are tracked
+            self._served[owner] = min(self._served.values(), default=0.0)
+        ticket = _Ticket(owner, next(self._seq), asyncio.get_running_loop().create_future(), on_position)
+        self._waiting.append(ticket)
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: _Ticket):
+        """Wait until the ticket's run may start. Returns the seconds spent queued."""
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Admitted just as we were cancelled; give the slot back
+                self.release(ticket)
+            else:
+                self._waiting.remove(ticket)
+                self._forget_if_idle(ticket.owner)
+                self._dispatch()
+            raise
+        wait = ticket.started_at - ticket.queued_at
+        RUN_QUEUE_SECONDS.observe(wait)
+        return wait
+
+    def release(self, ticket: _Ticket):
+        """The run has finished: free its slot and admit the next."""
+        self._running[ticket.owner] -= 1
+        if not self._running[ticket.owner]:
+            del self._running[ticket.owner]
+        self._avg_run_seconds = 0.8 * self._avg_run_seconds + 0.2 * (time.monotonic() - ticket.started_at)
+        self._forget_if_idle(ticket.owner)
+        self._dispatch()
+
+    def _forget_if_idle(self, owner):
+        if owner not in self._running and not any(ticket.owner == owner for ticket in self._waiting):
+            self._served.pop(owner, None)
+
+    def _order(self):
+        """Waiting tickets in the order they would be admitted, ignoring per-user limits."""
+        tags = {}
+        counts = {}
+        for ticket in self._waiting:
+            counts[ticket.owner] = counts.get(ticket.owner, 0) + 1
+            tags[ticket.seq] = self._served[ticket.owner] + counts[ticket.owner] / self._weight(ticket.owner)
+        return sorted(self._waiting, key=lambda ticket: (tags[ticket.seq], ticket.seq))
+
+    def _dispatch(self):
+        order = self._order()
+        for ticket in list(order):
+            if self.max_running and self.running >= self.max_running:
+                break
+            if self.max_per_user and self._running.get(ticket.owner, 0) >= self.max_per_user:
+                continue
+            order.remove(ticket)
+            self._waiting.remove(ticket)
+            self._running[ticket.owner] = self._running.get(ticket.owner, 0) + 1
+            self._served[ticket.owner] += 1 / self._weight(ticket.owner)
+            ticket.started_at = time.monotonic()
+            if not ticket.future.done():
+                ticket.future.set_result(None)
+
+        for position, ticket in enumerate(order, start=1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position is not None:
+                    ticket.on_position(position, len(order))
+
+    def stats(self):
+        return {
+            "max_running": self.max_running,
+            "running": self.running,
+            "queued": self.queued,
+            "running_by_owner": {str(owner): count for owner, count in self._running.items()},
+            "queued_by_owner": {str(ticket.owner): self._queued_by(ticket.owner) for ticket in self._waiting},
+            "avg_run_seconds": round(self._avg_run_seconds, 3),
+        }
+
+
+admission = AdmissionController(
+    config.RUN_MAX_CONCURRENT, config.RUN_MAX_PER_USER, config.RUN_MAX_QUEUED,
+    config.RUN_MAX_QUEUED_PER_USER, config.RUN_USER_WEIGHTS
+)
+
+Gauge("agent_runs_running", "Agent runs holding an admission slot.", collect=lambda: admission.running)
+Gauge("agent_runs_queued", "Agent runs waiting for an admission slot.", collect=lambda: admission.queued)
@@ -0,0 +1,278 @@
+import errno
+import fcntl
+import filecmp
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import func, not_, or_
+from app.config import DEDUP_MIN_FILE_BYTES, DISK_FULL_RESCAN_SECONDS, INSTALL_QUOTA_RESERVE_BYTES, USER_DISK_QUOTA_BYTES
+from app.database import SessionLocal
+from app.models import Session as SessionModel
+from app.services.cluster import local_sessions, orphaned_sessions
+from app.utils.event_log import log_event
+from app.utils.session_activity import as_utc
+
+# ioctl(2) request for copy-on-write file clones (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Package managers and the sub-commands that download into the clone
+_INSTALL_COMMANDS = {
+    "pip": {"install"},
+    "pip3": {"install"},
+    "python": {"install"},
+    "python3": {"install"},
+    "uv": {"install", "sync", "add"},
+    "poetry": {"install", "add"},
+    "npm": {"install", "i", "ci", "add"},
+    "yarn": {"install", "add"},
+    "pnpm": {"install", "i", "add"},
+    "bun": {"install", "i", "add"},
+}
+
+
+def directory_size(path: str):
+    """
+    Bytes allocated on disk under path. A file hardlinked n times is charged
+    1/n of its size, so space shared between clones is split between them.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                continue
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            total += st.st_blocks * 512 // max(st.st_nlink, 1)
+    return total
+
+
+# Per-session directory index from the last usage scan, by session id:
+# (monotonic time of the last full scan, {relative dir: (mtime_ns, bytes of its files, subdirs)})
+_usage_index = {}
+_usage_index_lock = threading.Lock()
+
+
+def _scan_usage(clone_path: str, index: dict, since: float = None):
+    """
+    Measure a clone like directory_size, re-listing only directories whose mtime
+    changed since the index was built. Creating, deleting or renaming a file
+    changes its directory's mtime, so unchanged directories keep their totals.
+    Returns (total bytes, new index, files created or changed after since).
+    """
+    scan_started_ns = time.time_ns()
+    new_index = {}
+    changed = []
+    total = 0
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        path = os.path.join(clone_path, rel_dir)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if rel_dir:
+            total += st.st_blocks * 512
+        cached = index.get(rel_dir)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            mtime_ns, files_bytes, subdirs = cached
+        else:
+            files_bytes, subdirs = 0, []
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                entries = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    entry_st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files_bytes += entry_st.st_blocks * 512 // max(entry_st.st_nlink, 1)
+                if entry.is_file(follow_symlinks=False) and (since is None or entry_st.st_ctime >= since):
+                    changed.append(os.path.join(rel_dir, entry.name))
+            # A directory changed in the same clock tick as the scan is listed again next time
+            mtime_ns = st.st_mtime_ns if st.st_mtime_ns < scan_started_ns - 2_000_000_000 else None
+        new_index[rel_dir] = (mtime_ns, files_bytes, subdirs)
+        total += files_bytes
+        stack.extend(os.path.join(rel_dir, name) for name in subdirs)
+    return total, new_index, changed
+
+
+def forget_session_usage(session_id: str):
+    """Drop a session's usage index, e.g. when its clone is deleted."""
+    with _usage_index_lock:
+        _usage_index.pop(session_id, None)
+
+
+def is_install_command(command: str, args=None):
+    """Whether a run_command call installs packages into the working directory."""
+    program = os.path.basename(command or "")
+    subcommands = _INSTALL_COMMANDS.get(program)
+    if not subcommands:
+        return False
+    args_list = args if isinstance(args, list) else [args] if args else []
+    if program == "yarn" and not args_list:
+        return True
+    return any(arg in subcommands for arg in args_list)
+
+
+def user_disk_usage(db, user_id: int, include_warm: bool = False):
+    """
+    Sum of the last measured usage of a user's sessions. Warm (pre-cloned,
+    unclaimed) sessions are left out unless include_warm is set, and so are
+    sessions whose node is down (their clones are not on any running node).
+    """
+    query = db.query(func.coalesce(func.sum(SessionModel.disk_bytes), 0)).filter(
+        SessionModel.user_id == user_id,
+        not_(orphaned_sessions())
+    )
+    if not include_warm:
+        query = query.filter(or_(SessionModel.status.is_(None), SessionModel.status.notin_(("warm", "warm_refreshing"))))
+    total = query.scalar()
+    return int(total or 0)
+
+
+def check_user_quota(user_id: int, db=None, additional_bytes: int = INSTALL_QUOTA_RESERVE_BYTES):
+    """
+    Returns an error dict when adding additional_bytes (the expected size of the
+    install or clone about to start) would take the user past USER_DISK_QUOTA_BYTES, else None.
+    """
+    if not USER_DISK_QUOTA_BYTES or user_id is None:
+        return None
+    if db is None:
+        db = SessionLocal()
+        try:
+            return check_user_quota(user_id, db, additional_bytes)
+        finally:
+            db.close()
+    used = user_disk_usage(db, user_id)
+    if used + additional_bytes > USER_DISK_QUOTA_BYTES:
+        return {
+            "error": f"Disk quota exceeded: {used} of {USER_DISK_QUOTA_BYTES} bytes used, "
+                     f"and this needs about {additional_bytes} more. Close a repository to free space.",
+            "used_bytes": used,
+            "needed_bytes": additional_bytes,
+            "quota_bytes": USER_DISK_QUOTA_BYTES
+        }
+    return None
+
+
+def _reflink(source: str, dest: str):
+    """Replace dest with a copy-on-write clone of source. Returns False if unsupported."""
+    tmp_path = f"{dest}.dedup-tmp"
+    try:
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        os.chmod(tmp_path, os.stat(dest).st_mode)
+        os.replace(tmp_path, dest)
+        return True
+    except OSError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+            return False
+        raise
+
+
+def dedupe_against(clone_path: str, peer_paths: list, rel_paths: list):
+    """
+    Share identical files between a clone and other clones of the same repository.
+    Each of rel_paths (files of the clone, relative to it) is matched against the
+    same path in the peers by size and content and reflinked, so each clone still
+    writes to its own copy. Nothing is shared on filesystems without reflinks:
+    hardlinks would let an in-place write in one clone change the others.
+    Returns the number of bytes saved.
+    """
+    peers = [p for p in peer_paths if p != clone_path and os.path.isdir(p)]
+    if not peers or not os.path.isdir(clone_path):
+        return 0
+
+    saved = 0
+    for rel_path in rel_paths:
+        if rel_path.split(os.sep, 1)[0] == ".git":
+            continue
+        path = os.path.join(clone_path, rel_path)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path) or os.path.islink(path) or st.st_size < DEDUP_MIN_FILE_BYTES:
+            continue
+
+        for peer in peers:
+            peer_file = os.path.join(peer, rel_path)
+            try:
+                peer_st = os.lstat(peer_file)
+            except OSError:
+                continue
+            if (peer_st.st_ino == st.st_ino and peer_st.st_dev == st.st_dev) or os.path.islink(peer_file):
+                break
+            if (peer_st.st_size != st.st_size or peer_st.st_dev != st.st_dev
+                    or peer_st.st_mode != st.st_mode or not filecmp.cmp(path, peer_file, shallow=False)):
+                continue
+            try:
+                if not _reflink(peer_file, path):
+                    return saved
+                saved += st.st_blocks * 512
+            except OSError as e:
+                log_event("disk.dedupe_failed", level="debug", path=path, error=str(e))
+            break
+    return saved
+
+
+def refresh_session_usage(session_id: str, dedupe: bool = True):
+    """
+    Update a session's stored disk usage, then deduplicate the files that changed
+    since the last measurement against the same user's other clones of the repository.
+    Usage is updated incrementally from the session's directory index, with a full
+    rescan every DISK_FULL_RESCAN_SECONDS to pick up files grown in place.
+    Blocking; run it in a worker thread.
+    """
+    db = SessionLocal()
+    try:
+        session = db.query(SessionModel).filter(SessionModel.id == session_id).first()
+        if not session or not session.clone_path or not os.path.isdir(session.clone_path):
+            return {"error": f"Session {session_id} has no clone"}
+
+        started_at = datetime.now(timezone.utc)
+        measured_at = as_utc(session.disk_measured_at)
+        with _usage_index_lock:
+            full_scan_at, index = _usage_index.get(session_id, (None, {}))
+        if full_scan_at is None or time.monotonic() - full_scan_at > DISK_FULL_RESCAN_SECONDS:
+            full_scan_at, index = time.monotonic(), {}
+        # Only files that appeared since the last measurement need a dedupe look
+        since = measured_at.timestamp() if measured_at else None
+        total, index, changed = _scan_usage(session.clone_path, index, since)
+        with _usage_index_lock:
+            _usage_index[session_id] = (full_scan_at, index)
+
+        saved = 0
+        if dedupe and changed:
+            # Reflinks only work within this node's filesystem
+            peers = db.query(SessionModel.clone_path).filter(
+                local_sessions(),
+                SessionModel.user_id == session.user_id,
+                SessionModel.repo_url == session.repo_url,
+                SessionModel.id != session_id,
+                SessionModel.status == "ready"
+            ).all()
+            saved = dedupe_against(session.clone_path, [p for (p,) in peers if p], changed)
+
+        session.disk_bytes = total
+        session.disk_measured_at = started_at
+        db.commit()
+        return {"session_id": session_id, "disk_bytes": session.disk_bytes, "deduplicated_bytes": saved}
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error measuring disk usage: {str(e)}"}
+    finally:
+        db.close()
@@ -0,0 +1,129 @@
+"""
+Structured event log.
+
+log_event() only checks the level and sampling, then hands the record to a queue;
+a background thread formats it (JSON lines by default) and writes it to stdout.
+Records carry the ids bound with log_context() (session, run, review) and the
+current trace and span ids, so one session's or run's events can be pulled out of
+the interleaved output and matched to its trace.
+
+    with log_context(session_id=session_id):
+        log_event("ws.message_received", level="debug", size=len(data))
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from app.config import LOG_EVENT_LEVELS, LOG_FORMAT, LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_RATES
+from app.utils.metrics import LOG_RECORDS_DROPPED
+from app.utils.tracing import current_trace_ids
+
+logger = logging.getLogger("reporefine")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+_setup_lock = threading.Lock()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records as they are; a full queue drops the record instead of blocking the caller."""
+
+    def prepare(self, record):
+        # The queue stays in-process, so formatting (and tracebacks) can wait for the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "event": getattr(record, "event", record.getMessage()),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = " ".join(f"{key}={value}" for key, value in getattr(record, "fields", {}).items())
+        line = (f"{datetime.fromtimestamp(record.created, timezone.utc).strftime('%H:%M:%S.%f')[:-3]} "
+                f"{record.levelname:<7} {getattr(record, 'event', record.getMessage())} {fields}").rstrip()
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def setup_logging(stream=None):
+    """Start the background writer. Called on first use; safe to call again."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        records = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        logger.handlers = [_NonBlockingQueueHandler(records)]
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+        _listener = logging.handlers.QueueListener(records, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out the queued records and stop the background writer."""
+    global _listener
+    with _setup_lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        _listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (session_id, run_id, ...) to every event logged inside the block, including worker threads it starts."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind_log_context(**fields):
+    """Attach fields for the rest of the enclosing log_context block."""
+    _context.set({**_context.get(), **fields})
+
+
+def log_event(event: str, level: str = "info", exc_info=False, **fields):
+    """
+    Log one event. LOG_EVENT_LEVELS overrides the level per event and LOG_SAMPLE_RATES
+    keeps only a fraction of an event's records (kept records carry sample_rate).
+    """
+    if _listener is None:
+        setup_logging()
+    level_number = logging.getLevelName(LOG_EVENT_LEVELS.get(event, level.upper()))
+    if not logger.isEnabledFor(level_number):
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(event)
+    if sample_rate is not None:
+        if random.random() >= sample_rate:
+            return
+        fields["sample_rate"] = sample_rate
+    logger.log(level_number, event, exc_info=exc_info, extra={"event": event, "fields": {**_context.get(), **current_trace_ids(), **fields}})
@@ -0,0 +1,98 @@
+import asyncio
+import json
+from collections import deque
+from fastapi.responses import StreamingResponse
+
+
+class EventChannel:
+    """
+    In-memory, append-only event log with sequence ids.
+    Any number of subscribers can read it, each from its own position.
+    Only the last maxlen events are kept; with bounded_types, that limit applies
+    to events of those types alone (e.g. high-volume output lines) and every other
+    event is kept for the channel's lifetime. A subscriber that falls behind the
+    kept events gets an events_truncated event in place of the ones it missed.
+    Must be published to from the event loop thread (use
+    loop.call_soon_threadsafe from worker threads).
+    """
+
+    def __init__(self, maxlen: int = 1000, bounded_types=None):
+        self._events = deque(maxlen=maxlen)
+        self._log = []  # events outside bounded_types, never evicted
+        self._bounded_types = bounded_types
+        self._evicted_through = 0  # id of the newest event dropped from _events
+        self._last_id = 0
+        self._last_event = None
+        self._waiter = None
+        self.closed = False
+
+    @property
+    def last_event(self):
+        return self._last_event
+
+    def publish(self, event: dict):
+        self._last_id += 1
+        event = {**event, "event_id": self._last_id}
+        if self._bounded_types is None or event.get("type") in self._bounded_types:
+            if len(self._events) == self._events.maxlen:
+                self._evicted_through = self._events[0]["event_id"]
+            self._events.append(event)
+        else:
+            self._log.append(event)
+        self._last_event = event
+        self._wake()
+        return event
+
+    def close(self):
+        self.closed = True
+        self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def subscribe(self, last_event_id: int = 0):
+        """
+        Yield events after last_event_id, then new ones until the channel closes.
+        If some of them were already evicted, an events_truncated event (carrying
+        the subscriber's unchanged event_id) says which ids were lost.
+        """
+        log_index = 0
+        while True:
+            while log_index < len(self._log) and self._log[log_index]["event_id"] <= last_event_id:
+                log_index += 1
+            pending = self._log[log_index:]
+            log_index += len(pending)
+            pending += [event for event in self._events if event["event_id"] > last_event_id]
+            if self._bounded_types is not None:
+                pending.sort(key=lambda event: event["event_id"])
+            if last_event_id < self._evicted_through:
+                yield {
+                    "type": "events_truncated",
+                    "event_id": last_event_id,
+                    "after_event_id": last_event_id,
+                    "through_event_id": self._evicted_through,
+                    "message": "Some earlier output is no longer available"
+                }
+            for event in pending:
+                last_event_id = event["event_id"]
+                yield event
+            if self.closed:
+                return
+            if self._waiter is None:
+                self._waiter = asyncio.get_running_loop().create_future()
+            await asyncio.shield(self._waiter)
+
+
+def sse_response(channel: EventChannel, last_event_id: int = 0):
+    """Stream a channel to an HTTP client as Server-Sent Events."""
+    async def event_source():
+        async for event in channel.subscribe(last_event_id):
+            yield f"id: {event['event_id']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
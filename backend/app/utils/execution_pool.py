@@ -0,0 +1,136 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from app import config
+from app.utils.metrics import EXECUTION_POOL_QUEUE_SECONDS, EXECUTION_POOL_RUN_SECONDS, Gauge
+
+
+class ExecutionPool:
+    """
+    Limits how many repo commands run at once across the server.
+    Waiting commands are served round-robin per owner (user), so one user
+    running many commands cannot starve everyone else.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self.max_concurrent = max(1, max_concurrent)
+        self._running = 0
+        self._waiting = OrderedDict()  # owner -> deque of futures
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self._waiting.values())
+
+    def has_free_slot(self):
+        return self._running < self.max_concurrent and not self._waiting
+
+    async def acquire(self, owner=None):
+        if self.has_free_slot():
+            self._running += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(owner, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed to us just as we were cancelled; pass it on.
+                self.release()
+            else:
+                self._discard(owner, future)
+            raise
+
+    def release(self):
+        """Hand the slot to the next owner in round-robin order, or free it."""
+        while self._waiting:
+            owner, waiters = next(iter(self._waiting.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiting.move_to_end(owner)
+            else:
+                del self._waiting[owner]
+            if not future.done():
+                future.set_result(None)
+                return
+        self._running -= 1
+
+    def _discard(self, owner, future):
+        waiters = self._waiting.get(owner)
+        if not waiters:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiting[owner]
+
+    @asynccontextmanager
+    async def slot(self, owner=None):
+        """Hold an execution slot; yields the seconds spent waiting for it."""
+        queued_at = time.monotonic()
+        await self.acquire(owner)
+        started_at = time.monotonic()
+        wait = started_at - queued_at
+        EXECUTION_POOL_QUEUE_SECONDS.observe(wait)
+        try:
+            yield wait
+        finally:
+            self.release()
+            EXECUTION_POOL_RUN_SECONDS.observe(time.monotonic() - started_at)
+
+
+_LIMITED_EXEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "limited_exec.py")
+
+
+def limited_command(cmd_list: list):
+    """
+    Wrap a command so it runs with per-process CPU, memory, file-size and
+    process-count limits, applied by a small exec wrapper (limited_exec.py)
+    rather than a preexec_fn.
+    """
+    limits = (config.EXEC_CPU_SECONDS, config.EXEC_MEMORY_BYTES, config.EXEC_FILE_SIZE_BYTES, config.EXEC_MAX_PROCESSES)
+    return [sys.executable, "-I", "-S", _LIMITED_EXEC, *map(str, limits), config.EXEC_CGROUP_ROOT, "--", *cmd_list]
+
+
+def release_command_cgroup(pid: int):
+    """
+    Kill anything left in a finished command's cgroup (e.g. daemons that left its
+    process group) and remove the cgroup. No-op without EXEC_CGROUP_ROOT.
+    """
+    if not config.EXEC_CGROUP_ROOT:
+        return
+    path = os.path.join(config.EXEC_CGROUP_ROOT, f"cmd-{pid}")
+    if not os.path.isdir(path):
+        return
+    for _ in range(3):
+        try:
+            with open(os.path.join(path, "cgroup.procs")) as f:
+                pids = [int(line) for line in f if line.strip()]
+        except OSError:
+            return
+        for leftover in pids:
+            try:
+                os.kill(leftover, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            os.rmdir(path)
+            return
+        except OSError:
+            time.sleep(0.01)  # killed processes leave the cgroup once reaped
+
+
+execution_pool = ExecutionPool(config.EXEC_MAX_CONCURRENT)
+
+Gauge("execution_pool_running", "Commands holding an execution pool slot.", collect=lambda: execution_pool.running)
+Gauge("execution_pool_queued", "Commands waiting for an execution pool slot.", collect=lambda: execution_pool.queued)
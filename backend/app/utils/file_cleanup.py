@@ -1,17 +1,72 @@
 import os
 import shutil
-from datetime import datetime, timezone
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from sqlalchemy import or_
 from sqlalchemy.orm import Session
+from app.config import (
+    CLEANUP_BATCH_SIZE, CLONE_DISK_BUDGET_BYTES, CLONE_MIN_FREE_BYTES,
+    CLONE_ROOT_DIR, EVICTION_GRACE_SECONDS
+)
 from app.database import SessionLocal
 from app.models import Session as SessionModel
+from app.models import Message as MessageModel
+from app.models import Review as ReviewModel
+from app.models import TokenUsage
+from app.services.clone_service import clone_channels
+from app.services.cluster import local_sessions, orphaned_sessions
+from app.utils.disk_usage import directory_size, forget_session_usage
+from app.utils.event_log import log_event
+from app.utils.git_utils import evict_repo
+from app.utils.session_activity import as_utc
 
 load_dotenv()
 
+# Clone directories without a session row are removed once unchanged for this long
+_UNOWNED_CLONE_AGE_SECONDS = 3600
+# Serializes periodic cleanup and disk-pressure eviction across threads
+_cleanup_lock = threading.Lock()
+
+
+def _active_clone_ids():
+    """Sessions this process is still cloning; their rows must not be removed underneath them."""
+    return [session_id for session_id, channel in clone_channels.items() if not channel.closed]
+
+
+def _remove_clone(clone_path: str):
+    if not clone_path:
+        return
+    evict_repo(clone_path)
+    if os.path.exists(clone_path):
+        try:
+            shutil.rmtree(clone_path)
+        except Exception as e:
+            log_event("cleanup.remove_failed", level="warning", clone_path=clone_path, error=str(e))
+
+
+def _delete_sessions(db: Session, session_ids: list):
+    """Delete session rows in one statement, keeping their messages, reviews and token usage."""
+    db.query(MessageModel).filter(MessageModel.session_id.in_(session_ids)).update(
+        {MessageModel.session_id: None}, synchronize_session=False
+    )
+    db.query(ReviewModel).filter(ReviewModel.session_id.in_(session_ids)).update(
+        {ReviewModel.session_id: None}, synchronize_session=False
+    )
+    db.query(TokenUsage).filter(TokenUsage.session_id.in_(session_ids)).update(
+        {TokenUsage.session_id: None}, synchronize_session=False
+    )
+    db.query(SessionModel).filter(SessionModel.id.in_(session_ids)).delete(synchronize_session=False)
+    db.commit()
+
+
 def cleanup_expired_sessions(db: Session = None):
     """
-    Clean up all expired sessions and their clone directories.
+    Clean up all expired sessions and their clone directories, in batches. This
+    node's sessions and those of nodes that are down (see orphaned_sessions) are included.
     Messages and reviews are preserved for chat history (session_id set to NULL).
+    Blocking; call it from a worker thread when running on the event loop.
     Returns count of cleaned sessions.
     """
     if db is None:
@@ -24,28 +79,154 @@ def cleanup_expired_sessions(db: Session = None):
     
     try:
         now = datetime.now(timezone.utc)
-        expired_sessions = db.query(SessionModel).filter(
-            SessionModel.expires_at < now
-        ).all()
-        
+        cloning = _active_clone_ids()
         cleaned_count = 0
-        for session in expired_sessions:
-            if session.clone_path and os.path.exists(session.clone_path):
-                try:
-                    shutil.rmtree(session.clone_path)
-                except Exception as e:
-                    print(f"Warning: Failed to remove {session.clone_path}: {e}")
-            
-
-            db.delete(session)
-            cleaned_count += 1
+        with _cleanup_lock:
+            while True:
+                batch = db.query(SessionModel.id, SessionModel.clone_path).filter(
+                    or_(local_sessions(), orphaned_sessions()),
+                    SessionModel.expires_at < now,
+                    SessionModel.id.notin_(cloning)
+                ).order_by(SessionModel.expires_at).limit(CLEANUP_BATCH_SIZE).all()
+                if not batch:
+                    break
+
+                for _, clone_path in batch:
+                    _remove_clone(clone_path)
+                _delete_sessions(db, [session_id for session_id, _ in batch])
+                cleaned_count += len(batch)
+                if len(batch) < CLEANUP_BATCH_SIZE:
+                    break
         
-        db.commit()
         return {"message": f"Cleaned up {cleaned_count} expired session(s)", "count": cleaned_count}
     except Exception as e:
         db.rollback()
         return {"error": f"Error cleaning up expired sessions: {str(e)}"}
 
+
+def _free_bytes():
+    try:
+        return shutil.disk_usage(CLONE_ROOT_DIR).free
+    except OSError:
+        return None
+
+
+def evict_for_disk_space(db: Session = None, check_budget: bool = True):
+    """
+    Evict the least recently used clones while free space is below CLONE_MIN_FREE_BYTES
+    or (with check_budget) clones take up more than CLONE_DISK_BUDGET_BYTES.
+    Sessions active within EVICTION_GRACE_SECONDS and clones in progress are kept.
+    Blocking; call it from a worker thread when running on the event loop.
+    """
+    if db is None:
+        db = SessionLocal()
+        try:
+            result = evict_for_disk_space(db, check_budget)
+            return result
+        finally:
+            db.close()
+
+    try:
+        with _cleanup_lock:
+            free = _free_bytes()
+            low_on_space = free is not None and free < CLONE_MIN_FREE_BYTES
+            use_budget = check_budget and CLONE_DISK_BUDGET_BYTES > 0
+            if not low_on_space and not use_budget:
+                return {"message": "No eviction needed", "count": 0}
+
+            sessions = db.query(
+                SessionModel.id, SessionModel.clone_path, SessionModel.status,
+                SessionModel.last_activity_at, SessionModel.created_at, SessionModel.disk_bytes
+            ).filter(local_sessions()).all()
+            sizes = {}
+            if use_budget:
+                # Usage is kept up to date per session; only walk clones never measured
+                sizes = {
+                    s.id: s.disk_bytes if s.disk_bytes is not None else directory_size(s.clone_path)
+                    for s in sessions if s.clone_path and os.path.isdir(s.clone_path)
+                }
+            total = sum(sizes.values())
+            if not low_on_space and total <= CLONE_DISK_BUDGET_BYTES:
+                return {"message": "No eviction needed", "count": 0, "clone_bytes": total}
+
+            cloning = set(_active_clone_ids())
+            protect_after = datetime.now(timezone.utc) - timedelta(seconds=EVICTION_GRACE_SECONDS)
+            last_used = lambda s: as_utc(s.last_activity_at or s.created_at) or protect_after
+            # Unclaimed warm clones go first, then the least recently used sessions
+            candidates = sorted(
+                (s for s in sessions
+                 if s.id not in cloning and s.status != "cloning" and last_used(s) < protect_after),
+                key=lambda s: (s.status != "warm", last_used(s))
+            )
+
+            evicted = []
+            for s in candidates:
+                over_budget = use_budget and total > CLONE_DISK_BUDGET_BYTES
+                if not over_budget and not low_on_space:
+                    break
+                _remove_clone(s.clone_path)
+                _delete_sessions(db, [s.id])
+                evicted.append(s.id)
+                total -= sizes.get(s.id, 0)
+                free = _free_bytes()
+                low_on_space = free is not None and free < CLONE_MIN_FREE_BYTES
+
+        if evicted:
+            log_event("cleanup.evicted", count=len(evicted), clone_bytes=total)
+        return {"message": f"Evicted {len(evicted)} session(s)", "count": len(evicted), "clone_bytes": total}
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error evicting sessions: {str(e)}"}
+
+
+def remove_unowned_clones(db: Session = None):
+    """
+    Remove clone directories that no session row refers to any more, e.g. because
+    another node deleted the session while this one was down. Directories changed
+    within _UNOWNED_CLONE_AGE_SECONDS are kept, as a clone may still be in progress.
+    Blocking; call it from a worker thread when running on the event loop.
+    """
+    if db is None:
+        db = SessionLocal()
+        try:
+            return remove_unowned_clones(db)
+        finally:
+            db.close()
+
+    try:
+        candidates = {}
+        cutoff = time.time() - _UNOWNED_CLONE_AGE_SECONDS
+        with os.scandir(CLONE_ROOT_DIR) as entries:
+            for entry in entries:
+                if entry.name.startswith("repo_") and entry.is_dir(follow_symlinks=False) \
+                        and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    candidates[entry.name[len("repo_"):]] = entry.path
+        if not candidates:
+            return {"message": "No unowned clones", "count": 0}
+        known = {session_id for (session_id,) in db.query(SessionModel.id).filter(
+            SessionModel.id.in_(list(candidates))
+        ).all()}
+        removed = 0
+        with _cleanup_lock:
+            for session_id, clone_path in candidates.items():
+                if session_id not in known:
+                    _remove_clone(clone_path)
+                    removed += 1
+        return {"message": f"Removed {removed} unowned clone(s)", "count": removed}
+    except FileNotFoundError:
+        return {"message": "No unowned clones", "count": 0}
+    except Exception as e:
+        db.rollback()
+        return {"error": f"Error removing unowned clones: {str(e)}"}
+
+
+def run_cleanup():
+    """Expired-session cleanup, unowned clone removal and disk eviction, for the periodic task."""
+    expired = cleanup_expired_sessions()
+    unowned = remove_unowned_clones()
+    evicted = evict_for_disk_space()
+    return {"expired": expired, "unowned": unowned, "evicted": evicted}
+
 def cleanup_session(session_id: str, db: Session = None):
     """
     Clean up a specific session and its clone directory.
@@ -65,14 +246,20 @@ def cleanup_session(session_id: str, db: Session = None):
         if not session:
             return {"error": f"Session {session_id} not found"}
         
+        if session.clone_path:
+            evict_repo(session.clone_path)
         if session.clone_path and os.path.exists(session.clone_path):
             try:
                 shutil.rmtree(session.clone_path)
             except Exception as e:
                 return {"error": f"Failed to remove clone directory: {str(e)}"}
         
+        db.query(TokenUsage).filter(TokenUsage.session_id == session_id).update(
+            {TokenUsage.session_id: None}, synchronize_session=False
+        )
         db.delete(session)
         db.commit()
+        forget_session_usage(session_id)
         
         return {"message": f"Session {session_id} and clone directory cleaned up"}
     except Exception as e:
@@ -1,5 +1,75 @@
-import git
 import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from stat import S_ISREG
+from app.utils.metrics import GIT_STATUS_SECONDS
+from app.utils.tracing import traced
+from app.utils.lazy_import import lazy_import
+
+git = lazy_import("git")
+
+# Open repository handles by clone path. Each handle keeps its persistent
+# `git cat-file --batch` / `--batch-check` helpers alive between calls, and
+# has its own lock because those helpers cannot be shared across threads.
+_repo_handles = {}
+_repo_handles_lock = threading.Lock()
+
+
+@contextmanager
+def repo_handle(working_directory: str):
+    """
+    Borrow the cached git.Repo for a clone, holding its lock while in use.
+    """
+    abs_working_dir = os.path.abspath(working_directory)
+    with _repo_handles_lock:
+        handle = _repo_handles.get(abs_working_dir)
+        if handle is None:
+            handle = (git.Repo(abs_working_dir), threading.RLock())
+            _repo_handles[abs_working_dir] = handle
+    repo, lock = handle
+    with lock:
+        yield repo
+
+
+def evict_repo(working_directory: str):
+    """
+    Drop the cached handle for a clone and stop its git helper processes.
+    Call this before deleting a clone directory.
+    """
+    abs_working_dir = os.path.abspath(working_directory)
+    with _repo_handles_lock:
+        handle = _repo_handles.pop(abs_working_dir, None)
+    if handle is None:
+        return
+    repo, lock = handle
+    with lock:
+        repo.close()
+
+
+def read_object(working_directory: str, spec: str):
+    """
+    Read an object (e.g. "HEAD:path/to/file") through the clone's persistent
+    `git cat-file --batch` helper. Returns hexsha, type, size and data.
+    """
+    abs_working_dir= os.path.abspath(working_directory)
+    if not os.path.isdir(abs_working_dir):
+        return {"error": f"Working directory not found: {abs_working_dir}"}
+    try:
+        with repo_handle(abs_working_dir) as repo:
+            hexsha, object_type, size, data = repo.git.get_object_data(spec)
+        return {
+            "hexsha": hexsha.decode() if isinstance(hexsha, bytes) else hexsha,
+            "type": object_type.decode() if isinstance(object_type, bytes) else object_type,
+            "size": size,
+            "data": data
+        }
+    except Exception as e:
+        return {"error": f"Error reading object {spec}: {str(e)}"}
+
+
+@traced("git.head")
 def get_current_commit_hash(working_directory: str):
     """
     Get the current commit hash of the repository.
@@ -8,51 +78,453 @@ def get_current_commit_hash(working_directory: str):
     if not os.path.isdir(abs_working_dir):
         return {"error": f"Working directory not found: {abs_working_dir}"}
     try:
-        repo =git.Repo(abs_working_dir)
-        commit=repo.head.commit
-        return {"commit_hash": commit.hexsha}
+        with repo_handle(abs_working_dir) as repo:
+            commit=repo.head.commit
+            return {"commit_hash": commit.hexsha}
     except Exception as e:
         return {"error": f"Error getting current commit hash: {str(e)}"}
 
 
-def get_git_status(working_directory: str):
+_BINARY_SNIFF_BYTES = 8000
+_LINE_COUNT_CACHE_SIZE = 50000
+
+# (path, size, mtime_ns) -> line count, so rescans skip untracked files that did not change
+_line_counts = {}
+_line_counts_lock = threading.Lock()
+
+
+def _count_lines(path: str):
+    """Line count of a new file, or None for binary files and anything that is not a file."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _line_counts_lock:
+        if key in _line_counts:
+            return _line_counts[key]
+    lines = _read_line_count(path)
+    with _line_counts_lock:
+        if len(_line_counts) >= _LINE_COUNT_CACHE_SIZE:
+            _line_counts.clear()
+        _line_counts[key] = lines
+    return lines
+
+
+def _read_line_count(path: str):
+    try:
+        lines = 0
+        with open(path, "rb") as f:
+            first = f.read(_BINARY_SNIFF_BYTES)
+            if b"\0" in first:
+                return None
+            lines += first.count(b"\n")
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                lines += chunk.count(b"\n")
+        return lines
+    except OSError:
+        return None
+
+
+def _scan_status(repo, paths: list = None):
+    """
+    Parse one `git status --porcelain=v2 -z` run into {path: entry}.
+    Each entry has a status (modified, added, deleted or renamed), the HEAD
+    blob id when known, and line stats.
+    """
+    pathspec = ["--", *paths] if paths else []
+    with GIT_STATUS_SECONDS.time(scope="partial" if paths else "full"):
+        output = repo.git.status("--porcelain=v2", "-z", "--untracked-files=all", *pathspec)
+    tokens = output.split("\0")
+    entries = {}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if not token or token.startswith("#"):
+            continue
+        kind = token[0]
+        if kind == "1":
+            fields = token.split(" ", 8)
+            xy, head_blob, path = fields[1], fields[6], fields[8]
+            if "D" in xy and xy[0] != "A":
+                status = "deleted"
+            elif xy[0] == "A":
+                status = "added"
+            else:
+                status = "modified"
+            entries[path] = {"status": status, "head_blob": head_blob}
+        elif kind == "2":
+            fields = token.split(" ", 9)
+            path, original = fields[9], tokens[i]
+            i += 1
+            entries[path] = {"status": "renamed", "from": original, "head_blob": fields[6]}
+        elif kind == "u":
+            path = token.split(" ", 10)[10]
+            entries[path] = {"status": "modified"}
+        elif kind == "?":
+            entries[token[2:]] = {"status": "untracked"}
+
+    if not entries:
+        return entries
+
+    # Line stats for tracked paths come from a single numstat diff against HEAD
+    try:
+        numstat = repo.git.diff("--numstat", "-z", "--no-renames", "HEAD", *pathspec)
+    except git.exc.GitCommandError:
+        numstat = ""  # no HEAD commit yet
+    for record in numstat.split("\0"):
+        parts = record.split("\t", 2)
+        if len(parts) == 3 and parts[2] in entries:
+            binary = parts[0] == "-"
+            entries[parts[2]]["additions"] = None if binary else int(parts[0])
+            entries[parts[2]]["deletions"] = None if binary else int(parts[1])
+
+    for path, entry in entries.items():
+        if entry["status"] == "untracked":
+            entry["additions"] = _count_lines(os.path.join(repo.working_tree_dir, path))
+            entry["deletions"] = None if entry["additions"] is None else 0
+    return entries
+
+
+def _summarize_status(repo, entries: dict):
+    """
+    Build the change set from scanned entries. Exact renames (a deleted file
+    whose content reappears as a new file) are paired by blob id.
+    """
+    deleted_by_blob = {}
+    for path, entry in entries.items():
+        if entry["status"] == "deleted" and entry.get("head_blob"):
+            deleted_by_blob.setdefault(entry["head_blob"], []).append(path)
+
+    renamed_pairs = {}
+    if deleted_by_blob:
+        # Untracked directories (nested repositories, "sub/") have no blob id and would fail hash-object
+        unhashed = [
+            path for path, entry in entries.items()
+            if entry["status"] == "untracked" and "blob" not in entry and not path.endswith("/")
+            and os.path.isfile(os.path.join(repo.working_tree_dir, path))
+        ]
+        if unhashed:
+            blobs = _hash_paths(repo, unhashed)
+            for path, blob in zip(unhashed, blobs):
+                entries[path]["blob"] = blob
+        for path, entry in entries.items():
+            if entry["status"] == "untracked" and deleted_by_blob.get(entry.get("blob")):
+                renamed_pairs[path] = deleted_by_blob[entry["blob"]].pop(0)
+
+    changes = {
+        "modified": [],
+        "added": [],
+        "deleted": [],
+        "renamed": [],
+        "stats": {}
+    }
+    paired_sources = set(renamed_pairs.values())
+    for path in sorted(entries):
+        entry = entries[path]
+        status = entry["status"]
+        if path in paired_sources:
+            continue
+        if path in renamed_pairs:
+            changes["renamed"].append({"from": renamed_pairs[path], "to": path})
+            changes["stats"][path] = {"additions": 0, "deletions": 0}
+            continue
+        if status == "renamed":
+            changes["renamed"].append({"from": entry["from"], "to": path})
+        elif status in ("added", "untracked"):
+            changes["added"].append(path)
+        else:
+            changes[status].append(path)
+        changes["stats"][path] = {"additions": entry.get("additions"), "deletions": entry.get("deletions")}
+    return changes
+
+
+def _hash_paths(repo, paths: list):
+    """Blob ids of working tree files, computed in one git hash-object call."""
+    with tempfile.TemporaryFile() as stdin:
+        stdin.write("\n".join(paths).encode())
+        stdin.seek(0)
+        output = repo.git.hash_object("--stdin-paths", istream=stdin)
+    return output.split("\n")
+
+
+@traced("git.status")
+def get_git_status(working_directory: str, paths: list = None):
     """
-    Get the current git status of the repository.
+    Get the current git status of the repository from a single
+    `git status --porcelain=v2 -z` run, with rename detection and per-file
+    line stats. paths limits the scan to the given paths.
     """
     abs_working_dir= os.path.abspath(working_directory)
     if not os.path.isdir(abs_working_dir):
         return {"error": f"Working directory not found: {abs_working_dir}"}
 
     try:
-        repo=git.Repo(abs_working_dir)
-        diff= repo.index.diff(None)
-        
-        untracked=repo.untracked_files
-        
-        changes={
-            "modified":[],
-            "added":[],
-            "deleted":[]
-        }
+        with repo_handle(abs_working_dir) as repo:
+            entries = _scan_status(repo, paths)
+            return _summarize_status(repo, entries)
 
-        for diff_item in diff:
-            diff_type=diff_item.change_type
-            if diff_type=="M":
-                changes["modified"].append(diff_item.a_path)
-            elif diff_type=="A":
-                changes["added"].append(diff_item.a_path)
-            elif diff_type=="D":
-                changes["deleted"].append(diff_item.a_path)
-        
-        for untracked_file in untracked:
-            changes["added"].append(untracked_file)
+    except Exception as e:
+        return {"error": f"Error getting git status: {str(e)}"}
 
-        return changes
 
+def find_untracked_paths(working_directory: str, file_paths: list = (), directories: list = ()):
+    """
+    Which of the given files, or entries directly inside the given directories,
+    are not tracked in the index (untracked or ignored). Paths are relative to
+    the clone; ".git" itself is skipped.
+    """
+    abs_working_dir = os.path.abspath(working_directory)
+    if not os.path.isdir(abs_working_dir):
+        return {"error": f"Working directory not found: {abs_working_dir}"}
+    try:
+        with repo_handle(abs_working_dir) as repo:
+            pathspec = [*file_paths, *directories]
+            tracked = set(repo.git.ls_files("-z", "--", *pathspec).split("\0")) if pathspec else set()
+        tracked.discard("")
+
+        untracked = [path for path in file_paths if os.path.normpath(path) not in tracked]
+        for directory in directories:
+            prefix = os.path.normpath(directory)
+            prefix = "" if prefix == "." else prefix + "/"
+            tracked_entries = {path[len(prefix):].split("/", 1)[0] for path in tracked if path.startswith(prefix)}
+            for name in os.listdir(os.path.join(abs_working_dir, directory)):
+                if name != ".git" and name not in tracked_entries:
+                    untracked.append(prefix + name)
+        return {"untracked": untracked}
     except Exception as e:
-        return {"error": f"Error getting git status: {str(e)}"}
+        return {"error": f"Error listing untracked paths: {str(e)}"}
+
 
+class ChangeTracker:
+    """
+    Keeps the change set of an agent run up to date across iterations.
+    Tools report the paths they touched; refresh() rescans only those paths,
+    or the whole tree after a tool with unknown effects (like a shell command).
+    """
 
+    def __init__(self, working_directory: str):
+        self.working_directory = os.path.abspath(working_directory)
+        self._entries = {}
+        self._dirty = set()
+        self._full_scan = True
+        self.changes = None
+
+    def mark_path(self, path: str):
+        rel_path = os.path.relpath(os.path.abspath(os.path.join(self.working_directory, path)), self.working_directory)
+        if rel_path.startswith(".."):
+            return
+        self._dirty.add(rel_path)
+
+    def mark_all(self):
+        self._full_scan = True
+
+    @property
+    def is_dirty(self):
+        return self._full_scan or bool(self._dirty)
+
+    def refresh(self):
+        """Rescan what changed since the last refresh; returns the change set or an error dict."""
+        if not self.is_dirty and self.changes is not None:
+            return self.changes
+        try:
+            with repo_handle(self.working_directory) as repo:
+                if self._full_scan:
+                    self._entries = _scan_status(repo)
+                else:
+                    paths = sorted(self._dirty)
+                    for path in list(self._entries):
+                        if any(path == p or path.startswith(p.rstrip("/") + "/") for p in paths):
+                            del self._entries[path]
+                    self._entries.update(_scan_status(repo, paths))
+                self._dirty.clear()
+                self._full_scan = False
+                self.changes = _summarize_status(repo, self._entries)
+            return self.changes
+        except Exception as e:
+            self._full_scan = True
+            return {"error": f"Error getting git status: {str(e)}"}
+
+
+@contextmanager
+def _temporary_index(repo):
+    """
+    A throwaway copy of the clone's index, so the whole working tree can be
+    staged and diffed without touching the real index. Copying the index keeps
+    git's stat cache, so only files that actually changed are re-hashed.
+    """
+    fd, index_path = tempfile.mkstemp(prefix="index.", dir=repo.git_dir)
+    os.close(fd)
+    try:
+        real_index = os.path.join(repo.git_dir, "index")
+        if os.path.exists(real_index):
+            shutil.copyfile(real_index, index_path)
+        else:
+            os.remove(index_path)
+        env = {"GIT_INDEX_FILE": index_path}
+        repo.git.add("-A", env=env)
+        yield env
+    finally:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+
+@traced("git.diff")
+def get_working_tree_diff(working_directory: str, base_commit: str):
+    """
+    Diff the whole working tree (including new files) against base_commit.
+    Returns the patch as bytes plus one entry per file with its status, line
+    stats and the byte range of its section in the patch.
+    """
+    abs_working_dir= os.path.abspath(working_directory)
+    if not os.path.isdir(abs_working_dir):
+        return {"error": f"Working directory not found: {abs_working_dir}"}
+
+    try:
+        with repo_handle(abs_working_dir) as repo:
+            with _temporary_index(repo) as env:
+                numstat = repo.git.diff("--cached", "-M", "--numstat", "-z", base_commit, env=env)
+                name_status = repo.git.diff("--cached", "-M", "--name-status", "-z", base_commit, env=env)
+                patch = repo.git.diff(
+                    "--cached", "-M", "--no-color", "--no-ext-diff", base_commit,
+                    env=env, stdout_as_string=False, strip_newline_in_stdout=False
+                )
+
+        files = _parse_numstat(numstat)
+        statuses = name_status.split("\0")
+        i = 0
+        for entry in files:
+            code = statuses[i]
+            i += 3 if code[:1] in ("R", "C") else 2
+            entry["status"] = {"A": "added", "D": "deleted", "R": "renamed", "C": "copied"}.get(code[:1], "modified")
+
+        # Patch sections come in the same order as the numstat entries
+        starts = [0] if patch.startswith(b"diff --git ") else []
+        position = patch.find(b"\ndiff --git ")
+        while position != -1:
+            starts.append(position + 1)
+            position = patch.find(b"\ndiff --git ", position + 1)
+        ends = starts[1:] + [len(patch)]
+        for entry, start, end in zip(files, starts, ends):
+            entry["offset"] = start
+            entry["length"] = end - start
+
+        return {"patch": patch, "files": files}
+    except Exception as e:
+        return {"error": f"Error computing diff: {str(e)}"}
+
+
+def _parse_numstat(numstat: str):
+    """Parse `git diff --numstat -z` output (renames use two path fields)."""
+    files = []
+    tokens = numstat.split("\0")
+    i = 0
+    while i < len(tokens):
+        record = tokens[i]
+        i += 1
+        if not record:
+            continue
+        additions, deletions, path = record.split("\t", 2)
+        old_path = None
+        if path == "":
+            old_path, path = tokens[i], tokens[i + 1]
+            i += 2
+        binary = additions == "-"
+        files.append({
+            "path": path,
+            "old_path": old_path,
+            "additions": None if binary else int(additions),
+            "deletions": None if binary else int(deletions),
+            "binary": binary
+        })
+    return files
+
+
+# Identity for snapshot commits, which never leave the clone
+_SNAPSHOT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "RepoRefine",
+    "GIT_AUTHOR_EMAIL": "snapshots@reporefine.local",
+    "GIT_COMMITTER_NAME": "RepoRefine",
+    "GIT_COMMITTER_EMAIL": "snapshots@reporefine.local",
+}
+
+
+@traced("git.snapshot")
+def snapshot_working_tree(working_directory: str, parent_commit: str, message: str, ref: str = None):
+    """
+    Record the working tree as a commit object without touching the index,
+    HEAD or any branch. Only files changed since the index was written are
+    re-hashed. ref (e.g. refs/reporefine/...) keeps the snapshot from being
+    garbage collected.
+    """
+    abs_working_dir= os.path.abspath(working_directory)
+    if not os.path.isdir(abs_working_dir):
+        return {"error": f"Working directory not found: {abs_working_dir}"}
+
+    try:
+        with repo_handle(abs_working_dir) as repo:
+            with _temporary_index(repo) as env:
+                tree_hash = repo.git.write_tree(env=env)
+            commit_hash = repo.git.commit_tree(tree_hash, "-p", parent_commit, "-m", message, env=_SNAPSHOT_IDENTITY)
+            if ref:
+                repo.git.update_ref(ref, commit_hash)
+        return {"commit_hash": commit_hash, "tree_hash": tree_hash}
+    except Exception as e:
+        return {"error": f"Error taking snapshot: {str(e)}"}
+
+
+@traced("git.restore")
+def restore_snapshot(working_directory: str, snapshot_commit: str, paths: list = None):
+    """
+    Make the working tree (or just the given paths) match a snapshot again.
+    Files that did not exist in the snapshot are removed. The index is left alone,
+    so the result still shows up as changes against the original checkpoint.
+    """
+    abs_working_dir= os.path.abspath(working_directory)
+    if not os.path.isdir(abs_working_dir):
+        return {"error": f"Working directory not found: {abs_working_dir}"}
+
+    try:
+        with repo_handle(abs_working_dir) as repo:
+            with _temporary_index(repo) as env:
+                current_tree = repo.git.write_tree(env=env)
+            pathspec = ["--", *paths] if paths else []
+            output = repo.git.diff("--name-status", "-z", "--no-renames", snapshot_commit, current_tree, *pathspec)
+            tokens = output.split("\0")
+            to_restore, to_remove = [], []
+            for code, path in zip(tokens[0::2], tokens[1::2]):
+                if code == "A":
+                    to_remove.append(path)
+                elif code:
+                    to_restore.append(path)
+
+            for path in to_remove:
+                file_path = os.path.join(abs_working_dir, path)
+                if os.path.lexists(file_path):
+                    os.remove(file_path)
+                _remove_empty_parents(abs_working_dir, os.path.dirname(file_path))
+            if to_restore:
+                repo.git.restore("--source", snapshot_commit, "--worktree", "--", *to_restore)
+
+        return {
+            "message": f"Restored {len(to_restore) + len(to_remove)} file(s) from snapshot {snapshot_commit[:12]}",
+            "restored": to_restore,
+            "removed": to_remove
+        }
+    except Exception as e:
+        return {"error": f"Error restoring snapshot: {str(e)}"}
+
+
+def _remove_empty_parents(root: str, directory: str):
+    while directory.startswith(root + os.sep) and os.path.isdir(directory) and not os.listdir(directory):
+        os.rmdir(directory)
+        directory = os.path.dirname(directory)
+
+
+@traced("git.revert")
 def revert_to_checkpoint(working_directory: str, checkpoint_commit_hash: str):
     """
     Revert the repository to a checkpoint commit hash.
@@ -63,17 +535,17 @@ def revert_to_checkpoint(working_directory: str, checkpoint_commit_hash: str):
         return {"error": f"Working directory not found: {abs_working_dir}"}
 
     try:
-        repo=git.Repo(abs_working_dir)
+        with repo_handle(abs_working_dir) as repo:
+            repo.git.reset('--hard', checkpoint_commit_hash) 
 
-        repo.git.reset('--hard', checkpoint_commit_hash) 
-
-        repo.git.clean('-fd') # Clean untracked files and directories
+            repo.git.clean('-fd') # Clean untracked files and directories
 
         return {"message": f"Reverted to checkpoint commit hash: {checkpoint_commit_hash}"}
 
     except Exception as e:
         return {"error": f"Error reverting to checkpoint commit hash: {str(e)}"}
 
+@traced("git.commit")
 def commit_changes(working_directory:str,commit_message:str,branch_name:str=None):
     """
     Commit changes to the repository with a branch name. If branch name is not provided, it will commit to the current branch.
@@ -83,30 +555,31 @@ def commit_changes(working_directory:str,commit_message:str,branch_name:str=None
         return {"error": f"Working directory not found: {abs_working_dir}"}
 
     try:
-        repo=git.Repo(abs_working_dir)
-        
-        if branch_name:
-            if branch_name not in [ref.name for ref in repo.heads]:
-                repo.git.checkout('-b', branch_name)
-            else:
-                repo.git.checkout(branch_name)
-       
-       
-        if not repo.is_dirty() and not repo.untracked_files:
-            return {"error": "No changes to commit"}
+        with repo_handle(abs_working_dir) as repo:
+            if branch_name:
+                if branch_name not in [ref.name for ref in repo.heads]:
+                    repo.git.checkout('-b', branch_name)
+                else:
+                    repo.git.checkout(branch_name)
+           
+            # One status call instead of is_dirty() plus untracked_files
+            if not repo.git.status('--porcelain', '-z', '--untracked-files=normal'):
+                return {"error": "No changes to commit"}
 
-        repo.git.add('-A')
+            repo.git.add('-A')
 
-        repo.index.commit(commit_message)
-        commit=repo.head.commit
+            repo.index.commit(commit_message)
+            commit=repo.head.commit
+            active_branch=repo.active_branch.name
         
-        return {"message":f"Committed changes with message: {commit_message} to branch: {repo.active_branch.name}",
+        return {"message":f"Committed changes with message: {commit_message} to branch: {active_branch}",
         "commit_hash":commit.hexsha,
-        "branch_name":repo.active_branch.name
+        "branch_name":active_branch
         }
     except Exception as e:
         return {"error": f"Error committing changes: {str(e)}"}
 
+@traced("git.push")
 def push_changes(working_directory:str, branch_name:str,github_token:str, repo_url:str):
     """
     Push Changes to the repository to the remote branch.
@@ -116,20 +589,18 @@ def push_changes(working_directory:str, branch_name:str,github_token:str, repo_u
         return {"error": f"Working directory not found: {abs_working_dir}"}
 
     try:
-        repo=git.Repo(abs_working_dir)
-
-        
         repo_path = repo_url.replace('https://github.com/', '').replace('.git', '')
         authenticated_url=f"https://{github_token}@github.com/{repo_path}.git"
-        
-        try:
-            origin=repo.remote('origin')
-        except:
-            origin=repo.create_remote('origin')
-        
-        origin.set_url(authenticated_url)
 
-        origin.push(branch_name)
+        with repo_handle(abs_working_dir) as repo:
+            try:
+                origin=repo.remote('origin')
+            except:
+                origin=repo.create_remote('origin', authenticated_url)
+            
+            origin.set_url(authenticated_url)
+
+            origin.push(branch_name)
         
         return {"message":f"Pushed changes to branch: {branch_name} on repo: {repo_url}",
         "branch_name":branch_name,
@@ -0,0 +1,55 @@
+"""
+Deferred imports for heavy dependencies.
+
+    types = lazy_import("google.genai.types")
+
+binds a stand-in that imports the real module on first attribute access, so a module
+can use the SDK at module scope without every importer (and every worker start)
+paying for it. Annotations evaluated at definition time count as access; quote them.
+"""
+import importlib
+import threading
+
+
+class LazyModule:
+    __slots__ = ("_name", "_module", "_lock")
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attribute: str):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute: str, value):
+        setattr(self._load(), attribute, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name: str):
+    """A module proxy that imports `name` on first use."""
+    return LazyModule(name)
+
+
+def preload(*modules):
+    """Import lazily bound modules now, e.g. from a startup task off the request path."""
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module._load()
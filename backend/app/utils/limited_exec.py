@@ -0,0 +1,89 @@
+"""
+Exec wrapper that applies resource limits to a command before it starts.
+
+    python -I -S limited_exec.py CPU_SECONDS DATA_BYTES FILE_SIZE_BYTES MAX_PROCESSES CGROUP_ROOT -- command [args...]
+
+Used instead of a preexec_fn, which is unsafe in the multithreaded server. The
+limits are in place before the command runs, so everything it starts inherits
+them. A limit of 0 leaves it unset. Standard library only, so it starts quickly.
+
+The process count is limited per command by a cgroup of its own under CGROUP_ROOT
+(cmd-<pid>, with pids.max), when that directory is set and writable. Otherwise
+RLIMIT_NPROC is set to MAX_PROCESSES more than the tasks the server's user already
+has; that limit is shared with everything else the user runs, and root ignores it.
+"""
+import os
+import resource
+import sys
+
+EXEC_FAILED = 127
+
+
+def _set_limit(limit: int, value: int):
+    try:
+        _, hard = resource.getrlimit(limit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit, (value, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def _join_cgroup(cgroup_root: str, max_processes: int):
+    """Move this process into a new cgroup with pids.max set. False if that is not possible."""
+    path = os.path.join(cgroup_root, f"cmd-{os.getpid()}")
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, "pids.max"), "w") as f:
+            f.write(str(max_processes))
+        with open(os.path.join(path, "cgroup.procs"), "w") as f:
+            f.write(str(os.getpid()))
+        return True
+    except OSError:
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return False
+
+
+def _user_task_count():
+    """Threads and processes currently owned by this user (what RLIMIT_NPROC counts)."""
+    uid = os.getuid()
+    count = 0
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            if os.stat(f"/proc/{name}").st_uid == uid:
+                count += len(os.listdir(f"/proc/{name}/task"))
+        except OSError:
+            continue
+    return count
+
+
+def main(argv: list):
+    separator = argv.index("--")
+    cpu_seconds, data_bytes, file_size_bytes, max_processes = (int(value) for value in argv[:4])
+    cgroup_root = argv[4] if separator > 4 else ""
+    command = argv[separator + 1:]
+
+    for limit, value in ((resource.RLIMIT_CPU, cpu_seconds), (resource.RLIMIT_DATA, data_bytes),
+                         (resource.RLIMIT_FSIZE, file_size_bytes)):
+        if value > 0:
+            _set_limit(limit, value)
+    if max_processes > 0 and not (cgroup_root and _join_cgroup(cgroup_root, max_processes)):
+        try:
+            _set_limit(resource.RLIMIT_NPROC, _user_task_count() + max_processes)
+        except OSError:
+            pass
+
+    try:
+        os.execvp(command[0], command)
+    except OSError as e:
+        sys.stderr.write(f"{command[0]}: {e.strerror}\n")
+        sys.exit(EXEC_FAILED)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
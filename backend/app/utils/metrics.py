@@ -0,0 +1,227 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a fast HTTP handler up to a long agent run
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames and self.kind != "histogram":
+            # Unlabeled series are exported as 0 before their first update
+            self._values[()] = 0
+        _registry.append(self)
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._samples()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that goes up and down. With collect, the value is read at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self._collect = collect
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in progress while it runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        if self._collect is not None:
+            return [((), self._collect())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the block takes. Labels can be changed inside the block."""
+        started_at = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, (list(counts), total)) for key, (counts, total) in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._samples()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.",
+    ("method", "route", "status")
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "websocket_connections_active", "Open agent websocket connections."
+)
+WEBSOCKET_PROMPT_SECONDS = Histogram(
+    "websocket_prompt_duration_seconds", "Time to handle one prompt on the agent websocket.",
+    ("outcome",)
+)
+MODEL_CALL_SECONDS = Histogram(
+    "model_call_duration_seconds", "Latency of generate_content calls.",
+    ("model", "outcome")
+)
+TOOL_CALL_SECONDS = Histogram(
+    "tool_call_duration_seconds", "Tool function run time.",
+    ("tool", "outcome")
+)
+TOOL_RESULT_BYTES = Histogram(
+    "tool_result_bytes", "Size of tool results sent back to the model.",
+    ("tool",), buckets=SIZE_BUCKETS
+)
+HISTORY_LOADS = Counter(
+    "message_history_loads_total", "Message history loads by the store that served them.",
+    ("source",)
+)
+CLONE_SECONDS = Histogram(
+    "clone_duration_seconds", "Time to create a session clone.",
+    ("mode", "status")
+)
+GIT_STATUS_SECONDS = Histogram(
+    "git_status_duration_seconds", "Time for a porcelain status scan.",
+    ("scope",)
+)
+AGENT_RUNS_ACTIVE = Gauge(
+    "agent_runs_active", "Agent runs in progress."
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total", "Response cache lookups by outcome (hit, miss, expired, bypass).",
+    ("outcome",)
+)
+RUN_QUEUE_SECONDS = Histogram(
+    "agent_run_queue_seconds", "Time an agent run waited for an admission slot."
+)
+RUNS_SHED = Counter(
+    "agent_runs_shed_total", "Prompts refused because the run queue was full.",
+    ("reason",)
+)
+EXECUTION_POOL_QUEUE_SECONDS = Histogram(
+    "execution_pool_queue_seconds", "Time a repo command waited for an execution pool slot."
+)
+EXECUTION_POOL_RUN_SECONDS = Histogram(
+    "execution_pool_run_seconds", "Time a repo command held an execution pool slot."
+)
+SUBPROCESSES_ACTIVE = Gauge(
+    "subprocesses_active", "Tool subprocesses running."
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full."
+)
+TRACE_SPANS_DROPPED = Counter(
+    "trace_spans_dropped_total", "Finished spans dropped because the export queue was full or the export failed."
+)
+NODE_FORWARDS = Counter(
+    "node_forwards_total", "Requests for another node's sessions, by how they were handled.",
+    ("kind", "outcome")
+)
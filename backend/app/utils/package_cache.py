@@ -0,0 +1,172 @@
+import asyncio
+import errno
+import fcntl
+import os
+import shutil
+import subprocess
+import threading
+from app import config
+from app.utils.process_runner import run_streaming
+from app.utils.event_log import log_event
+
+_template_lock = threading.Lock()
+
+# Files in a venv that embed the venv's absolute path
+_PATH_BEARING_FILES = ("pyvenv.cfg",)
+
+FICLONE = 0x40049409
+
+
+def _cache_dir(name: str) -> str:
+    path = os.path.join(config.PACKAGE_CACHE_DIR, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def package_env(base_env: dict = None):
+    """
+    Build the environment for commands run inside a clone, pointing pip, npm,
+    pnpm and yarn at server-wide caches so packages are downloaded only once.
+    In offline mode installs are resolved from the caches and LOCAL_PACKAGE_INDEX only.
+    """
+    env = dict(os.environ if base_env is None else base_env)
+    env["PIP_CACHE_DIR"] = _cache_dir("pip")
+    env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+    env["npm_config_cache"] = _cache_dir("npm")
+    env["npm_config_prefer_offline"] = "true"
+    env["npm_config_store_dir"] = _cache_dir("pnpm-store")
+    env["YARN_CACHE_FOLDER"] = _cache_dir("yarn")
+
+    if config.PACKAGE_INDEX_OFFLINE:
+        env["PIP_NO_INDEX"] = "1"
+        env["npm_config_offline"] = "true"
+        env.pop("npm_config_prefer_offline", None)
+        if config.LOCAL_PACKAGE_INDEX:
+            env["PIP_FIND_LINKS"] = config.LOCAL_PACKAGE_INDEX
+    return env
+
+
+def _is_text_with(path: str, needle: bytes) -> bool:
+    try:
+        with open(path, "rb") as f:
+            data = f.read(1024 * 1024)
+    except OSError:
+        return False
+    return b"\0" not in data and needle in data
+
+
+def _reflink_or_copy(src: str, dest: str, reflink: bool):
+    """
+    Copy src to dest as a copy-on-write clone when the filesystem supports it,
+    otherwise as a plain copy. Returns whether reflinks are still worth trying.
+    """
+    if reflink:
+        try:
+            with open(src, "rb") as source, open(dest, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(src, dest)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS):
+                raise
+    shutil.copy2(src, dest)
+    return False
+
+
+def clone_venv_template(template_path: str, venv_path: str):
+    """
+    Clone a pre-built venv into venv_path using reflinks, or plain copies where the
+    filesystem has none. Files are never hardlinked: code run in one venv can rewrite
+    its packages in place, and that must not reach the template or other venvs.
+    Scripts and config that embed the template path are rewritten,
+    so the clone's pip and python never point back at the template.
+    """
+    template_path = os.path.abspath(template_path)
+    venv_path = os.path.abspath(venv_path)
+    old = template_path.encode()
+    new = venv_path.encode()
+    reflink = True
+
+    for root, dirs, files in os.walk(template_path):
+        rel_root = os.path.relpath(root, template_path)
+        dest_root = os.path.normpath(os.path.join(venv_path, rel_root))
+        os.makedirs(dest_root, exist_ok=True)
+        in_bin = rel_root.split(os.sep)[0] in ("bin", "Scripts")
+
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dest = os.path.join(dest_root, name)
+            if os.path.islink(src):
+                target = os.readlink(src)
+                if target.startswith(template_path):
+                    target = venv_path + target[len(template_path):]
+                os.symlink(target, dest)
+                if name in dirs:
+                    dirs.remove(name)
+            elif name in files:
+                if (in_bin or name in _PATH_BEARING_FILES) and _is_text_with(src, old):
+                    with open(src, "rb") as f:
+                        data = f.read().replace(old, new)
+                    with open(dest, "wb") as f:
+                        f.write(data)
+                    shutil.copymode(src, dest)
+                else:
+                    reflink = _reflink_or_copy(src, dest, reflink)
+
+
+async def create_venv(venv_path: str, cwd: str, on_output=None, owner=None):
+    """
+    Create a virtual environment at venv_path.
+    Uses the BASE_VENV_TEMPLATE (building it once if missing) when configured,
+    otherwise falls back to python3 -m venv.
+    """
+    template = config.BASE_VENV_TEMPLATE
+    if template:
+        try:
+            if not os.path.exists(os.path.join(template, "pyvenv.cfg")):
+                result = await _build_template(template)
+                if "error" in result:
+                    return result
+            await asyncio.to_thread(clone_venv_template, template, venv_path)
+            return {"message": f"Cloned virtual environment from template {template}", "source": "template"}
+        except Exception as e:
+            shutil.rmtree(venv_path, ignore_errors=True)
+            log_event("package_cache.template_clone_failed", level="warning", template=template, error=str(e))
+
+    output = await run_streaming(
+        ["python3", "-m", "venv", venv_path],
+        cwd=cwd,
+        timeout=30,
+        on_output=on_output,
+        env=package_env(),
+        owner=owner
+    )
+    if output["timed_out"]:
+        return {"error": "Creating virtual environment timed out after 30 seconds"}
+    if output["exit_code"] != 0:
+        return {
+            "error": f"Failed to create virtual environment: {output['stderr']}",
+            "stdout": output["stdout"],
+            "stderr": output["stderr"]
+        }
+    return {"message": f"Created virtual environment at {venv_path}", "source": "venv"}
+
+
+async def _build_template(template: str):
+    """Build the base venv template the first time it is needed."""
+    def build():
+        with _template_lock:
+            if os.path.exists(os.path.join(template, "pyvenv.cfg")):
+                return {"message": "Template already exists"}
+            output = subprocess.run(
+                ["python3", "-m", "venv", template],
+                timeout=60,
+                capture_output=True,
+                text=True
+            )
+            if output.returncode != 0:
+                shutil.rmtree(template, ignore_errors=True)
+                return {"error": f"Failed to build venv template: {output.stderr}"}
+            return {"message": f"Built venv template at {template}"}
+
+    return await asyncio.to_thread(build)
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import shutil
+import signal
+import time
+from collections import deque
+from app.utils.execution_pool import execution_pool, limited_command, release_command_cgroup
+from app.utils.metrics import SUBPROCESSES_ACTIVE
+from app.utils.tracing import span, trace_env
+
+# How much output is kept for the tool result sent back to the model.
+# Everything is still streamed to the client line by line.
+HEAD_LIMIT_BYTES = 16 * 1024
+TAIL_LIMIT_BYTES = 16 * 1024
+MAX_LINE_BYTES = 64 * 1024
+# After a kill, how long to wait for output still in the pipes (a process that
+# left the group could keep them open indefinitely)
+DRAIN_SECONDS = 2
+
+
+class BoundedOutput:
+    """
+    Keeps the first and last chunk of a stream of lines, dropping the middle.
+    Memory use stays bounded no matter how much a process prints.
+    """
+
+    def __init__(self, head_limit: int = HEAD_LIMIT_BYTES, tail_limit: int = TAIL_LIMIT_BYTES):
+        self.head_limit = head_limit
+        self.tail_limit = tail_limit
+        self.head = []
+        self.head_bytes = 0
+        self.tail = deque()
+        self.tail_bytes = 0
+        self.omitted_lines = 0
+        self.omitted_bytes = 0
+
+    def append(self, line: str):
+        size = len(line)
+        if self.head_bytes + size <= self.head_limit and not self.tail:
+            self.head.append(line)
+            self.head_bytes += size
+            return
+
+        self.tail.append(line)
+        self.tail_bytes += size
+        while self.tail_bytes > self.tail_limit and len(self.tail) > 1:
+            dropped = self.tail.popleft()
+            self.tail_bytes -= len(dropped)
+            self.omitted_lines += 1
+            self.omitted_bytes += len(dropped)
+
+    @property
+    def truncated(self):
+        return self.omitted_lines > 0
+
+    def text(self):
+        head = "".join(self.head)
+        tail = "".join(self.tail)
+        if not self.truncated:
+            return head + tail
+        marker = f"\n... [{self.omitted_lines} lines ({self.omitted_bytes} bytes) omitted] ...\n"
+        return head + marker + tail
+
+
+async def _pump(stream, name: str, buffer: BoundedOutput, on_output):
+    """Read a pipe line by line, feeding the buffer and the output callback."""
+    while True:
+        try:
+            raw = await stream.readline()
+        except ValueError:
+            # Line longer than the stream limit; read what is buffered instead.
+            raw = await stream.read(MAX_LINE_BYTES)
+        if not raw:
+            break
+        line = raw.decode("utf-8", errors="replace")
+        buffer.append(line)
+        if on_output is not None:
+            await on_output(name, line.rstrip("\n"))
+
+
+async def run_streaming(cmd_list: list, cwd: str, timeout: float, on_output=None, env: dict = None, owner=None):
+    """
+    Run a process without blocking the event loop, streaming its output.
+
+    The process runs in a slot of the shared execution pool (queued fairly per
+    owner) with resource limits applied. on_output is an optional coroutine
+    function called as on_output(stream, line) for every stdout/stderr line as
+    it arrives. Only a bounded head/tail of each stream is kept for the result.
+
+    Returns a dict with stdout, stderr, exit_code, duration_seconds,
+    queue_wait_seconds, timed_out and truncated. Raises FileNotFoundError if
+    the executable does not exist. The process gets the current trace context
+    as TRACEPARENT, so a traced child joins the run's trace.
+    """
+    with span("subprocess", command=os.path.basename(cmd_list[0]), args=" ".join(cmd_list[1:])[:200]) as process_span:
+        if on_output is not None and not execution_pool.has_free_slot():
+            await on_output("queue", f"Waiting for a free execution slot ({execution_pool.queued} command(s) queued)")
+
+        async with execution_pool.slot(owner) as queue_wait:
+            result = await _run(cmd_list, cwd, timeout, on_output, trace_env(env))
+        result["queue_wait_seconds"] = round(queue_wait, 3)
+        process_span.set_attributes(
+            exit_code=result["exit_code"], timed_out=result["timed_out"], queue_wait_seconds=result["queue_wait_seconds"]
+        )
+        if result["timed_out"] or result["exit_code"] != 0:
+            process_span.set_error("timed out" if result["timed_out"] else f"exit code {result['exit_code']}")
+        return result
+
+
+async def _run(cmd_list: list, cwd: str, timeout: float, on_output, env: dict):
+    stdout_buffer = BoundedOutput()
+    stderr_buffer = BoundedOutput()
+    started_at = time.monotonic()
+
+    # The exec wrapper would only report a missing executable through its exit code
+    executable = cmd_list[0]
+    if os.sep in executable:
+        found = os.path.exists(os.path.join(cwd, executable))
+    else:
+        found = shutil.which(executable, path=(env if env is not None else os.environ).get("PATH", os.defpath))
+    if not found:
+        raise FileNotFoundError(f"No such file or directory: '{executable}'")
+
+    process = await asyncio.create_subprocess_exec(
+        *limited_command(cmd_list),
+        cwd=cwd,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=MAX_LINE_BYTES,
+        start_new_session=True,
+    )
+
+    pumps = asyncio.gather(
+        _pump(process.stdout, "stdout", stdout_buffer, on_output),
+        _pump(process.stderr, "stderr", stderr_buffer, on_output),
+    )
+
+    timed_out = False
+    SUBPROCESSES_ACTIVE.inc()
+    try:
+        await asyncio.wait_for(asyncio.shield(pumps), timeout=timeout)
+        # The pipes can close before the process exits; it gets what is left of the timeout
+        remaining = None if timeout is None else max(timeout - (time.monotonic() - started_at), 0)
+        await asyncio.wait_for(process.wait(), timeout=remaining)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill_process_group(process)
+        await process.wait()
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), timeout=DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            pumps.cancel()
+            pumps.add_done_callback(_consume_result)
+    except asyncio.CancelledError:
+        _kill_process_group(process)
+        pumps.cancel()
+        pumps.add_done_callback(_consume_result)
+        raise
+    finally:
+        SUBPROCESSES_ACTIVE.dec()
+        release_command_cgroup(process.pid)
+
+    return {
+        "stdout": stdout_buffer.text(),
+        "stderr": stderr_buffer.text(),
+        "exit_code": process.returncode,
+        "duration_seconds": round(time.monotonic() - started_at, 3),
+        "timed_out": timed_out,
+        "truncated": stdout_buffer.truncated or stderr_buffer.truncated,
+    }
+
+
+def _consume_result(future):
+    """Mark a cancelled gather as retrieved so asyncio does not warn about it."""
+    if not future.cancelled():
+        future.exception()
+
+
+def _kill_process_group(process):
+    """Kill the process and any children it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
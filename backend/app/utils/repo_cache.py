@@ -0,0 +1,132 @@
+import fcntl
+import os
+import re
+import shutil
+import uuid
+from contextlib import contextmanager
+from app import config
+from app.utils.tracing import traced
+from app.utils.lazy_import import lazy_import
+
+git = lazy_import("git")
+
+
+def mirror_path_for(repo_url: str):
+    """Map a repository URL to its bare mirror directory in the cache."""
+    path = re.sub(r"^[a-z]+://", "", repo_url.strip().lower())
+    path = re.sub(r"^[^@/]+@", "", path)  # drop credentials
+    path = re.sub(r"\.git$", "", path.rstrip("/"))
+    key = re.sub(r"[^a-z0-9._-]+", "__", path)
+    return os.path.join(config.MIRROR_CACHE_DIR, f"{key}.git")
+
+
+@contextmanager
+def _mirror_lock(mirror_path: str):
+    """Serialize mirror creation and fetches across threads and worker processes."""
+    os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+    with open(f"{mirror_path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@traced("git.mirror")
+def ensure_mirror(repo_url: str, progress=None):
+    """
+    Create or refresh the local bare mirror for a repository.
+    The mirror only tracks branches and tags, and never garbage collects,
+    because session clones borrow its objects through alternates.
+    """
+    mirror_path = mirror_path_for(repo_url)
+    try:
+        with _mirror_lock(mirror_path):
+            if os.path.isdir(mirror_path):
+                mirror = git.Repo(mirror_path)
+                try:
+                    mirror.remote("origin").fetch(prune=True, tags=True, progress=progress)
+                finally:
+                    mirror.close()
+                return {"mirror_path": mirror_path, "created": False}
+
+            tmp_path = f"{mirror_path}.tmp-{uuid.uuid4().hex[:8]}"
+            try:
+                mirror = git.Repo.clone_from(repo_url, tmp_path, bare=True, progress=progress)
+                with mirror.config_writer() as writer:
+                    writer.set_value('remote "origin"', "fetch", "+refs/heads/*:refs/heads/*")
+                    writer.set_value("gc", "auto", "0")
+                    writer.set_value("gc", "pruneExpire", "never")
+                mirror.close()
+                os.rename(tmp_path, mirror_path)
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            return {"mirror_path": mirror_path, "created": True}
+    except Exception as e:
+        return {"error": f"Error updating mirror for {repo_url}: {str(e)}"}
+
+
+@traced("git.clone")
+def create_clone(repo_url: str, clone_path: str, mode: str = None, progress=None):
+    """
+    Create a working clone for a session according to CLONE_MODE.
+
+    reference: refresh the local mirror, then make a --shared clone of it, so
+               no objects are copied and only the working tree uses disk.
+    shallow:   depth-1 clone straight from the remote.
+    blobless:  partial clone from the remote, file contents fetched on demand.
+    full:      plain clone from the remote.
+
+    Shared clones are used instead of `git worktree add` because worktree
+    branches would live in the mirror and be pruned by its fetches.
+    """
+    mode = (mode or config.CLONE_MODE).lower()
+    try:
+        if mode == "reference":
+            mirror = ensure_mirror(repo_url, progress=progress)
+            if "error" in mirror:
+                return mirror
+            repo = git.Repo.clone_from(mirror["mirror_path"], clone_path, shared=True, progress=progress)
+            repo.remote("origin").set_url(repo_url)
+        elif mode == "shallow":
+            repo = git.Repo.clone_from(repo_url, clone_path, depth=1, progress=progress)
+        elif mode == "blobless":
+            repo = git.Repo.clone_from(repo_url, clone_path, filter="blob:none", progress=progress)
+        elif mode == "full":
+            repo = git.Repo.clone_from(repo_url, clone_path, progress=progress)
+        else:
+            return {"error": f"Unknown clone mode: {mode}"}
+        repo.close()
+        return {"clone_path": clone_path, "mode": mode}
+    except Exception as e:
+        shutil.rmtree(clone_path, ignore_errors=True)
+        return {"error": f"Error cloning {repo_url}: {str(e)}"}
+
+
+@traced("git.refresh")
+def refresh_clone(repo_url: str, clone_path: str, mode: str = None):
+    """
+    Bring an unused clone up to date with the remote's default branch.
+    Reference clones fetch from the refreshed local mirror instead of the remote.
+    Any local changes in the clone are discarded.
+    """
+    mode = (mode or config.CLONE_MODE).lower()
+    try:
+        repo = git.Repo(clone_path)
+        try:
+            if mode == "reference":
+                mirror = ensure_mirror(repo_url)
+                if "error" in mirror:
+                    return mirror
+                repo.git.fetch("--prune", mirror["mirror_path"], "+refs/heads/*:refs/remotes/origin/*")
+            elif mode == "shallow":
+                repo.git.fetch("--depth", "1", "origin")
+            else:
+                repo.git.fetch("--prune", "origin")
+            repo.git.reset("--hard", "origin/HEAD")
+            repo.git.clean("-fdx")
+            return {"clone_path": clone_path, "commit_hash": repo.head.commit.hexsha}
+        finally:
+            repo.close()
+    except Exception as e:
+        return {"error": f"Error refreshing {clone_path}: {str(e)}"}
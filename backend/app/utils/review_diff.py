@@ -0,0 +1,68 @@
+import hashlib
+import json
+import zlib
+from app.utils.git_utils import get_working_tree_diff
+from app.utils.tracing import traced
+
+
+@traced("review.build_diff")
+def build_review_diff(working_directory: str, base_commit: str):
+    """
+    Compute a run's diff once and pack it for storage on the review:
+    a zlib-compressed patch, the per-file index into it, and a digest used as ETag.
+    """
+    diff = get_working_tree_diff(working_directory, base_commit)
+    if "error" in diff:
+        return diff
+    patch = diff["patch"]
+    return {
+        "diff_patch": zlib.compress(patch, 6),
+        "diff_files": json.dumps(diff["files"]),
+        "diff_digest": hashlib.sha256(patch).hexdigest()[:32]
+    }
+
+
+def load_diff_files(review):
+    """The per-file stats stored on a review, without the byte offsets."""
+    if not review.diff_files:
+        return []
+    return [
+        {key: value for key, value in entry.items() if key not in ("offset", "length")}
+        for entry in json.loads(review.diff_files)
+    ]
+
+
+def read_file_diff(review, path: str):
+    """
+    Extract one file's section from a review's stored patch and split it into hunks.
+    Returns None if the file is not part of the review.
+    """
+    if not review.diff_files or review.diff_patch is None:
+        return None
+    entry = next((e for e in json.loads(review.diff_files) if e["path"] == path or e.get("old_path") == path), None)
+    if entry is None or "offset" not in entry:
+        return None
+
+    patch = zlib.decompress(review.diff_patch)
+    section = patch[entry["offset"]:entry["offset"] + entry["length"]].decode("utf-8", errors="replace")
+
+    header = []
+    hunks = []
+    for line in section.splitlines():
+        if line.startswith("@@"):
+            hunks.append({"header": line, "lines": []})
+        elif hunks:
+            hunks[-1]["lines"].append(line)
+        else:
+            header.append(line)
+
+    return {
+        "path": entry["path"],
+        "old_path": entry.get("old_path"),
+        "status": entry.get("status"),
+        "additions": entry.get("additions"),
+        "deletions": entry.get("deletions"),
+        "binary": entry.get("binary", False),
+        "header": header,
+        "hunks": hunks
+    }
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+from app.config import SESSION_IDLE_TTL_SECONDS, SESSION_MAX_LIFETIME_SECONDS
+
+# Activity is written at most this often per session
+TOUCH_INTERVAL_SECONDS = 60
+
+
+def as_utc(value: datetime):
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def session_expiry(created_at: datetime, now: datetime = None):
+    """Expiry for a session active at `now`: idle TTL from now, capped by the maximum lifetime."""
+    now = now or datetime.now(timezone.utc)
+    created_at = as_utc(created_at) or now
+    return min(
+        now + timedelta(seconds=SESSION_IDLE_TTL_SECONDS),
+        created_at + timedelta(seconds=SESSION_MAX_LIFETIME_SECONDS)
+    )
+
+
+def touch_session(session, db, force: bool = False):
+    """
+    Record activity on a session and slide its expiry forward.
+    Writes are throttled to one per TOUCH_INTERVAL_SECONDS unless force is set.
+    """
+    if session.status == "failed":
+        return False
+    now = datetime.now(timezone.utc)
+    last_activity = as_utc(session.last_activity_at)
+    if not force and last_activity and (now - last_activity).total_seconds() < TOUCH_INTERVAL_SECONDS:
+        return False
+    session.last_activity_at = now
+    session.expires_at = session_expiry(session.created_at, now)
+    db.commit()
+    return True
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from app.config import (
+    MODEL_PRICE_PER_MILLION, RUN_TOKEN_BUDGET, USER_TOKEN_BUDGET, USER_TOKEN_BUDGET_WINDOW_HOURS
+)
+from app.models import Session as SessionModel
+from app.models import TokenUsage
+
+USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "output_tokens", "total_tokens")
+
+
+def usage_from_response(response):
+    """Token counts from a generate_content response's usage_metadata; missing counts are 0."""
+    metadata = response.usage_metadata
+    prompt_tokens = metadata.prompt_token_count or 0
+    output_tokens = (metadata.candidates_token_count or 0) + (metadata.thoughts_token_count or 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": metadata.cached_content_token_count or 0,
+        "output_tokens": output_tokens,
+        "total_tokens": metadata.total_token_count or prompt_tokens + output_tokens,
+    }
+
+
+def estimate_cost(prompt_tokens: int, cached_tokens: int, output_tokens: int):
+    """Estimated USD cost at MODEL_PRICE_PER_MILLION. Cached prompt tokens are billed at the cached rate."""
+    input_price, cached_price, output_price = MODEL_PRICE_PER_MILLION
+    uncached_tokens = max(0, prompt_tokens - cached_tokens)
+    cost = uncached_tokens * input_price + cached_tokens * cached_price + output_tokens * output_price
+    return round(cost / 1_000_000, 6)
+
+
+def usage_totals(record):
+    """The token counts of a review (or any object with the usage fields) plus their estimated cost."""
+    totals = {field: getattr(record, field) or 0 for field in USAGE_FIELDS}
+    totals["cost_usd"] = estimate_cost(totals["prompt_tokens"], totals["cached_tokens"], totals["output_tokens"])
+    return totals
+
+
+def record_usage(db, review, session, iteration: int, model: str, usage: dict):
+    """Store one model call's usage and add it to the run's review and the session totals."""
+    db.add(TokenUsage(
+        user_id=session.user_id,
+        session_id=session.id,
+        review_id=review.id,
+        iteration=iteration,
+        model=model,
+        **usage
+    ))
+    for field in USAGE_FIELDS:
+        setattr(review, field, (getattr(review, field) or 0) + usage[field])
+    # Increment in SQL; runs in other tabs may be adding to the same session
+    db.query(SessionModel).filter(SessionModel.id == session.id).update(
+        {SessionModel.total_tokens: func.coalesce(SessionModel.total_tokens, 0) + usage["total_tokens"]},
+        synchronize_session=False
+    )
+    db.commit()
+
+
+def budget_window_start(now: datetime = None):
+    return (now or datetime.now(timezone.utc)) - timedelta(hours=USER_TOKEN_BUDGET_WINDOW_HOURS)
+
+
+def user_tokens_used(db, user_id: int, since: datetime = None):
+    query = db.query(func.coalesce(func.sum(TokenUsage.total_tokens), 0)).filter(TokenUsage.user_id == user_id)
+    if since is not None:
+        query = query.filter(TokenUsage.created_at >= since)
+    return int(query.scalar())
+
+
+def check_user_token_budget(user_id: int, db):
+    """Returns an error dict when the user has used USER_TOKEN_BUDGET tokens within the window, else None."""
+    if not USER_TOKEN_BUDGET or user_id is None:
+        return None
+    used = user_tokens_used(db, user_id, budget_window_start())
+    if used >= USER_TOKEN_BUDGET:
+        return {
+            "error": f"Token budget exceeded: {used} of {USER_TOKEN_BUDGET} tokens used "
+                     f"in the last {USER_TOKEN_BUDGET_WINDOW_HOURS} hours.",
+            "used_tokens": used,
+            "budget_tokens": USER_TOKEN_BUDGET
+        }
+    return None
+
+
+def check_run_token_budget(review):
+    """Returns an error dict when the run has used RUN_TOKEN_BUDGET tokens, else None."""
+    used = review.total_tokens or 0
+    if RUN_TOKEN_BUDGET and used >= RUN_TOKEN_BUDGET:
+        return {
+            "error": f"Run token budget exceeded: {used} of {RUN_TOKEN_BUDGET} tokens used.",
+            "used_tokens": used,
+            "budget_tokens": RUN_TOKEN_BUDGET
+        }
+    return None
+
+
+def usage_summary(db, user_id: int, since: datetime = None, session_id: str = None):
+    """
+    The user's token usage since a time (all time if None), in total and per session.
+    Usage of sessions that were cleaned up is reported under session_id None.
+    """
+    query = db.query(
+        TokenUsage.session_id,
+        func.count(TokenUsage.id),
+        func.count(func.distinct(TokenUsage.review_id)),
+        *(func.coalesce(func.sum(getattr(TokenUsage, field)), 0) for field in USAGE_FIELDS)
+    ).filter(TokenUsage.user_id == user_id)
+    if since is not None:
+        query = query.filter(TokenUsage.created_at >= since)
+    if session_id is not None:
+        query = query.filter(TokenUsage.session_id == session_id)
+
+    totals = {"model_calls": 0, "runs": 0, **{field: 0 for field in USAGE_FIELDS}}
+    sessions = []
+    for row in query.group_by(TokenUsage.session_id).all():
+        entry = {"session_id": row[0], "model_calls": row[1], "runs": row[2]}
+        entry.update({field: int(value) for field, value in zip(USAGE_FIELDS, row[3:])})
+        entry["cost_usd"] = estimate_cost(entry["prompt_tokens"], entry["cached_tokens"], entry["output_tokens"])
+        sessions.append(entry)
+        for key in totals:
+            totals[key] += entry[key]
+    totals["cost_usd"] = estimate_cost(totals["prompt_tokens"], totals["cached_tokens"], totals["output_tokens"])
+    sessions.sort(key=lambda entry: entry["total_tokens"], reverse=True)
+    return {"totals": totals, "sessions": sessions}
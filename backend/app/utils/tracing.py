@@ -0,0 +1,292 @@
+"""
+Lightweight tracing with W3C trace context.
+
+A span is current for the code inside `with span(...)`, including tasks and worker
+threads started there (asyncio copies context variables into both), so nested spans
+become its children without passing anything around. Child processes get the
+current span as the TRACEPARENT environment variable (see trace_env).
+
+Finished spans of sampled traces are exported from a background thread, as
+OTLP/JSON, to a file or an OTLP/HTTP collector (TRACE_EXPORTER). The request path
+only appends to a queue.
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from app.config import (
+    TRACE_EXPORTER, TRACE_FILE, TRACE_OTLP_ENDPOINT, TRACE_SAMPLE_RATE, TRACE_SERVICE_NAME
+)
+from app.utils.metrics import TRACE_SPANS_DROPPED
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+_EXPORT_QUEUE_SIZE = 10000
+_EXPORT_BATCH_SIZE = 512
+_EXPORT_INTERVAL_SECONDS = 2.0
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    """The propagated part of a span: enough to parent spans in another process."""
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(value: str):
+    """A SpanContext from a W3C traceparent header value, or None if it is missing or malformed."""
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return SpanContext(match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1)
+
+
+class Span(SpanContext):
+    __slots__ = ("parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "status", "status_message", "_previous")
+
+    def __init__(self, name: str, parent: SpanContext = None, kind: str = "internal", attributes: dict = None):
+        if parent is None:
+            super().__init__(f"{random.getrandbits(128):032x}", f"{random.getrandbits(64):016x}",
+                             random.random() < TRACE_SAMPLE_RATE)
+            self.parent_id = None
+        else:
+            super().__init__(parent.trace_id, f"{random.getrandbits(64):016x}", parent.sampled)
+            self.parent_id = parent.span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "unset"
+        self.status_message = None
+        self._previous = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def set_error(self, message: str):
+        self.status = "error"
+        self.status_message = message
+
+    def end(self, error: BaseException = None):
+        """Finish the span, make its parent current again and queue it for export."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if isinstance(error, Exception):
+            self.set_error(f"{type(error).__name__}: {error}")
+        elif error is not None:
+            # Cancelled or closed (client went away); not a failure of the span itself
+            self.attributes["cancelled"] = True
+        if _current.get() is self:
+            _current.set(self._previous)
+        if self.sampled:
+            _exporter.submit(self)
+
+
+def current_span():
+    return _current.get()
+
+
+def begin_span(name: str, kind: str = "internal", parent: SpanContext = None, **attributes):
+    """Start a span and make it current; the caller must call end() on it. Prefer `with span(...)`."""
+    new_span = Span(name, parent or _current.get(), kind, attributes)
+    new_span._previous = _current.get()
+    _current.set(new_span)
+    return new_span
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", parent: SpanContext = None, **attributes):
+    """Run the block in a new child span of the current one (or of parent, e.g. from a traceparent header)."""
+    new_span = begin_span(name, kind, parent, **attributes)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.end(error=e)
+        raise
+    else:
+        new_span.end()
+    finally:
+        # Even if a span started inside was left open (an abandoned generator), leave with our parent current
+        _current.set(new_span._previous)
+
+
+def traced(name: str):
+    """Decorator running a function, sync or async, in a span. A returned {"error": ...} marks the span failed."""
+    def decorate(func):
+        def _finish(current, result):
+            if isinstance(result, dict) and "error" in result:
+                current.set_error(str(result["error"]))
+            return result
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name) as current:
+                    return _finish(current, await func(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                return _finish(current, func(*args, **kwargs))
+        return wrapper
+    return decorate
+
+
+def trace_env(env: dict = None):
+    """A copy of env (default os.environ) with TRACEPARENT set to the current span, for child processes."""
+    env = dict(os.environ if env is None else env)
+    current = _current.get()
+    if current is not None:
+        env["TRACEPARENT"] = current.traceparent
+    else:
+        env.pop("TRACEPARENT", None)
+    return env
+
+
+def current_trace_ids():
+    """{"trace_id", "span_id"} of the current span, or {} outside any span. Used to correlate log records."""
+    current = _current.get()
+    if current is None:
+        return {}
+    return {"trace_id": current.trace_id, "span_id": current.span_id}
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def span_to_otlp(finished: Span):
+    """One span in the OTLP/JSON encoding (hex ids, nanosecond timestamps as strings)."""
+    encoded = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": _SPAN_KINDS.get(finished.kind, 1),
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.end_ns),
+        "attributes": [
+            {"key": key, "value": _attribute_value(value)}
+            for key, value in finished.attributes.items() if value is not None
+        ],
+        "status": {"code": {"unset": 0, "ok": 1, "error": 2}[finished.status]},
+    }
+    if finished.parent_id:
+        encoded["parentSpanId"] = finished.parent_id
+    if finished.status_message:
+        encoded["status"]["message"] = finished.status_message
+    return encoded
+
+
+def otlp_payload(spans: list):
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "reporefine"}, "spans": [span_to_otlp(s) for s in spans]}],
+        }]
+    }
+
+
+class _SpanExporter:
+    """Batches finished spans on a background thread and writes them to the configured exporter."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._queue = queue.Queue(maxsize=_EXPORT_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._http = None
+
+    def submit(self, finished: Span):
+        if self.kind not in ("file", "otlp"):
+            return
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            TRACE_SPANS_DROPPED.inc()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + _EXPORT_INTERVAL_SECONDS
+            while len(batch) < _EXPORT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch: list):
+        try:
+            payload = otlp_payload(batch)
+            if self.kind == "file":
+                with open(TRACE_FILE, "a") as f:
+                    f.write(json.dumps(payload) + "\n")
+            else:
+                if self._http is None:
+                    self._http = requests.Session()
+                self._http.post(TRACE_OTLP_ENDPOINT, json=payload, timeout=5).raise_for_status()
+        except Exception:
+            TRACE_SPANS_DROPPED.inc(len(batch))
+
+    def flush(self):
+        """Export whatever is queued now (at shutdown)."""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._export(batch)
+
+
+_exporter = _SpanExporter(TRACE_EXPORTER)
+
+
+def flush_spans():
+    _exporter.flush()
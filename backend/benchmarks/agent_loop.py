@@ -0,0 +1,239 @@
+"""
+Offline agent-loop benchmark on recorded runs.
+
+Record runs with MODEL_RECORD_DIR set on the server, then replay the cassettes here:
+each run is repeated against a fresh clone of the repository at the recorded commit,
+with the model responses served from the cassette (ReplayBackend) and no API calls,
+so the timings measure the agent loop and its tools alone.
+
+Run from the backend directory:
+
+    python -m benchmarks.agent_loop recordings/*.jsonl.gz --repo ~/src/project
+    python -m benchmarks.agent_loop recordings/*.jsonl.gz --save-baseline
+    python -m benchmarks.agent_loop recordings/*.jsonl.gz --compare
+
+--repo defaults to the repository URL recorded in the cassette. The database is a
+temporary SQLite file and Redis is off, so no server or services are needed.
+A replay whose requests diverge from the recording (different tool calls) is reported
+and fails the run: its timings would not be comparable.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.tools import compare_to_baseline
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_loop_baseline.json")
+BENCHMARK_GITHUB_ID = 800_000_000
+
+
+def _configure_environment(work_dir: str):
+    """Point the app at a throwaway database before it is imported."""
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(work_dir, 'agent_loop.db')}",
+        "REDIS_URL": "none",
+        "WARM_POOL_SIZE": "0",
+        "MODEL_RECORD_DIR": "",
+        "RUN_TOKEN_BUDGET": "0",
+        "USER_TOKEN_BUDGET": "0",
+        "TRACE_EXPORTER": "none",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def _case_name(path: str):
+    name = os.path.basename(path)
+    for suffix in (".gz", ".jsonl"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def _clone(source: str, commit: str, work_dir: str):
+    clone_path = tempfile.mkdtemp(prefix="agentloop_clone_", dir=work_dir)
+    shared = ["--shared"] if os.path.isdir(source) else []
+    subprocess.run(["git", "clone", "-q", *shared, source, clone_path], check=True)
+    if commit:
+        subprocess.run(["git", "checkout", "-q", commit], cwd=clone_path, check=True)
+    return clone_path
+
+
+def _create_session(db, user_id: int, clone_path: str, history: list):
+    """A ready session on the clone, with the recorded run's earlier messages as its history."""
+    from app.models import Message as MessageModel
+    from app.models import Session as SessionModel
+
+    now = datetime.now(timezone.utc)
+    session_id = str(uuid.uuid4())
+    db.add(SessionModel(
+        id=session_id, user_id=user_id, repo_name="agent-loop-benchmark", repo_url=clone_path,
+        clone_path=clone_path, created_at=now, last_activity_at=now,
+        expires_at=now + timedelta(hours=1), status="ready"
+    ))
+    for sequence, content in enumerate(history):
+        text = "".join(part.get("text", "") for part in content.get("parts", []))
+        db.add(MessageModel(id=str(uuid.uuid4()), session_id=session_id, user_id=user_id,
+                            message=text, sender=content.get("role"), sequence=sequence))
+    db.commit()
+    return session_id
+
+
+async def _replay(path: str, prompt: str, session_id: str, db):
+    from app.services.agent_service import GeminiAgentService
+    from app.services.model_cassette import ReplayBackend
+
+    backend = ReplayBackend(path, strict=False)
+    service = GeminiAgentService(backend=backend)
+    final = {}
+    tool_calls = 0
+    started_at = time.perf_counter()
+    async for update in service.execute(prompt, session_id, db, None):
+        if "status" in update:
+            final = update
+            tool_calls = len(update.get("function_calls") or [])
+    return time.perf_counter() - started_at, final, tool_calls, backend
+
+
+def run_benchmarks(paths: list, repo: str, repeat: int, work_dir: str):
+    from app.database import SessionLocal, init_db
+    from app.models import User as UserModel
+    from app.services.model_cassette import load_cassette
+
+    init_db()
+    db = SessionLocal()
+    user = UserModel(github_id=BENCHMARK_GITHUB_ID, username="agent-loop-benchmark", avatar_url="", github_token="")
+    db.add(user)
+    db.commit()
+
+    results = []
+    try:
+        for path in paths:
+            cassette = load_cassette(path)
+            run = cassette["run"]
+            if not cassette["interactions"]:
+                print(f"Skipping {path}: no recorded model calls", file=sys.stderr)
+                continue
+            source = repo or run.get("repo_url")
+            history = cassette["interactions"][0]["contents"][:-1]
+            print(f"Replaying {_case_name(path)} ({len(cassette['interactions'])} model calls)...", file=sys.stderr)
+
+            def replay_once():
+                clone_path = _clone(source, run.get("checkpoint_commit_hash"), work_dir)
+                try:
+                    session_id = _create_session(db, user.id, clone_path, history)
+                    return asyncio.run(_replay(path, run.get("prompt", ""), session_id, db))
+                finally:
+                    shutil.rmtree(clone_path, ignore_errors=True)
+
+            timings = []
+            for _ in range(repeat):
+                elapsed, final, tool_calls, backend = replay_once()
+                timings.append(elapsed)
+
+            tracemalloc.start()
+            try:
+                replay_once()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+
+            diverged = backend.mismatches or backend.position != len(backend.interactions)
+            results.append({
+                "case": _case_name(path),
+                "median_seconds": statistics.median(timings),
+                "min_seconds": min(timings),
+                "max_seconds": max(timings),
+                "peak_memory_bytes": peak,
+                "model_calls": backend.position,
+                "tool_calls": tool_calls,
+                "status": final.get("status"),
+                "recorded_model_seconds": round(sum(item["elapsed_seconds"] for item in cassette["interactions"]), 3),
+                "diverged": (backend.mismatches[0]["difference"] if backend.mismatches
+                             else f"used {backend.position} of {len(backend.interactions)} recorded calls") if diverged else None,
+            })
+    finally:
+        db.close()
+    return results
+
+
+def _print_table(results: list):
+    header = f"{'case':40} {'median ms':>10} {'model calls':>11} {'tools':>6} {'status':>22} {'peak KiB':>10} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        change = f"{entry['change'] * 100:+.0f}%" if entry.get("change") is not None else "-"
+        print(f"{entry['case'][:40]:40} {entry['median_seconds'] * 1000:10.1f} {entry['model_calls']:11d} "
+              f"{entry['tool_calls']:6d} {str(entry['status']):>22} {entry['peak_memory_bytes'] / 1024:10.0f} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded agent runs offline and time the agent loop.")
+    parser.add_argument("cassettes", nargs="+", help="cassette files recorded with MODEL_RECORD_DIR")
+    parser.add_argument("--repo", help="repository to clone (default: the recorded repository URL)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed replays per cassette")
+    parser.add_argument("--work-dir", help="where to put clones and the database (default: system temp dir)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="exit 1 if a run regressed past --threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="agentloop_", dir=args.work_dir)
+    try:
+        _configure_environment(work_dir)
+        results = run_benchmarks(args.cassettes, args.repo, args.repeat, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold, min_delta_seconds=0.01)
+    elif args.compare:
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.", file=sys.stderr)
+        return 2
+
+    _print_table(results)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    diverged = [entry for entry in results if entry["diverged"]]
+    for entry in diverged:
+        print(f"DIVERGED {entry['case']}: {entry['diverged']}")
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']}: time {regression['time_change'] * 100:+.0f}%, "
+              f"peak memory {regression['memory_change'] * 100:+.0f}%")
+    if diverged or (args.compare and regressions):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
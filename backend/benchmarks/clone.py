@@ -0,0 +1,99 @@
+"""
+Clone benchmark and mirror-cache check.
+
+Builds the small synthetic repository as a local git repository and clones it the way
+sessions do (create_clone with a CloneProgress reporter), once against an empty mirror
+cache and again once the mirror exists, for each clone mode:
+
+    clone/<mode>/cold    first clone of the repository
+    clone/<mode>/warm    later clones; in reference mode this refreshes the existing mirror
+
+Run from the backend directory (no server, database or network needed):
+
+    python -m benchmarks.clone
+    python -m benchmarks.clone --modes reference --repeat 10
+
+Any clone that returns an error fails the run, so this also checks that a repository
+can be cloned a second time through its cached mirror.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_repo import build_repository
+
+MODES = ("reference", "shallow", "blobless", "full")
+
+
+def _source_repository(root: str):
+    """A committed git repository with the small tier's content."""
+    build_repository(root, "small")
+    git = ["git", "-c", "user.name=benchmark", "-c", "user.email=benchmark@localhost"]
+    subprocess.run([*git, "init", "-q"], cwd=root, check=True)
+    subprocess.run([*git, "add", "-A"], cwd=root, check=True)
+    subprocess.run([*git, "commit", "-q", "-m", "synthetic repository"], cwd=root, check=True)
+    # file:// so shallow and blobless clones go through the transport instead of a local copy
+    return f"file://{root}"
+
+
+def run_benchmarks(modes: list, repeat: int, work_dir: str):
+    from app import config
+    from app.services.clone_service import CloneProgress
+    from app.utils.repo_cache import create_clone
+
+    source = _source_repository(os.path.join(work_dir, "source"))
+    progress = CloneProgress(lambda *args, **kwargs: None)
+    results, errors = [], []
+    for mode in modes:
+        config.MIRROR_CACHE_DIR = os.path.join(work_dir, f"mirrors_{mode}")
+        timings = {"cold": [], "warm": []}
+        for run in range(repeat + 1):
+            phase = "cold" if run == 0 else "warm"
+            clone_path = os.path.join(work_dir, f"clone_{mode}_{run}")
+            started_at = time.perf_counter()
+            result = create_clone(source, clone_path, mode=mode, progress=progress)
+            timings[phase].append(time.perf_counter() - started_at)
+            shutil.rmtree(clone_path, ignore_errors=True)
+            if "error" in result:
+                errors.append(f"clone/{mode}/{phase} (run {run + 1}): {result['error']}")
+        for phase, values in timings.items():
+            results.append({
+                "case": f"clone/{mode}/{phase}",
+                "median_seconds": statistics.median(values),
+                "runs": len(values),
+            })
+    return results, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark session clones and check mirror reuse.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=3, help="warm clones per mode")
+    parser.add_argument("--work-dir", help="where to create the repositories (default: system temp dir)")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="clonebench_", dir=args.work_dir)
+    try:
+        results, errors = run_benchmarks(args.modes, max(args.repeat, 1), work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    header = f"{'case':28} {'median ms':>10} {'runs':>5}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        print(f"{entry['case']:28} {entry['median_seconds'] * 1000:10.1f} {entry['runs']:5}")
+    for error in errors:
+        print(f"FAILED {error}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Cold-start benchmark for a backend worker.
+
+Each run starts a fresh interpreter against an empty SQLite database with Redis and
+the warm pool off, and times the stages a new worker goes through:
+
+    import/app.main         importing the application
+    startup/lifespan        the lifespan startup (table creation, background tasks)
+    startup/first_request   the first HTTP request (GET /)
+    startup/ready           process spawn to first response
+    startup/agent_ready     process spawn to the model SDK and tool config being loaded
+
+Run from the backend directory (standard library only):
+
+    python -m benchmarks.startup                    # median of 5 cold starts
+    python -m benchmarks.startup --importtime 15    # also list the slowest imports
+    python -m benchmarks.startup --save-baseline    # record benchmarks/startup_baseline.json
+    python -m benchmarks.startup --compare          # fail if slower than the baseline
+
+Peak memory is the probe process's max RSS at the end of each stage.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.tools import compare_to_baseline
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_baseline.json")
+RESULT_MARKER = "STARTUP_BENCHMARK "
+STAGES = ("import/app.main", "startup/lifespan", "startup/first_request", "startup/ready", "startup/agent_ready")
+
+# Runs in the fresh interpreter. Drives the ASGI app directly so no server or HTTP client is needed.
+PROBE = r'''
+import asyncio, json, resource, sys, time
+
+def rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+stages = {}
+started_at = time.perf_counter()
+import app.main
+stages["import/app.main"] = (time.perf_counter() - started_at, rss())
+
+async def first_request(app):
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    sent = []
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+    async def send(message):
+        sent.append(message)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+        "headers": [(b"host", b"localhost")], "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 8000),
+    }
+    await app(scope, receive, send)
+    status = next(m["status"] for m in sent if m["type"] == "http.response.start")
+    if status != 200:
+        raise SystemExit(f"GET / returned {status}")
+
+async def main():
+    application = app.main.app
+    started_at = time.perf_counter()
+    async with application.router.lifespan_context(application):
+        stages["startup/lifespan"] = (time.perf_counter() - started_at, rss())
+        started_at = time.perf_counter()
+        await first_request(application)
+        stages["startup/first_request"] = (time.perf_counter() - started_at, rss())
+        ready_at = time.time()
+        # Waits for the lifespan's background warm-up if it is still loading
+        from app.services.agent_service import warm_up
+        await asyncio.to_thread(warm_up)
+        agent_ready_at = time.time()
+        agent_rss = rss()
+    print("STARTUP_BENCHMARK " + json.dumps({
+        "stages": stages, "ready_at": ready_at, "agent_ready_at": agent_ready_at, "agent_rss": agent_rss,
+    }), flush=True)
+
+asyncio.run(main())
+'''
+
+
+def _probe_env(database_path: str):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{database_path}",
+        "REDIS_URL": "none",
+        "WARM_POOL_SIZE": "0",
+        "MODEL_BACKEND": "fake",
+        "LOG_LEVEL": "WARNING",
+        "TRACE_EXPORTER": "none",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def cold_start():
+    """Time one cold start; returns {stage: (seconds, peak_rss_bytes)}."""
+    with tempfile.TemporaryDirectory(prefix="startupbench_") as tmp:
+        spawned_at = time.time()
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=_probe_env(os.path.join(tmp, "bench.db")),
+            capture_output=True, text=True, timeout=120
+        )
+    lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"startup probe failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+    report = json.loads(lines[-1][len(RESULT_MARKER):])
+    stages = {name: tuple(value) for name, value in report["stages"].items()}
+    stages["startup/ready"] = (report["ready_at"] - spawned_at, stages["startup/first_request"][1])
+    stages["startup/agent_ready"] = (report["agent_ready_at"] - spawned_at, report["agent_rss"])
+    return stages
+
+
+def run_benchmarks(repeat: int):
+    runs = []
+    for i in range(repeat):
+        print(f"Cold start {i + 1}/{repeat}...", file=sys.stderr)
+        runs.append(cold_start())
+
+    results = []
+    for stage in STAGES:
+        timings = [run[stage][0] for run in runs]
+        results.append({
+            "case": stage,
+            "median_seconds": statistics.median(timings),
+            "min_seconds": min(timings),
+            "max_seconds": max(timings),
+            "peak_memory_bytes": max(run[stage][1] for run in runs),
+        })
+    return results
+
+
+def slowest_imports(limit: int):
+    """(self seconds, cumulative seconds, module) of the slowest imports of app.main, from -X importtime."""
+    with tempfile.TemporaryDirectory(prefix="startupbench_") as tmp:
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app.main"], cwd=BACKEND_DIR,
+            env=_probe_env(os.path.join(tmp, "bench.db")), capture_output=True, text=True, timeout=120
+        )
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        imports.append((int(self_us) / 1e6, int(cumulative_us) / 1e6, module.rstrip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def _print_table(results: list):
+    header = f"{'stage':28} {'median ms':>10} {'min ms':>9} {'max ms':>9} {'peak MiB':>9} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        change = f"{entry['change'] * 100:+.0f}%" if entry.get("change") is not None else "-"
+        print(f"{entry['case']:28} {entry['median_seconds'] * 1000:10.1f} {entry['min_seconds'] * 1000:9.1f} "
+              f"{entry['max_seconds'] * 1000:9.1f} {entry['peak_memory_bytes'] / 1024 ** 2:9.1f} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark backend worker import and startup time.")
+    parser.add_argument("--repeat", type=int, default=5, help="cold starts to take the median of")
+    parser.add_argument("--importtime", type=int, metavar="N", default=0, help="also list the N slowest imports")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="exit 1 if a stage regressed past --threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            # Process start-up jitters by a few milliseconds; smaller changes are noise
+            regressions = compare_to_baseline(results, json.load(f), args.threshold, min_delta_seconds=0.01)
+    elif args.compare:
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.", file=sys.stderr)
+        return 2
+
+    _print_table(results)
+
+    if args.importtime:
+        print(f"\n{'self ms':>9} {'cumulative ms':>14}  module")
+        for self_seconds, cumulative_seconds, module in slowest_imports(args.importtime):
+            print(f"{self_seconds * 1000:9.1f} {cumulative_seconds * 1000:14.1f}  {module}")
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']}: time {regression['time_change'] * 100:+.0f}%, "
+              f"peak memory {regression['memory_change'] * 100:+.0f}%")
+    if args.compare and regressions:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import os
+import random
+
+# Sizes for each tier. "large" is meant for occasional runs, not every commit.
+TIERS = {
+    "small": {"files": 200, "depth": 8, "huge_file_mb": 1, "source_defs": 500, "binaries": 5, "binary_kb": 64},
+    "medium": {"files": 5000, "depth": 40, "huge_file_mb": 20, "source_defs": 5000, "binaries": 20, "binary_kb": 1024},
+    "large": {"files": 50000, "depth": 200, "huge_file_mb": 100, "source_defs": 50000, "binaries": 50, "binary_kb": 8192},
+}
+
+_WORDS = (
+    "alpha beta gamma delta request response session commit branch token stream "
+    "buffer worker queue cache index review status agent model tool result error"
+).split()
+
+# The needle search benchmarks look for; planted on every 1000th line of the huge file
+NEEDLE = "NEEDLE_4f2a"
+
+
+def _text_line(rng: random.Random, line_number: int):
+    words = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(4, 14)))
+    if line_number % 1000 == 0:
+        return f"{line_number}: {words} {NEEDLE}\n"
+    return f"{line_number}: {words}\n"
+
+
+def write_many_files(root: str, count: int, rng: random.Random):
+    """count small text files in one flat directory."""
+    path = os.path.join(root, "flat")
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(path, f"file_{i:06d}.txt"), "w") as f:
+            f.writelines(_text_line(rng, n) for n in range(rng.randint(1, 20)))
+    return path
+
+
+def write_deep_tree(root: str, depth: int, rng: random.Random):
+    """A chain of nested directories with a few files at every level; returns the deepest one."""
+    path = os.path.join(root, "deep")
+    for level in range(depth):
+        path = os.path.join(path, f"level_{level:03d}")
+        os.makedirs(path, exist_ok=True)
+        for i in range(3):
+            with open(os.path.join(path, f"module_{i}.py"), "w") as f:
+                f.write(f"def handler_{level}_{i}():\n    return {level * 10 + i}\n")
+    return path
+
+
+def write_huge_file(root: str, size_mb: int, rng: random.Random):
+    """One large text log of roughly size_mb megabytes."""
+    path = os.path.join(root, "huge.log")
+    target = size_mb * 1024 * 1024
+    written = 0
+    line_number = 1
+    with open(path, "w") as f:
+        while written < target:
+            line = _text_line(rng, line_number)
+            f.write(line)
+            written += len(line)
+            line_number += 1
+    return path
+
+
+def write_source_file(root: str, definitions: int, rng: random.Random):
+    """A long source file mixing Python, JavaScript and Go definitions for get_file_overview."""
+    path = os.path.join(root, "big_module.py")
+    templates = (
+        "def function_{n}(value):\n    return value + {n}\n\n",
+        "async def async_function_{n}(value):\n    return value * {n}\n\n",
+        "class Model{n}:\n    field = {n}\n\n",
+        "function jsFunction{n}(x) {{ return x + {n}; }}\n\n",
+        "func GoFunction{n}() int {{ return {n} }}\n\n",
+        "# plain comment line {n} with no definitions\nvalue_{n} = {n}\n\n",
+    )
+    with open(path, "w") as f:
+        for n in range(definitions):
+            f.write(rng.choice(templates).format(n=n))
+    return path
+
+
+def write_binaries(root: str, count: int, size_kb: int, rng: random.Random):
+    """Random binary blobs (not valid UTF-8), like images or compiled artifacts."""
+    path = os.path.join(root, "bin")
+    os.makedirs(path, exist_ok=True)
+    files = []
+    for i in range(count):
+        file_path = os.path.join(path, f"blob_{i:03d}.bin")
+        with open(file_path, "wb") as f:
+            f.write(rng.randbytes(size_kb * 1024))
+        files.append(file_path)
+    return files
+
+
+def build_repository(root: str, tier: str, seed: int = 1234):
+    """
+    Generate the synthetic repository for a tier under root.
+    The same tier and seed always produce the same content.
+    Returns the paths of the generated fixtures, relative to root.
+    """
+    spec = TIERS[tier]
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    fixtures = {
+        "flat_dir": write_many_files(root, spec["files"], rng),
+        "deep_dir": write_deep_tree(root, spec["depth"], rng),
+        "huge_file": write_huge_file(root, spec["huge_file_mb"], rng),
+        "source_file": write_source_file(root, spec["source_defs"], rng),
+        "binary_file": write_binaries(root, spec["binaries"], spec["binary_kb"], rng)[-1],
+    }
+    return {name: os.path.relpath(path, root) for name, path in fixtures.items()}
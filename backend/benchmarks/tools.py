@@ -0,0 +1,193 @@
+"""
+Micro-benchmarks for the agent's file tools in functions/.
+
+Run from the backend directory (works offline, standard library only):
+
+    python -m benchmarks.tools                      # small and medium tiers
+    python -m benchmarks.tools --tiers small large
+    python -m benchmarks.tools --save-baseline      # record benchmarks/baseline.json
+    python -m benchmarks.tools --compare            # fail if slower than the baseline
+
+Each case is timed over several runs (median wall time); peak Python memory is
+measured in a separate run with tracemalloc so it does not skew the timings.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.get_file_content import get_file_content
+from functions.get_file_overview import get_file_overview
+from functions.get_files_info import get_files_info
+from functions.search_in_file import search_in_file
+from functions.write_file import write_file
+from benchmarks.synthetic_repo import NEEDLE, TIERS, build_repository
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _file_size(root: str, rel_path: str):
+    return os.path.getsize(os.path.join(root, rel_path))
+
+
+def _cases(root: str, fixtures: dict):
+    """(name, callable, bytes processed per call, items processed per call) for one tier."""
+    flat_count = len(os.listdir(os.path.join(root, fixtures["flat_dir"])))
+    huge_bytes = _file_size(root, fixtures["huge_file"])
+    source_bytes = _file_size(root, fixtures["source_file"])
+    binary_bytes = _file_size(root, fixtures["binary_file"])
+    payload = "x = 1\n" * (256 * 1024 // 6)
+
+    return [
+        ("get_files_info/flat", lambda: get_files_info(root, fixtures["flat_dir"]), 0, flat_count),
+        ("get_files_info/deep", lambda: get_files_info(root, fixtures["deep_dir"]), 0, 3),
+        ("get_file_content/huge_full", lambda: get_file_content(root, fixtures["huge_file"]), huge_bytes, 1),
+        ("get_file_content/huge_first_100", lambda: get_file_content(root, fixtures["huge_file"], 1, 100), huge_bytes, 1),
+        ("get_file_content/binary", lambda: get_file_content(root, fixtures["binary_file"]), binary_bytes, 1),
+        ("search_in_file/huge_literal", lambda: search_in_file(root, fixtures["huge_file"], NEEDLE), huge_bytes, 1),
+        ("search_in_file/huge_regex_ci", lambda: search_in_file(root, fixtures["huge_file"], r"session\s+\w+ token", 2, False), huge_bytes, 1),
+        ("get_file_overview/source", lambda: get_file_overview(root, fixtures["source_file"]), source_bytes, 1),
+        ("write_file/256k", lambda: write_file(root, "bench_out/written.py", payload), len(payload), 1),
+        ("write_file/append", lambda: write_file(root, "bench_out/appended.log", "line of output", append=True), 15, 1),
+    ]
+
+
+def _run_case(func, repeat: int):
+    result = func()
+    if isinstance(result, dict) and "error" in result:
+        raise RuntimeError(result["error"])
+
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started_at)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return timings, peak
+
+
+def run_benchmarks(tiers: list, repeat: int, work_dir: str = None, only: str = None):
+    results = []
+    for tier in tiers:
+        root = tempfile.mkdtemp(prefix=f"toolbench_{tier}_", dir=work_dir)
+        try:
+            print(f"Generating {tier} repository in {root}...", file=sys.stderr)
+            fixtures = build_repository(root, tier)
+            for name, func, size_bytes, items in _cases(root, fixtures):
+                if only and only not in name:
+                    continue
+                timings, peak = _run_case(func, repeat)
+                median = statistics.median(timings)
+                results.append({
+                    "case": f"{tier}/{name}",
+                    "tier": tier,
+                    "median_seconds": median,
+                    "min_seconds": min(timings),
+                    "max_seconds": max(timings),
+                    "mb_per_second": size_bytes / median / 1024 ** 2 if size_bytes and median else None,
+                    "items_per_second": items / median if median else None,
+                    "peak_memory_bytes": peak,
+                })
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def compare_to_baseline(results: list, baseline: dict, threshold: float, min_delta_seconds: float = 0.0005):
+    """
+    Cases whose median time or peak memory grew by more than threshold (0.25 = 25%)
+    over the baseline. Time changes smaller than min_delta_seconds are treated as noise.
+    """
+    previous = {entry["case"]: entry for entry in baseline.get("results", [])}
+    regressions = []
+    for entry in results:
+        before = previous.get(entry["case"])
+        if not before or not before["median_seconds"]:
+            entry["change"] = None
+            continue
+        change = entry["median_seconds"] / before["median_seconds"] - 1
+        memory_change = entry["peak_memory_bytes"] / before["peak_memory_bytes"] - 1 if before["peak_memory_bytes"] else 0
+        entry["change"] = change
+        slower = change > threshold and entry["median_seconds"] - before["median_seconds"] > min_delta_seconds
+        if slower or memory_change > threshold:
+            regressions.append({"case": entry["case"], "time_change": change, "memory_change": memory_change})
+    return regressions
+
+
+def _print_table(results: list):
+    header = f"{'case':48} {'median ms':>10} {'MB/s':>9} {'items/s':>11} {'peak KiB':>10} {'vs base':>8}"
+    print(header)
+    print("-" * len(header))
+    for entry in results:
+        mbps = f"{entry['mb_per_second']:.1f}" if entry["mb_per_second"] else "-"
+        items = f"{entry['items_per_second']:.0f}" if entry["items_per_second"] else "-"
+        change = f"{entry['change'] * 100:+.0f}%" if entry.get("change") is not None else "-"
+        print(f"{entry['case']:48} {entry['median_seconds'] * 1000:10.2f} {mbps:>9} {items:>11} "
+              f"{entry['peak_memory_bytes'] / 1024:10.0f} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent's file tools on synthetic repositories.")
+    parser.add_argument("--tiers", nargs="+", choices=list(TIERS), default=["small", "medium"])
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case")
+    parser.add_argument("--only", help="run only cases whose name contains this")
+    parser.add_argument("--work-dir", help="where to generate repositories (default: system temp dir)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="exit 1 if a case regressed past --threshold")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.tiers, args.repeat, args.work_dir, args.only)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold)
+    elif args.compare:
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.", file=sys.stderr)
+        return 2
+
+    _print_table(results)
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']}: time {regression['time_change'] * 100:+.0f}%, "
+              f"peak memory {regression['memory_change'] * 100:+.0f}%")
+    if args.compare and regressions:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 import os
-from google.genai import types 
 
 
 
@@ -30,26 +29,26 @@ def get_file_content(working_directory, file_path, start_line=1,end_line=None):
     except Exception as e:
         return {"error": f"Exception reading lines {start_line} to {end_line} from file: {file_path}: {e}"}
         
-schema_get_file_content = types.FunctionDeclaration(
-    name="get_file_content",
-    description="Gets the contents of the given file as a string, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file from the working directory.",
-            ),
-            "start_line": types.Schema(
-                type=types.Type.INTEGER,
-                description="The line number to start reading from.",
-                default=1,
-            ),
-            "end_line": types.Schema(
-                type=types.Type.INTEGER,
-                description="The line number to stop reading at.",
-                default=None,
-            ),
+schema_get_file_content = {
+    "name": "get_file_content",
+    "description": "Gets the contents of the given file as a string, constrained to the working directory.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "file_path": {
+                "type": "STRING",
+                "description": "The path to the file from the working directory.",
+            },
+            "start_line": {
+                "type": "INTEGER",
+                "description": "The line number to start reading from.",
+                "default": 1,
+            },
+            "end_line": {
+                "type": "INTEGER",
+                "description": "The line number to stop reading at.",
+                "default": None,
+            },
         },
-    ),
-)
\ No newline at end of file
+    },
+}
\ No newline at end of file
@@ -1,6 +1,5 @@
 
 import os
-from google.genai import types 
 import re
 
 def get_file_overview(working_directory, file_path):
@@ -48,16 +47,16 @@ def extract_name(line): #extracts the name of the function or class from the lin
     else:
         return None
 
-schema_get_file_overview = types.FunctionDeclaration(
-    name="get_file_overview",
-    description="Gets an overview of functions and classes in a file, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file from the working directory.",
-            ),
+schema_get_file_overview = {
+    "name": "get_file_overview",
+    "description": "Gets an overview of functions and classes in a file, constrained to the working directory.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "file_path": {
+                "type": "STRING",
+                "description": "The path to the file from the working directory.",
+            },
         },
-    ),
-)
+    },
+}
@@ -1,5 +1,4 @@
 import os
-from google.genai import types 
 
 def get_files_info(working_directory, directory="."):
     abs_working_dir= os.path.abspath(working_directory)
@@ -23,16 +22,16 @@ def get_files_info(working_directory, directory="."):
 
     return {"files": files}
 
-schema_get_files_info = types.FunctionDeclaration(
-    name="get_files_info",
-    description="Lists files in the specified directory along with their sizes, constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "directory": types.Schema(
-                type=types.Type.STRING,
-                description="The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
-            ),
+schema_get_files_info = {
+    "name": "get_files_info",
+    "description": "Lists files in the specified directory along with their sizes, constrained to the working directory.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "directory": {
+                "type": "STRING",
+                "description": "The directory to list files from, relative to the working directory. If not provided, lists files in the working directory itself.",
+            },
         },
-    ),
-)
\ No newline at end of file
+    },
+}
\ No newline at end of file
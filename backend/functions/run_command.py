@@ -1,18 +1,28 @@
+import asyncio
 import os
-import subprocess
-from google.genai import types 
+from app.utils.process_runner import run_streaming
+from app.utils.package_cache import create_venv, package_env
+from app.utils.disk_usage import check_user_quota, is_install_command
 
-def run_command(working_directory: str, command: str, args=None):
+async def run_command(working_directory: str, command: str, args=None, on_output=None, user_id=None):
     """
     Run a shell command in the working directory.
     Automatically uses a virtual environment for Python commands if needed.
-    Returns stdout, stderr, and exit code.
+    Output lines are passed to on_output as they arrive (if given).
+    Commands run through the shared execution pool, queued fairly per user_id.
+    Returns stdout, stderr, exit code, wall time and time spent queued.
     """
     abs_working_dir = os.path.abspath(working_directory)
     
     if not os.path.isdir(abs_working_dir):
         return {"error": f'Error: "{working_directory}" is not a valid directory'}
     
+    # Installs are what fill the disk; refuse them once the user is over quota
+    if is_install_command(command, args):
+        quota_error = await asyncio.to_thread(check_user_quota, user_id)
+        if quota_error:
+            return quota_error
+
     # Check if this is a pip install command - use venv if needed
     venv_path = os.path.join(abs_working_dir, ".venv")
     use_venv = False
@@ -22,22 +32,12 @@ def run_command(working_directory: str, command: str, args=None):
         # Check if it's an install command
         if any(arg in args_list for arg in ["install", "i"]):
             use_venv = True
-            # Create venv if it doesn't exist
+            # Create venv if it doesn't exist (cloned from the shared template when configured)
             if not os.path.exists(venv_path):
                 try:
-                    venv_output = subprocess.run(
-                        ["python3", "-m", "venv", venv_path],
-                        cwd=abs_working_dir,
-                        timeout=30,
-                        capture_output=True,
-                        text=True
-                    )
-                    if venv_output.returncode != 0:
-                        return {
-                            "error": f"Failed to create virtual environment: {venv_output.stderr}",
-                            "stdout": venv_output.stdout,
-                            "stderr": venv_output.stderr
-                        }
+                    venv_result = await create_venv(venv_path, abs_working_dir, on_output=on_output, owner=user_id)
+                    if "error" in venv_result:
+                        return venv_result
                 except Exception as e:
                     return {"error": f"Error creating virtual environment: {e}"}
     
@@ -80,48 +80,59 @@ def run_command(working_directory: str, command: str, args=None):
                 return {"error": f"Invalid args type: {type(args)}. Expected list or string."}
     
     try:
-        output = subprocess.run(
+        output = await run_streaming(
             cmd_list,
             cwd=abs_working_dir,
             timeout=60,
-            capture_output=True,
-            text=True
+            on_output=on_output,
+            env=package_env(),
+            owner=user_id
         )
+        if output["timed_out"]:
+            return {
+                "error": "Command timed out after 60 seconds",
+                "stdout": output["stdout"],
+                "stderr": output["stderr"],
+                "duration_seconds": output["duration_seconds"],
+                "queue_wait_seconds": output["queue_wait_seconds"]
+            }
         result = {
-            "stdout": output.stdout,
-            "stderr": output.stderr,
-            "exit_code": output.returncode,
-            "success": output.returncode == 0
+            "stdout": output["stdout"],
+            "stderr": output["stderr"],
+            "exit_code": output["exit_code"],
+            "success": output["exit_code"] == 0,
+            "duration_seconds": output["duration_seconds"],
+            "queue_wait_seconds": output["queue_wait_seconds"]
         }
+        if output["truncated"]:
+            result["note_truncated"] = "Output was truncated to its first and last lines"
         # Add note about venv if used
         if use_venv:
             result["note"] = "Used virtual environment (.venv) for package installation"
         return result
-    except subprocess.TimeoutExpired:
-        return {"error": "Command timed out after 60 seconds"}
     except FileNotFoundError:
         return {"error": f"Error: Command '{command}' not found. Make sure it's installed and in your system's PATH."}
     except Exception as e:
         return {"error": f"Error executing command: {e}"}
 
 
-schema_run_command = types.FunctionDeclaration(
-    name="run_command",
-    description="Run a shell command in the working directory. Useful for running tests (pytest, npm test), installing dependencies (pip install, npm install), or any other shell commands. Returns stdout, stderr, exit code, and success status.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "command": types.Schema(
-                type=types.Type.STRING,
-                description="The command to run (e.g., 'pytest', 'pip', 'npm', 'python3', etc.)",
-            ),
-            "args": types.Schema(
-                type=types.Type.ARRAY,
-                items=types.Schema(type=types.Type.STRING),
-                description="Optional list of arguments to pass to the command (e.g., ['install', '-r', 'requirements.txt'] for pip, or ['test_calculator.py'] for pytest)",
-            ),
+schema_run_command = {
+    "name": "run_command",
+    "description": "Run a shell command in the working directory. Useful for running tests (pytest, npm test), installing dependencies (pip install, npm install), or any other shell commands. Returns stdout, stderr (long output is truncated in the middle), exit code, success status and wall time.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "command": {
+                "type": "STRING",
+                "description": "The command to run (e.g., 'pytest', 'pip', 'npm', 'python3', etc.)",
+            },
+            "args": {
+                "type": "ARRAY",
+                "items": {"type": "STRING"},
+                "description": "Optional list of arguments to pass to the command (e.g., ['install', '-r', 'requirements.txt'] for pip, or ['test_calculator.py'] for pytest)",
+            },
         },
-        required=["command"],
-    ),
-)
+        "required": ["command"],
+    },
+}
 
@@ -1,8 +1,7 @@
 import os
-import subprocess
-from google.genai import types 
+from app.utils.process_runner import run_streaming
 
-def run_program_file(working_directory:str, file_path:str):
+async def run_program_file(working_directory:str, file_path:str, on_output=None, user_id=None):
     abs_working_dir= os.path.abspath(working_directory)
     abs_file_path= os.path.abspath(os.path.join(working_directory, file_path))
 
@@ -21,27 +20,29 @@ def run_program_file(working_directory:str, file_path:str):
         return {"error": f'Error: "{file_path}" is not a supported file type'}
 
     try:
-        output=subprocess.run([language_type, file_path], cwd=abs_working_dir, timeout=30, capture_output=True, check=True, text=True)
-        result={"stdout":output.stdout,"stderr":output.stderr}
+        output=await run_streaming([language_type, file_path], cwd=abs_working_dir, timeout=30, on_output=on_output, owner=user_id)
+        if output["timed_out"]:
+            return {"error": "Program timed out after 30 seconds", "stdout": output["stdout"], "stderr": output["stderr"], "duration_seconds": output["duration_seconds"], "queue_wait_seconds": output["queue_wait_seconds"]}
+        if output["exit_code"] != 0:
+            return {"error": f"Command failed with exit code {output['exit_code']}", "stderr": output["stderr"], "exit_code": output["exit_code"], "duration_seconds": output["duration_seconds"], "queue_wait_seconds": output["queue_wait_seconds"]}
+        result={"stdout":output["stdout"],"stderr":output["stderr"],"exit_code":output["exit_code"],"duration_seconds":output["duration_seconds"],"queue_wait_seconds":output["queue_wait_seconds"]}
         return result
-    except subprocess.CalledProcessError as e:
-        return {"error": f"Command failed with exit code {e.returncode}", "stderr": e.stderr}
     except FileNotFoundError:
         return {"error": f"Error: {language_type} executable not found. Make sure {language_type} is installed and in your system's PATH."}
     except Exception as e:
         return {"error": f"Error executing {language_type} file: {e}"}
 
 
-schema_run_program_file = types.FunctionDeclaration(
-    name="run_program_file",
-    description="Runs a file with the python3 or node interpreter depending on the file extension.Returns the stdout and stderr of the command.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The file to run, relative to the working directory.",
-            ),
+schema_run_program_file = {
+    "name": "run_program_file",
+    "description": "Runs a file with the python3 or node interpreter depending on the file extension.Returns the stdout and stderr of the command.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "file_path": {
+                "type": "STRING",
+                "description": "The file to run, relative to the working directory.",
+            },
         },
-    ),
-)
\ No newline at end of file
+    },
+}
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-from google.genai import types 
 import re
 
 
@@ -72,35 +71,35 @@ def search_in_file(working_directory,file_path,pattern,context_lines=0,case_sens
     except Exception as e:
         return {"error": f"Exception searching in file: {file_path} for pattern: {pattern}: {e}"}
 
-schema_search_in_file = types.FunctionDeclaration(
-    name="search_in_file",
-    description="Searches for a regex pattern in a file, constrained to the working directory. Returns matches with line numbers, positions, and optional context.",  
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={    
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file from the working directory.",
-            ),
-            "pattern": types.Schema(
-                type=types.Type.STRING,
-                description="The regex pattern to search for in the file.",
-            ),  
-            "context_lines": types.Schema(
-                type=types.Type.INTEGER,
-                description="The number of lines of context to include before and after each match. Default: 0.",
-                default=0
-            ),
-            "case_sensitive": types.Schema(
-                type=types.Type.BOOLEAN,
-                description="Whether the search should be case sensitive. Default: true.",
-                default=True
-            ),
-            "max_results": types.Schema(
-                type=types.Type.INTEGER,
-                description="The maximum number of matches to return. Default: 200.",
-                default=200
-            ),
+schema_search_in_file = {
+    "name": "search_in_file",
+    "description": "Searches for a regex pattern in a file, constrained to the working directory. Returns matches with line numbers, positions, and optional context.",  
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {    
+            "file_path": {
+                "type": "STRING",
+                "description": "The path to the file from the working directory.",
+            },
+            "pattern": {
+                "type": "STRING",
+                "description": "The regex pattern to search for in the file.",
+            },  
+            "context_lines": {
+                "type": "INTEGER",
+                "description": "The number of lines of context to include before and after each match. Default: 0.",
+                "default": 0
+            },
+            "case_sensitive": {
+                "type": "BOOLEAN",
+                "description": "Whether the search should be case sensitive. Default: true.",
+                "default": True
+            },
+            "max_results": {
+                "type": "INTEGER",
+                "description": "The maximum number of matches to return. Default: 200.",
+                "default": 200
+            },
         },
-    ),
-)
\ No newline at end of file
+    },
+}
\ No newline at end of file
@@ -1,5 +1,5 @@
 import os
-from google.genai import types 
+import shutil
 
 def write_file(working_directory, file_path,content,append=False):
     abs_working_dir= os.path.abspath(working_directory)
@@ -16,6 +16,11 @@ def write_file(working_directory, file_path,content,append=False):
         except Exception as e:
             return {"error": f"Could not create parent dirs: {parent_dir}= {e}"}
     try:
+        # Clones may share identical files through hardlinks; give this one its own copy first
+        if os.path.isfile(abs_file_path) and os.stat(abs_file_path).st_nlink > 1:
+            tmp_path = f"{abs_file_path}.write-tmp"
+            shutil.copy2(abs_file_path, tmp_path)
+            os.replace(tmp_path, abs_file_path)
         with open(abs_file_path, 'a' if append else 'w',encoding='utf-8',errors='replace') as f:
             if append:
                 f.write(content + "\n")
@@ -26,25 +31,25 @@ def write_file(working_directory, file_path,content,append=False):
     except Exception as e:
         return {"error": f"Failed to write to file: {file_path}, {e}"}
 
-schema_write_file = types.FunctionDeclaration(
-    name="write_file",
-    description="Writes content to a file. By default (append=False), overwrites the entire file. If append=True, appends content to the end of the file. Creates the file and required parent directories if they don't exist. All operations are constrained to the working directory.",
-    parameters=types.Schema(
-        type=types.Type.OBJECT,
-        properties={
-            "file_path": types.Schema(
-                type=types.Type.STRING,
-                description="The path to the file to write, relative to the working directory.",
-            ),
-            "content": types.Schema(
-                type=types.Type.STRING,
-                description="The contents to write to the file as a string",
-            ),
-            "append": types.Schema(
-                type=types.Type.BOOLEAN,
-                description="Whether to append to the file if it already exists. Default: false.",
-                default=False,
-            ),
+schema_write_file = {
+    "name": "write_file",
+    "description": "Writes content to a file. By default (append=False), overwrites the entire file. If append=True, appends content to the end of the file. Creates the file and required parent directories if they don't exist. All operations are constrained to the working directory.",
+    "parameters": {
+        "type": "OBJECT",
+        "properties": {
+            "file_path": {
+                "type": "STRING",
+                "description": "The path to the file to write, relative to the working directory.",
+            },
+            "content": {
+                "type": "STRING",
+                "description": "The contents to write to the file as a string",
+            },
+            "append": {
+                "type": "BOOLEAN",
+                "description": "Whether to append to the file if it already exists. Default: false.",
+                "default": False,
+            },
         },
-    ),
-)
+    },
+}
@@ -0,0 +1,172 @@
+"""
+Local stand-in for the Gemini API, for load tests that must not spend quota.
+
+Answers POST /generate with scripted responses: each user prompt walks through
+the script's steps (function calls, then a final text answer), one step per
+model call. Start it, then run the backend with MODEL_BACKEND=fake:
+
+    python -m loadtest.fake_model_server --port 8089 --latency-ms 300 --jitter-ms 100
+    MODEL_BACKEND=fake FAKE_MODEL_URL=http://127.0.0.1:8089 uvicorn app.main:app
+
+A custom script is a JSON file like:
+
+    {"steps": [
+        {"function_call": {"name": "get_files_info", "args": {"directory": "."}}},
+        {"function_call": {"name": "write_file", "args": {"file_path": "out.txt", "content": "hi"}}},
+        {"text": "Done."}
+    ]}
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SCRIPT = {
+    "steps": [
+        {"function_call": {"name": "get_files_info", "args": {"directory": "."}}},
+        {"function_call": {"name": "get_file_content", "args": {"file_path": "README.md"}}},
+        {"function_call": {"name": "search_in_file", "args": {"file_path": "README.md", "pattern": "load"}}},
+        {"function_call": {"name": "write_file", "args": {"file_path": "loadtest_notes.txt", "content": "written by the load test\n"}}},
+        {"text": "Done. I read the README and wrote loadtest_notes.txt."},
+    ]
+}
+
+
+def script_step(contents: list, steps: list):
+    """
+    The step to answer with: the number of model turns since the latest user prompt.
+    Tool results come back with role "tool", so they do not reset the count.
+    """
+    last_prompt = -1
+    for i, content in enumerate(contents):
+        parts = content.get("parts") or []
+        if content.get("role") == "user" and any("text" in part for part in parts):
+            last_prompt = i
+    model_turns = sum(1 for content in contents[last_prompt + 1:] if content.get("role") == "model")
+    return steps[min(model_turns, len(steps) - 1)]
+
+
+def build_response(step: dict, prompt_tokens: int):
+    if "function_call" in step:
+        part = {"function_call": step["function_call"]}
+    else:
+        part = {"text": step.get("text", "Done.")}
+    output_tokens = max(1, len(json.dumps(part)) // 4)
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [part]}, "finish_reason": "STOP"}],
+        "usage_metadata": {
+            "prompt_token_count": prompt_tokens,
+            "candidates_token_count": output_tokens,
+            "total_token_count": prompt_tokens + output_tokens,
+        },
+    }
+
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    server_version = "FakeModel/1.0"
+    # Set by make_server
+    script = DEFAULT_SCRIPT
+    latency_ms = 0.0
+    jitter_ms = 0.0
+    error_rate = 0.0
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok", **self.stats.snapshot()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        time.sleep(delay / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats.record(error=True)
+            self._send_json(503, {"error": "injected failure"})
+            return
+
+        contents = request.get("contents") or []
+        step = script_step(contents, self.script["steps"])
+        prompt_tokens = max(1, len(json.dumps(contents)) // 4)
+        self.stats.record(error=False)
+        self._send_json(200, build_response(step, prompt_tokens))
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, error: bool):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors}
+
+
+def make_server(host: str = "127.0.0.1", port: int = 8089, script: dict = None,
+                latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0):
+    """A ready-to-serve fake model server (call serve_forever, or run it in a thread)."""
+    handler = type("ConfiguredFakeModelHandler", (FakeModelHandler,), {
+        "script": script or DEFAULT_SCRIPT,
+        "latency_ms": latency_ms,
+        "jitter_ms": jitter_ms,
+        "error_rate": error_rate,
+        "stats": _Stats(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scripted fake Gemini server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--script", help="JSON file with the steps to play back")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="mean response latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 503")
+    args = parser.parse_args(argv)
+
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    server = make_server(args.host, args.port, script, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Fake model server on http://{args.host}:{args.port} "
+          f"(latency {args.latency_ms}±{args.jitter_ms} ms, error rate {args.error_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
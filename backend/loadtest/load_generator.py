@@ -0,0 +1,219 @@
+"""
+Opens many concurrent /agent/stream/{session_id} websockets against a running
+backend and reports throughput and latency percentiles.
+
+Run from the backend directory. --setup creates throwaway users and sessions
+(each with its own clone of a small generated repository) directly in the
+backend's database, so it needs the same DATABASE_URL and JWT_SECRET as the
+server. A fully local run, with no Postgres, Redis or Gemini:
+
+    export DATABASE_URL=sqlite:////tmp/loadtest.db JWT_SECRET=loadtest REDIS_URL=none
+    python -m loadtest.fake_model_server --latency-ms 300 &
+    MODEL_BACKEND=fake uvicorn app.main:app --port 8000 &
+    python -m loadtest.load_generator --setup --sessions 200 --prompts 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+import websockets
+
+FINAL_STATUSES = ("completed", "error", "max_iterations_reached", "budget_exceeded")
+LOADTEST_GITHUB_ID_BASE = 900_000_000
+
+
+def _git(*args, cwd=None):
+    subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True)
+
+
+def make_template_repository(path: str):
+    """A small git repository for the scripted tools to read and write."""
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(os.path.join(path, "src"))
+    with open(os.path.join(path, "README.md"), "w") as f:
+        f.write("# Load test fixture\n\nThis repository is generated by the load generator.\n")
+    for i in range(20):
+        with open(os.path.join(path, "src", f"module_{i}.py"), "w") as f:
+            f.write(f"def handler_{i}(value):\n    return value + {i}\n")
+    _git("init", "-q", cwd=path)
+    _git("add", ".", cwd=path)
+    _git("-c", "user.name=loadtest", "-c", "user.email=loadtest@localhost", "commit", "-qm", "fixture", cwd=path)
+
+
+def setup_sessions(count: int, work_dir: str, template: str = None):
+    """Create one user and one ready session per connection; returns [(session_id, token)]."""
+    from app.database import SessionLocal, init_db
+    from app.models import Session as SessionModel
+    from app.models import User as UserModel
+
+    if template is None:
+        template = os.path.join(work_dir, "template")
+        make_template_repository(template)
+
+    secret = os.getenv("JWT_SECRET")
+    if not secret:
+        raise SystemExit("JWT_SECRET must be set to the server's value")
+
+    init_db()
+    db = SessionLocal()
+    sessions = []
+    try:
+        now = datetime.now(timezone.utc)
+        for i in range(count):
+            user = db.query(UserModel).filter(UserModel.github_id == LOADTEST_GITHUB_ID_BASE + i).first()
+            if user is None:
+                user = UserModel(github_id=LOADTEST_GITHUB_ID_BASE + i, username=f"loadtest-{i}", avatar_url="")
+                db.add(user)
+                db.flush()
+            session_id = str(uuid.uuid4())
+            clone_path = os.path.join(work_dir, f"repo_{session_id}")
+            _git("clone", "-q", "--shared", template, clone_path)
+            db.add(SessionModel(
+                id=session_id,
+                user_id=user.id,
+                repo_name="loadtest",
+                repo_url="https://github.com/loadtest/fixture.git",
+                clone_path=clone_path,
+                created_at=now,
+                last_activity_at=now,
+                expires_at=now + timedelta(hours=2),
+                status="ready"
+            ))
+            sessions.append((session_id, jwt.encode({"user_id": user.id}, secret, algorithm="HS256")))
+        db.commit()
+    finally:
+        db.close()
+    return sessions
+
+
+def teardown_sessions(session_ids: list):
+    from app.utils.file_cleanup import cleanup_session
+    for session_id in session_ids:
+        cleanup_session(session_id)
+
+
+async def run_connection(ws_url: str, session_id: str, token: str, prompts: int, prompt: str, stats: dict):
+    url = f"{ws_url}/agent/stream/{session_id}?token={token}"
+    started_at = time.perf_counter()
+    try:
+        async with websockets.connect(url, open_timeout=60, max_size=None) as ws:
+            json.loads(await ws.recv())  # "connected"
+            stats["connect"].append(time.perf_counter() - started_at)
+            for n in range(prompts):
+                sent_at = time.perf_counter()
+                first_event_at = None
+                await ws.send(json.dumps({"prompt": f"{prompt} (#{n})"}))
+                while True:
+                    update = json.loads(await ws.recv())
+                    stats["events"] += 1
+                    if first_event_at is None:
+                        first_event_at = time.perf_counter()
+                        stats["first_event"].append(first_event_at - sent_at)
+                    if update.get("type") == "error" or update.get("status") in FINAL_STATUSES:
+                        break
+                stats["prompt"].append(time.perf_counter() - sent_at)
+                if update.get("status") == "completed":
+                    stats["completed"] += 1
+                else:
+                    stats["failed"] += 1
+                    stats["errors"].append(update.get("message"))
+    except Exception as e:
+        stats["failed"] += 1
+        stats["errors"].append(f"{type(e).__name__}: {e}")
+
+
+def _percentiles(values: list):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "p50": round(pick(0.50), 4),
+        "p90": round(pick(0.90), 4),
+        "p95": round(pick(0.95), 4),
+        "p99": round(pick(0.99), 4),
+        "max": round(ordered[-1], 4),
+        "mean": round(statistics.fmean(ordered), 4),
+    }
+
+
+async def run_load(ws_url: str, sessions: list, prompts: int, prompt: str, ramp_seconds: float):
+    stats = {"connect": [], "first_event": [], "prompt": [], "events": 0, "completed": 0, "failed": 0, "errors": []}
+    started_at = time.perf_counter()
+    tasks = []
+    for i, (session_id, token) in enumerate(sessions):
+        if ramp_seconds and len(sessions) > 1:
+            await asyncio.sleep(ramp_seconds / len(sessions))
+        tasks.append(asyncio.create_task(run_connection(ws_url, session_id, token, prompts, prompt, stats)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started_at
+
+    error_counts = {}
+    for error in stats["errors"]:
+        error_counts[str(error)[:120]] = error_counts.get(str(error)[:120], 0) + 1
+    return {
+        "connections": len(sessions),
+        "prompts_per_connection": prompts,
+        "wall_seconds": round(elapsed, 3),
+        "prompts_completed": stats["completed"],
+        "prompts_failed": stats["failed"],
+        "prompts_per_second": round(stats["completed"] / elapsed, 3) if elapsed else None,
+        "events_per_second": round(stats["events"] / elapsed, 3) if elapsed else None,
+        "connect_seconds": _percentiles(stats["connect"]),
+        "first_event_seconds": _percentiles(stats["first_event"]),
+        "prompt_seconds": _percentiles(stats["prompt"]),
+        "errors": error_counts,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Websocket load generator for the agent stream endpoint.")
+    parser.add_argument("--server", default="ws://127.0.0.1:8000", help="backend websocket base URL")
+    parser.add_argument("--sessions", type=int, default=100, help="concurrent websocket connections")
+    parser.add_argument("--prompts", type=int, default=3, help="prompts sent on each connection, one after another")
+    parser.add_argument("--prompt", default="Read the README and leave a note.")
+    parser.add_argument("--ramp-seconds", type=float, default=5.0, help="spread connection opens over this long")
+    parser.add_argument("--setup", action="store_true", help="create users, sessions and clones in the database first")
+    parser.add_argument("--sessions-file", help="JSON list of [session_id, token] pairs to use instead of --setup")
+    parser.add_argument("--work-dir", default="/tmp/reporefine_loadtest", help="where --setup puts the clones")
+    parser.add_argument("--template", help="git repository to clone for each session (default: generated)")
+    parser.add_argument("--keep", action="store_true", help="keep the sessions created by --setup")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.setup:
+        os.makedirs(args.work_dir, exist_ok=True)
+        print(f"Creating {args.sessions} sessions in {args.work_dir}...", file=sys.stderr)
+        sessions = setup_sessions(args.sessions, args.work_dir, args.template)
+    elif args.sessions_file:
+        with open(args.sessions_file) as f:
+            sessions = [tuple(pair) for pair in json.load(f)][:args.sessions]
+    else:
+        parser.error("use --setup or --sessions-file")
+
+    try:
+        report = asyncio.run(run_load(args.server.rstrip("/"), sessions, args.prompts, args.prompt, args.ramp_seconds))
+    finally:
+        if args.setup and not args.keep:
+            teardown_sessions([session_id for session_id, _ in sessions])
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["prompts_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
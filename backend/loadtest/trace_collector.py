@@ -0,0 +1,207 @@
+"""
+Local stand-in for an OpenTelemetry collector, and a terminal waterfall view of traces.
+
+Receive spans over OTLP/HTTP JSON (TRACE_EXPORTER=otlp) and append them to a file:
+
+    python -m loadtest.trace_collector serve --port 4318 --output traces.jsonl
+
+TRACE_EXPORTER=file writes the same format directly. Show the slowest recent traces,
+or one trace as a waterfall:
+
+    python -m loadtest.trace_collector list traces.jsonl
+    python -m loadtest.trace_collector show traces.jsonl --trace-id 4bf92f3577b34da6a3ce929d0e0e4736
+
+The file holds one OTLP/JSON export request per line, so any OTLP tool can load it too.
+"""
+import argparse
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BAR_WIDTH = 40
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    server_version = "TraceCollector/1.0"
+    output_path = "traces.jsonl"
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != "/v1/traces":
+            self._reply(404, {"error": "not found"})
+            return
+        if "json" not in (self.headers.get("Content-Type") or ""):
+            self._reply(415, {"error": "only OTLP/HTTP JSON is supported"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400, {"error": "invalid JSON"})
+            return
+        with self.lock, open(self.output_path, "a") as f:
+            f.write(json.dumps(payload) + "\n")
+        self._reply(200, {"partialSuccess": {}})
+
+
+def make_server(host: str = "127.0.0.1", port: int = 4318, output_path: str = "traces.jsonl"):
+    handler = type("ConfiguredCollectorHandler", (CollectorHandler,), {"output_path": output_path})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _attribute(value: dict):
+    for kind in ("stringValue", "boolValue", "doubleValue"):
+        if kind in value:
+            return value[kind]
+    if "intValue" in value:
+        return int(value["intValue"])
+    return None
+
+
+def load_spans(path: str):
+    """All spans in an OTLP/JSON lines file, flattened, with the service name of each."""
+    spans = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource_spans in json.loads(line).get("resourceSpans", []):
+                resource = {a["key"]: _attribute(a["value"]) for a in resource_spans.get("resource", {}).get("attributes", [])}
+                for scope_spans in resource_spans.get("scopeSpans", []):
+                    for raw in scope_spans.get("spans", []):
+                        spans.append({
+                            "trace_id": raw["traceId"],
+                            "span_id": raw["spanId"],
+                            "parent_id": raw.get("parentSpanId") or None,
+                            "name": raw["name"],
+                            "start_ns": int(raw["startTimeUnixNano"]),
+                            "end_ns": int(raw["endTimeUnixNano"]),
+                            "attributes": {a["key"]: _attribute(a["value"]) for a in raw.get("attributes", [])},
+                            "error": raw.get("status", {}).get("code") == 2,
+                            "status_message": raw.get("status", {}).get("message"),
+                            "service": resource.get("service.name"),
+                        })
+    return spans
+
+
+def group_traces(spans: list):
+    traces = {}
+    for s in spans:
+        traces.setdefault(s["trace_id"], []).append(s)
+    return traces
+
+
+def trace_summary(trace_id: str, spans: list):
+    start = min(s["start_ns"] for s in spans)
+    end = max(s["end_ns"] for s in spans)
+    ids = {s["span_id"] for s in spans}
+    roots = [s for s in spans if s["parent_id"] not in ids]
+    root = min(roots or spans, key=lambda s: s["start_ns"])
+    return {
+        "trace_id": trace_id,
+        "root": root["name"],
+        "duration_ms": (end - start) / 1e6,
+        "spans": len(spans),
+        "errors": sum(1 for s in spans if s["error"]),
+        "start_ns": start,
+    }
+
+
+def render_waterfall(spans: list, width: int = BAR_WIDTH):
+    """Text waterfall of one trace: each span indented under its parent, with a bar for its time window."""
+    start = min(s["start_ns"] for s in spans)
+    total = max(max(s["end_ns"] for s in spans) - start, 1)
+    ids = {s["span_id"] for s in spans}
+    children = {}
+    for s in spans:
+        parent = s["parent_id"] if s["parent_id"] in ids else None
+        children.setdefault(parent, []).append(s)
+
+    lines = []
+
+    def visit(parent, depth):
+        for s in sorted(children.get(parent, []), key=lambda item: item["start_ns"]):
+            offset = int((s["start_ns"] - start) / total * width)
+            length = max(1, round((s["end_ns"] - s["start_ns"]) / total * width))
+            bar = " " * offset + "█" * min(length, width - offset)
+            label = ("  " * depth + s["name"])[:48]
+            detail = " ".join(
+                f"{key}={value}" for key, value in s["attributes"].items()
+                if key in ("tool", "command", "exit_code", "total_tokens", "outcome", "http.status_code")
+            )
+            marker = " ERROR " + (s["status_message"] or "") if s["error"] else ""
+            lines.append(f"{label:<48} |{bar:<{width}}| {(s['end_ns'] - s['start_ns']) / 1e6:9.1f} ms {detail}{marker}".rstrip())
+            visit(s["span_id"], depth + 1)
+
+    visit(None, 0)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local OTLP/HTTP JSON trace collector and waterfall viewer.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="receive spans on /v1/traces and append them to a file")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=4318)
+    serve.add_argument("--output", default="traces.jsonl")
+
+    listing = commands.add_parser("list", help="list traces, slowest first")
+    listing.add_argument("path")
+    listing.add_argument("--limit", type=int, default=20)
+
+    show = commands.add_parser("show", help="print one trace as a waterfall (default: the slowest)")
+    show.add_argument("path")
+    show.add_argument("--trace-id")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = make_server(args.host, args.port, args.output)
+        print(f"Collecting OTLP/HTTP JSON on http://{args.host}:{args.port}/v1/traces into {args.output}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    traces = group_traces(load_spans(args.path))
+    if not traces:
+        print("No spans found.", file=sys.stderr)
+        return 1
+    summaries = sorted((trace_summary(tid, spans) for tid, spans in traces.items()),
+                       key=lambda summary: summary["duration_ms"], reverse=True)
+
+    if args.command == "list":
+        for summary in summaries[:args.limit]:
+            print(f"{summary['trace_id']}  {summary['duration_ms']:10.1f} ms  {summary['spans']:4d} spans  "
+                  f"{summary['errors']:3d} errors  {summary['root']}")
+        return 0
+
+    trace_id = args.trace_id or summaries[0]["trace_id"]
+    if trace_id not in traces:
+        print(f"Trace {trace_id} not found.", file=sys.stderr)
+        return 1
+    summary = trace_summary(trace_id, traces[trace_id])
+    print(f"trace {trace_id}  {summary['duration_ms']:.1f} ms  {summary['spans']} spans  {summary['errors']} errors")
+    print(render_waterfall(traces[trace_id]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
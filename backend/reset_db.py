@@ -14,27 +14,27 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect
-from app.database import Base, engine
-from app.models import User, Session, Message, Review
+from sqlalchemy import inspect
+from app.database import Base, get_engine
+from app.models import User, Session, Message, Review, RepoHistory, TokenUsage, Node
 
 load_dotenv()
 
 def drop_all_tables():
     """Drop all tables in the database."""
     print("Dropping all tables...")
-    Base.metadata.drop_all(bind=engine)
+    Base.metadata.drop_all(bind=get_engine())
     print("✓ All tables dropped")
 
 def create_all_tables():
     """Create all tables based on current models."""
     print("Creating all tables...")
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
     print("✓ All tables created")
 
 def list_tables():
     """List all tables in the database."""
-    inspector = inspect(engine)
+    inspector = inspect(get_engine())
     tables = inspector.get_table_names()
     if tables:
         print(f"\nCurrent tables in database:")
@@ -123,6 +123,20 @@ export default function App() {
 
   // Handle incoming WebSocket messages
   useEffect(() => {
+    async function fetchReview(reviewId) {
+      const reviewResponse = await fetch(`/api/agent/review/${reviewId}`)
+      const reviewData = await reviewResponse.json()
+      const hasChanges = reviewData.changes && reviewData.changes.modified?.length > 0 || 
+        reviewData.changes.added?.length > 0 || 
+        reviewData.changes.deleted?.length > 0 ||
+        reviewData.changes.renamed?.length > 0
+      
+      if(hasChanges) {
+        setPendingReview(true)
+        setReview(reviewData)
+      }
+    }
+
     if (lastMessage) {
       try {
         const data = JSON.parse(lastMessage.data)
@@ -131,6 +145,9 @@ export default function App() {
         if (data.type === 'connected') {
           // Connection confirmed - do nothing, just log
           console.log('WebSocket connected:', data.message)
+        } else if (data.type === 'queued') {
+          // Waiting for a free agent slot on the server
+          setAgentResponse(data.message || `Queued (position ${data.position})...`)
         } else if (data.type === 'agent_started') {
           // Agent started processing - show loading state
           setAgentResponse('Processing...')
@@ -160,23 +177,21 @@ export default function App() {
             setChatHistory(prev => [...prev, { role: 'assistant', content: fullResponse }])
           }
           if(data.review_id) {
-            async function fetchReview() {
-              const reviewResponse = await fetch(`/api/agent/review/${data.review_id}`)
-              const reviewData = await reviewResponse.json()
-              const hasChanges = reviewData.changes && reviewData.changes.modified?.length > 0 || 
-                reviewData.changes.added?.length > 0 || 
-                reviewData.changes.deleted?.length > 0
-              
-              if(hasChanges) {
-                setPendingReview(true)
-                setReview(reviewData)
-              }
-            }
-            fetchReview()
+            fetchReview(data.review_id)
+          }
+        } else if (data.status === 'budget_exceeded') {
+          // Out of tokens - the run stopped early, but its changes can still be reviewed
+          setError(data.message || 'Token budget exceeded')
+          if (data.agent_responses && data.agent_responses.length > 0) {
+            setAgentResponses(data.agent_responses)
+            setAgentResponse(data.agent_responses.join('\n\n'))
+          }
+          if(data.review_id) {
+            fetchReview(data.review_id)
           }
         } else if (data.status === 'error') {
           // Agent error
-          setError(data.message || 'An error occurred')
+          setError(data.retry_after ? `${data.message} Try again in ${data.retry_after}s.` : (data.message || 'An error occurred'))
           if (data.agent_responses && data.agent_responses.length > 0) {
             setAgentResponses(data.agent_responses)
             setAgentResponse(data.agent_responses.join('\n\n'))
@@ -232,7 +247,8 @@ export default function App() {
           id: selectedRepository.id,
           name: selectedRepository.name,
           full_name: selectedRepository.full_name,
-          private: selectedRepository.private
+          private: selectedRepository.private,
+          size: selectedRepository.size
         }),
         credentials: 'include'
       })
@@ -243,6 +259,25 @@ export default function App() {
       }
       
       const data = await response.json()
+
+      // Cloning runs in the background; wait until the session is ready
+      let status = data.status
+      while (status === 'cloning') {
+        await new Promise((resolve) => setTimeout(resolve, 1000))
+        const statusResponse = await fetch(`/api/user/sessions/${data.session_id}/status`, {
+          credentials: 'include'
+        })
+        if (!statusResponse.ok) {
+          const errorData = await statusResponse.json().catch(() => ({}))
+          throw new Error(errorData.detail || 'Failed to check clone status')
+        }
+        const statusData = await statusResponse.json()
+        status = statusData.status
+        if (status === 'failed') {
+          throw new Error(statusData.message || 'Failed to clone repository')
+        }
+      }
+
       setClonedSessionId(data.session_id)
       setShowRepositories(false)
       setCloneRepoDialogOpen(false)  // Close clone dialog, success modal will show
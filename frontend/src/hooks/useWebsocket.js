@@ -1,4 +1,4 @@
-import { useMemo } from "react"
+import { useCallback, useEffect, useMemo, useRef } from "react"
 import useWebSocket from "react-use-websocket"
 
 export function useWebsocket(sessionId, token) {
@@ -19,8 +19,23 @@ export function useWebsocket(sessionId, token) {
         // If no token provided, rely on cookie (browser sends it automatically)
         return `${wsProtocol}//${wsHost}/agent/stream/${sessionId}`
     }, [sessionId, token]) // Only recalculate when sessionId or token changes
+
+    // Last event received from the current run, so a reconnect resumes it instead of losing output
+    const resumeRef = useRef(null)
+    useEffect(() => {
+        resumeRef.current = null
+    }, [sessionId])
+
+    const getSocketUrl = useCallback(() => {
+        const resume = resumeRef.current
+        if (!socketUrl || !resume) {
+            return socketUrl
+        }
+        const separator = socketUrl.includes('?') ? '&' : '?'
+        return `${socketUrl}${separator}run_id=${resume.runId}&last_event_id=${resume.eventId}`
+    }, [socketUrl])
     
-    const { sendMessage, lastMessage, readyState } = useWebSocket(socketUrl, {
+    const { sendMessage, lastMessage, readyState } = useWebSocket(socketUrl ? getSocketUrl : null, {
         onOpen: (event) => {
             console.log('WebSocket connection opened:', event)
         },
@@ -32,6 +47,23 @@ export function useWebsocket(sessionId, token) {
         reconnectAttempts: 5,
     })
 
+    useEffect(() => {
+        if (!lastMessage) {
+            return
+        }
+        try {
+            const data = JSON.parse(lastMessage.data)
+            if (data.type === 'run_finished') {
+                // Nothing left to resume; reconnect without replaying this run
+                resumeRef.current = null
+            } else if (data.run_id && data.event_id) {
+                resumeRef.current = { runId: data.run_id, eventId: data.event_id }
+            }
+        } catch {
+            // Not JSON, nothing to resume from
+        }
+    }, [lastMessage])
+
     return {
         sendMessage,
         lastMessage,